@@ -1,86 +1,100 @@
 import streamlit as st
 from dotenv import load_dotenv
 import os
-from load_and_split import process_pdf
-from langchain_openai import OpenAIEmbeddings, ChatOpenAI
-from langchain_community.vectorstores import FAISS
-from langchain.chains import RetrievalQA
-from utils import save_faiss_index, load_faiss_index
+import uuid
+from client import API_URL, get_client
+from shared import BOOKS_DIR
+import metrics
 from summarizer import generate_summary
 from flashcard import generate_flashcard
 
 # --- Load environment and configs ---
 load_dotenv()
-openai_key = os.getenv("OPENAI_API_KEY")
-
-BOOKS_DIR = "books"         # Permanent PDFs
-INDEX_DIR = "faiss_index"   # FAISS store path
 
 st.set_page_config(page_title="📚 Student Study Agent", layout="wide")
 st.title("📚 Student Study Agent")
 
 # --- Ensure folders exist ---
-os.makedirs(BOOKS_DIR, exist_ok=True)
-
-# --- Initialize embeddings ---
-embedding = OpenAIEmbeddings(
-    openai_api_key=openai_key,
-)
-
-# --- Load or create vectorstore ---
-vectorstore = None
-
-if os.path.exists(INDEX_DIR) and os.listdir(INDEX_DIR):
-    with st.spinner("🔄 Loading your knowledge base..."):
+if not API_URL:
+    os.makedirs(BOOKS_DIR, exist_ok=True)
+
+# uploads are private to the browser session that made them
+session_id = st.session_state.setdefault("session_id", uuid.uuid4().hex)
+
+# in-process core by default; the HTTP service when STUDY_API_URL is set (see client.py)
+client = get_client(session_id)
+
+# --- Sync index with books/ folder, then load it ---
+# Only new or changed PDFs are embedded; see indexer.sync_books. Synced once
+# per browser session (and on request), not on every rerun: with the HTTP
+# client each sync is a POST /sync that takes a service slot.
+resync = st.sidebar.button("🔄 Re-sync books/ folder")
+if resync or "synced" not in st.session_state:
+    st.session_state.synced = True
+    with st.spinner("📖 Syncing memory with books/ folder..."):
         try:
-            vectorstore = load_faiss_index(openai_key, INDEX_DIR)
-            st.success("✅ Loaded existing study memory.")
+            report = client.sync(on_progress=st.write)
+            if report and report["changed"]:
+                st.success(
+                    f"✅ Knowledge base updated: {len(report['added'])} added, {len(report['updated'])} changed, "
+                    f"{len(report['removed'])} removed ({report['chunks_added']} chunks embedded in "
+                    f"{report['seconds']:.1f}s, {report['chunks_per_second']:.1f} chunks/s)."
+                )
+            for name, error in (report["failed"].items() if report else []):
+                st.warning(f"⚠️ Skipped {name}: {error}")
         except Exception as e:
-            st.error(f"❌ Failed to load FAISS index: {e}")
-else:
-    with st.spinner("📖 Creating memory from books/ folder..."):
-        all_docs = []
-        for filename in os.listdir(BOOKS_DIR):
-            if filename.endswith(".pdf"):
-                file_path = os.path.join(BOOKS_DIR, filename)
-                st.write(f"Processing: {filename}")
-                docs = process_pdf(file_path)
-                all_docs.extend(docs)
-
-        if all_docs:
-            vectorstore = FAISS.from_documents(all_docs, embedding)
-            save_faiss_index(vectorstore, INDEX_DIR)
-            st.success("✅ Knowledge base created from books.")
+            st.error(f"❌ Failed to sync books/ folder: {e}")
+
+names = None
+with st.spinner("🔄 Loading your knowledge base..."):
+    try:
+        names = client.books()
+        if names:
+            st.success(f"✅ Loaded existing study memory ({len(names)} books).")
         else:
             st.warning("⚠️ No PDFs found in books/ folder.")
-            vectorstore = None
+    except Exception as e:
+        st.error(f"❌ Failed to load FAISS index: {e}")
 
 # --- PDF Upload (temporary) ---
 uploaded_file = st.file_uploader("📄 Upload a study PDF (temporary)", type="pdf")
 
-if uploaded_file:
+if uploaded_file and names is not None:
     with st.spinner("Processing uploaded file..."):
-            docs, load_time = process_pdf(uploaded_file)
-            if docs:
-                vectorstore.add_documents(docs)
-                st.success(f"✅ {len(docs)} chunks loaded in {load_time:.2f} seconds.")
-            else:
-                st.error("❌ Failed to extract content from uploaded file.")
+        # embedded once per distinct file; later reruns just re-attach the shard
+        try:
+            result = client.upload(uploaded_file.name, uploaded_file.getvalue())
+            if result["built"]:
+                st.success(f"✅ {result['name']} loaded in {result['seconds']:.2f} seconds.")
+            names = client.books()
+        except Exception as e:
+            st.error(f"❌ Failed to extract content from uploaded file: {e}")
 
+# --- Scope: which books to search ---
+scope = None
+if names:
+    picked = st.sidebar.multiselect(
+        "📚 Limit to books", options=list(names), format_func=names.get,
+        help="Leave empty to search all books and uploads.",
+    )
+    scope = picked or None
 
-# --- Q&A Section ---
-if vectorstore:
-    retriever = vectorstore.as_retriever()
-    llm = ChatOpenAI(openai_api_key=openai_key, temperature=0.3)
-    qa_chain = RetrievalQA.from_chain_type(llm=llm, retriever=retriever)
 
+# --- Q&A Section ---
+if names:
     question = st.text_input("🧠 Ask a study question")
 
     if question:
-        with st.spinner("Thinking..."):
-            response = qa_chain.invoke(question)
+        with st.spinner("Thinking..."), metrics.span("qa.request"):
+            # cached answers come back as a string, fresh ones are streamed token by token
+            answer, _sources = client.ask(question, scope=scope, stream=True)
             st.markdown("### ✅ Answer")
-            st.write(response["result"])
+            if isinstance(answer, str):
+                st.write(answer)
+            else:
+                with metrics.span("qa.render"):
+                    st.write_stream(answer)
+                st.caption(f"First token after {answer.ttft or 0:.2f}s")
 else:
     st.info("Upload a PDF or place one in the 'books/' folder to get started.")
 
@@ -89,11 +103,47 @@ st.markdown("---")
 # --- Comprehensive Summarizer (drop-in replacement) ---
 st.subheader("📝 Summarize a Topic")
 
-generate_summary(vectorstore)
+generate_summary(client if names else None, scope)
 
 
 st.markdown("---")
 # --- Flashcards (Anki-style reveal) ---
 st.subheader("🧠 Generate Flashcards")
 
-generate_flashcard(vectorstore)
+generate_flashcard(client if names else None, scope)
+
+
+# --- Resource metrics ---
+# from wherever the work runs: this process, or the service with STUDY_API_URL
+try:
+    diag = client.diagnostics()
+except Exception as e:
+    diag = {}
+    st.sidebar.caption(f"Metrics unavailable: {e}")
+
+with st.sidebar.expander("⚙️ Resource metrics"):
+    if diag:
+        st.json({"gauges": diag["gauges"], "counters": diag["counters"]})
+    st.caption("This session's uploads")
+    st.json(client.upload_stats())
+
+# --- Diagnostics: where the time went ---
+with st.sidebar.expander("🩺 Diagnostics"):
+    stages = {name[len("stage_"):-len("_seconds")]: t for name, t in diag.get("timings", {}).items()
+              if name.startswith("stage_")}
+    if stages:
+        st.dataframe(
+            [{"stage": name, "count": t["count"], "p50 (s)": round(t["p50"], 3),
+              "p95 (s)": round(t["p95"], 3), "total (s)": round(t["sum"], 2)} for name, t in stages.items()],
+            hide_index=True,
+        )
+    for trace in diag.get("traces", []):
+        depth, lines = {}, []
+        for sp in trace:
+            depth[sp["span_id"]] = depth.get(sp["parent_id"], -1) + 1
+            attrs = ", ".join(f"{k}={v}" for k, v in sp["attrs"].items())
+            lines.append(f"{'  ' * depth[sp['span_id']]}{sp['name']}  {sp['duration'] or 0:.3f}s  {attrs}")
+        st.code("\n".join(lines), language=None)
+    if diag:
+        st.download_button("⬇️ Prometheus metrics", diag["prometheus"], file_name="metrics.prom")
+        st.download_button("⬇️ Trace spans (JSONL)", diag["spans_jsonl"], file_name="spans.jsonl")
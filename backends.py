@@ -0,0 +1,221 @@
+"""
+Embedding and chat backends, selected by configuration:
+
+    STUDY_EMBEDDING_BACKEND = openai | local | fake
+    STUDY_LLM_BACKEND       = openai | fake
+
+`local` runs a sentence-transformers model on CPU (optional dependency).
+`fake` is deterministic and offline, with simulated latency, so ingestion,
+retrieval and the summary/flashcard pipelines can be benchmarked without
+a network or an API bill.
+"""
+import hashlib
+import json
+import math
+import os
+import re
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from langchain_core.callbacks import CallbackManagerForLLMRun
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+EMBEDDING_BACKEND = os.getenv("STUDY_EMBEDDING_BACKEND", "openai").lower()
+LLM_BACKEND = os.getenv("STUDY_LLM_BACKEND", "openai").lower()
+EMBEDDING_MODEL = os.getenv("STUDY_EMBEDDING_MODEL")     # backend default when unset
+LLM_MODEL = os.getenv("STUDY_LLM_MODEL")
+LOCAL_EMBEDDING_MODEL = os.getenv("STUDY_LOCAL_EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+FAKE_EMBED_DIM = int(os.getenv("STUDY_FAKE_EMBED_DIM", "384"))
+# simulated latency: per request, plus per text (embeddings) or per output token (chat)
+FAKE_LATENCY_MS = float(os.getenv("STUDY_FAKE_LATENCY_MS", "0"))
+FAKE_PER_ITEM_MS = float(os.getenv("STUDY_FAKE_PER_ITEM_MS", "0"))
+FAKE_LLM_WORDS = int(os.getenv("STUDY_FAKE_LLM_WORDS", "150"))
+
+_EMBEDDING_BACKENDS: Dict[str, Callable[..., Embeddings]] = {}
+_LLM_BACKENDS: Dict[str, Callable[..., BaseChatModel]] = {}
+
+
+def register_embedding_backend(name: str):
+    def _register(factory):
+        _EMBEDDING_BACKENDS[name] = factory
+        return factory
+    return _register
+
+
+def register_llm_backend(name: str):
+    def _register(factory):
+        _LLM_BACKENDS[name] = factory
+        return factory
+    return _register
+
+
+def make_embedding(backend: Optional[str] = None, **kwargs) -> Embeddings:
+    backend = (backend or EMBEDDING_BACKEND).lower()
+    if backend not in _EMBEDDING_BACKENDS:
+        raise ValueError(f"Unknown embedding backend: {backend!r} (use one of {sorted(_EMBEDDING_BACKENDS)})")
+    return _EMBEDDING_BACKENDS[backend](**kwargs)
+
+
+def make_llm(backend: Optional[str] = None, temperature: float = 0.3, **kwargs) -> BaseChatModel:
+    backend = (backend or LLM_BACKEND).lower()
+    if backend not in _LLM_BACKENDS:
+        raise ValueError(f"Unknown LLM backend: {backend!r} (use one of {sorted(_LLM_BACKENDS)})")
+    return _LLM_BACKENDS[backend](temperature=temperature, **kwargs)
+
+
+def _simulate(seconds: float):
+    if seconds > 0:
+        time.sleep(seconds)
+
+
+# --- OpenAI ---
+@register_embedding_backend("openai")
+def _openai_embedding(model: Optional[str] = None, **kwargs):
+    from langchain_openai import OpenAIEmbeddings
+    model = model or EMBEDDING_MODEL
+    if model:
+        kwargs["model"] = model
+    return OpenAIEmbeddings(openai_api_key=os.getenv("OPENAI_API_KEY"), **kwargs)
+
+
+@register_llm_backend("openai")
+def _openai_llm(temperature: float = 0.3, model: Optional[str] = None, **kwargs):
+    from langchain_openai import ChatOpenAI
+    model = model or LLM_MODEL
+    if model:
+        kwargs["model"] = model
+    return ChatOpenAI(openai_api_key=os.getenv("OPENAI_API_KEY"), temperature=temperature, **kwargs)
+
+
+# --- Local sentence-transformers (CPU) ---
+class LocalSentenceEmbeddings(Embeddings):
+    """sentence-transformers model run in-process; needs `pip install sentence-transformers`."""
+
+    def __init__(self, model: str = LOCAL_EMBEDDING_MODEL, device: str = "cpu", batch_size: int = 32):
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError as e:
+            raise ImportError(
+                "The local embedding backend needs sentence-transformers: pip install sentence-transformers"
+            ) from e
+        self.model = model
+        self.batch_size = batch_size
+        self._model = SentenceTransformer(model, device=device)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors = self._model.encode(list(texts), batch_size=self.batch_size, normalize_embeddings=True)
+        return [v.tolist() for v in vectors]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+@register_embedding_backend("local")
+def _local_embedding(model: Optional[str] = None, **kwargs):
+    return LocalSentenceEmbeddings(model or EMBEDDING_MODEL or LOCAL_EMBEDDING_MODEL, **kwargs)
+
+
+# --- Deterministic fake ---
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+
+class FakeEmbeddings(Embeddings):
+    """
+    Hashed bag-of-words vectors: identical text gives identical vectors and
+    texts sharing words are close, so retrieval quality is meaningful in
+    benchmarks. Sleeps `latency + per_text * len(texts)` seconds per call.
+    """
+
+    def __init__(self, dim: int = FAKE_EMBED_DIM, latency: float = FAKE_LATENCY_MS / 1000,
+                 per_text: float = FAKE_PER_ITEM_MS / 1000):
+        self.dim = dim
+        self.latency = latency
+        self.per_text = per_text
+        self.model = f"fake-bow-{dim}"
+
+    def _vector(self, text: str) -> List[float]:
+        vec = [0.0] * self.dim
+        for word in _WORD_RE.findall(text.lower()):
+            h = int.from_bytes(hashlib.blake2b(word.encode(), digest_size=8).digest(), "little")
+            vec[h % self.dim] += 1.0 if (h >> 32) & 1 else -1.0
+        norm = math.sqrt(sum(x * x for x in vec)) or 1.0
+        return [x / norm for x in vec]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        _simulate(self.latency + self.per_text * len(texts))
+        return [self._vector(t) for t in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+_CONTEXT_RE = re.compile(r'CONTEXT[^\n]*\n\s*"""(.*?)"""', re.DOTALL)
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+")
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Offline chat model: answers extractively from the prompt's CONTEXT block
+    (or the prompt itself), and returns a JSON card list when asked for
+    flashcards. Output is a pure function of the prompt. Sleeps `latency`
+    seconds before the first token and `per_token` per streamed word.
+    """
+
+    temperature: float = 0.0
+    latency: float = FAKE_LATENCY_MS / 1000
+    per_token: float = FAKE_PER_ITEM_MS / 1000
+    words: int = FAKE_LLM_WORDS
+    model_name: str = "fake-chat"
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    def _respond(self, prompt: str) -> str:
+        match = _CONTEXT_RE.search(prompt)
+        source = match.group(1) if match else prompt
+        sentences = [s.strip() for s in _SENTENCE_RE.split(" ".join(source.split())) if len(s.strip()) > 20]
+        if '"question"' in prompt and "JSON" in prompt:
+            wanted = re.search(r"Create (\d+)", prompt)
+            n = int(wanted.group(1)) if wanted else 5
+            cards = [
+                {"question": f"What does the text say about: {s[:60].rstrip('.!?')}?", "answer": s, "source_span": s}
+                for s in sentences[:n]
+            ]
+            return json.dumps(cards)
+        out = " ".join(sentences or [source.strip()]).split()
+        return " ".join(out[: self.words])
+
+    def _prompt_text(self, messages: List[BaseMessage]) -> str:
+        return "\n".join(str(m.content) for m in messages)
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        text = self._respond(self._prompt_text(messages))
+        _simulate(self.latency + self.per_token * len(text.split()))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager: Optional[CallbackManagerForLLMRun] = None,
+                **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        text = self._respond(self._prompt_text(messages))
+        _simulate(self.latency)
+        for i, word in enumerate(text.split(" ")):
+            _simulate(self.per_token)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=word if i == 0 else " " + word))
+            if run_manager:
+                run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+
+
+@register_embedding_backend("fake")
+def _fake_embedding(**kwargs):
+    return FakeEmbeddings(**kwargs)
+
+
+@register_llm_backend("fake")
+def _fake_llm(temperature: float = 0.0, **kwargs):
+    return FakeChatModel(temperature=temperature, **kwargs)
@@ -0,0 +1,245 @@
+"""
+Pre-generate flashcard decks and topic summaries for a whole syllabus.
+
+Topics come from a text file (one per line, '#' comments) searched across
+the library or the --books given, or from each book's own table of contents
+(--toc). Tasks run with bounded parallelism; every finished task is appended
+to a checkpoint in the output folder, so an interrupted run picks up where
+it stopped. Outputs per book (or "library"):
+
+    <out>/<book>/NN-<topic>.tsv     Anki deck (Question<TAB>Answer)
+    <out>/<book>/NN-<topic>.md      summary with its sources
+    <out>/<book>/deck.tsv           every topic's cards in one importable deck
+
+    python batch.py --topics syllabus.txt --out study_out
+    python batch.py --toc --books physiology.pdf --toc-level 2 --kinds cards --jobs 8
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from typing import List, Optional
+
+import metrics
+from core import generate_cards, source_labels, summarize
+from resources import get_library, sync_library
+from shared import BOOKS_DIR, INDEX_DIR, to_anki_tsv
+
+BATCH_JOBS = int(os.getenv("STUDY_BATCH_JOBS", "4"))
+CHECKPOINT_NAME = "checkpoint.jsonl"
+DECK_NAME = "deck.tsv"
+
+
+@dataclass
+class Task:
+    kind: str                 # cards | summary
+    group: str                # output folder: book slug or "library"
+    index: int                # topic position within the group, for file ordering
+    topic: str
+    scope: Optional[List[str]]
+    params: dict
+
+    @property
+    def key(self) -> str:
+        raw = json.dumps([self.kind, self.scope, self.topic, self.params], sort_keys=True)
+        return hashlib.sha1(raw.encode()).hexdigest()
+
+    @property
+    def path(self) -> str:
+        ext = ".tsv" if self.kind == "cards" else ".md"
+        return os.path.join(self.group, f"{self.index:02d}-{_slug(self.topic)}{ext}")
+
+
+def _slug(text: str, limit: int = 60) -> str:
+    return re.sub(r"[^A-Za-z0-9]+", "-", text).strip("-")[:limit].lower() or "topic"
+
+
+def read_topics(path: str) -> List[str]:
+    with open(path, encoding="utf-8") as f:
+        lines = (line.strip() for line in f)
+        return [line for line in lines if line and not line.startswith("#")]
+
+
+def toc_topics(pdf_path: str, max_level: int = 1) -> List[str]:
+    """Outline entries of a PDF up to `max_level`, in reading order, without duplicates."""
+    import fitz
+    with fitz.open(pdf_path) as doc:
+        toc = doc.get_toc(simple=True)
+    seen, topics = set(), []
+    for level, title, _page in toc:
+        title = " ".join(title.split())
+        if level <= max_level and title and title.lower() not in seen:
+            seen.add(title.lower())
+            topics.append(title)
+    return topics
+
+
+def plan_tasks(library, args) -> List[Task]:
+    names = library.shard_names()
+    if args.books:
+        wanted = set(args.books)
+        names = {sid: name for sid, name in names.items() if name in wanted or sid in wanted}
+        missing = wanted - set(names) - set(names.values())
+        if missing:
+            raise SystemExit(f"Not in the library: {', '.join(sorted(missing))}")
+
+    # (group, scope, topics)
+    groups = []
+    if args.toc:
+        for sid, name in names.items():
+            topics = toc_topics(os.path.join(args.books_dir, name), args.toc_level)
+            if not topics:
+                print(f"{name}: no table of contents, skipped", file=sys.stderr)
+            groups.append((_slug(os.path.splitext(name)[0]), [sid], topics))
+    else:
+        scope = sorted(names) if args.books else None
+        groups.append(("library", scope, read_topics(args.topics)))
+
+    cards = {"top_k": args.top_k, "num_cards": args.num_cards}
+    summary = {"top_k": args.summary_top_k, "target_words": args.target_words,
+               "reader_level": args.reader_level, "include_aids": not args.no_aids}
+    tasks = []
+    for group, scope, topics in groups:
+        for i, topic in enumerate(topics, start=1):
+            if "cards" in args.kinds:
+                tasks.append(Task("cards", group, i, topic, scope, cards))
+            if "summary" in args.kinds:
+                tasks.append(Task("summary", group, i, topic, scope, summary))
+    return tasks
+
+
+def load_checkpoint(out_dir: str) -> dict:
+    done = {}
+    path = os.path.join(out_dir, CHECKPOINT_NAME)
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue   # torn last line of an interrupted run
+                done[record["key"]] = record
+    return done
+
+
+def _write(path: str, text: str):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+def run_task(library, task: Task, out_dir: str) -> dict:
+    """Generate one output file; returns its checkpoint record."""
+    start = time.perf_counter()
+    with metrics.span("batch.task", kind=task.kind, topic=task.topic) as sp:
+        if task.kind == "cards":
+            cards = generate_cards(library, task.topic, task.params["top_k"], task.params["num_cards"],
+                                   scope=task.scope)
+            if not cards:
+                raise ValueError("no cards generated")
+            text, count = to_anki_tsv(cards), len(cards)
+        else:
+            summary, docs = summarize(library, task.topic, scope=task.scope, **task.params)
+            sources = "\n".join(f"- **{tag}** — {name}" for tag, name in source_labels(docs))
+            text, count = f"{summary.rstrip()}\n\n---\n\n### Sources\n{sources}\n", len(summary.split())
+        sp.set(items=count)
+    _write(os.path.join(out_dir, task.path), text)
+    return {"key": task.key, "kind": task.kind, "group": task.group, "topic": task.topic, "path": task.path,
+            "items": count, "seconds": time.perf_counter() - start}
+
+
+def write_decks(tasks: List[Task], out_dir: str, done: dict):
+    """Concatenate each group's finished topic decks, in topic order, into one deck.tsv."""
+    for group in dict.fromkeys(t.group for t in tasks if t.kind == "cards"):
+        parts = []
+        for task in tasks:
+            if task.kind == "cards" and task.group == group and task.key in done:
+                with open(os.path.join(out_dir, task.path), encoding="utf-8") as f:
+                    parts.append(f.read())
+        if parts:
+            _write(os.path.join(out_dir, group, DECK_NAME), "".join(parts))
+
+
+def run(library, tasks: List[Task], out_dir: str, jobs: int = BATCH_JOBS) -> dict:
+    os.makedirs(out_dir, exist_ok=True)
+    done = load_checkpoint(out_dir)
+    todo = [t for t in tasks if t.key not in done or not os.path.exists(os.path.join(out_dir, t.path))]
+    print(f"{len(tasks)} tasks, {len(tasks) - len(todo)} already done, running {len(todo)} "
+          f"with {jobs} in parallel", file=sys.stderr)
+
+    lock = threading.Lock()
+    failed = {}
+    start = time.perf_counter()
+    with open(os.path.join(out_dir, CHECKPOINT_NAME), "a", encoding="utf-8") as checkpoint, \
+            ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        futures = {pool.submit(run_task, library, t, out_dir): t for t in todo}
+        for n, future in enumerate(as_completed(futures), start=1):
+            task = futures[future]
+            try:
+                record = future.result()
+            except Exception as e:
+                failed[task.key] = f"{task.kind} '{task.topic}': {e}"
+                metrics.inc("batch_tasks_failed_total")
+                print(f"[{n}/{len(todo)}] FAILED {failed[task.key]}", file=sys.stderr)
+                continue
+            with lock:
+                checkpoint.write(json.dumps(record) + "\n")
+                checkpoint.flush()
+                done[task.key] = record
+            metrics.inc("batch_tasks_done_total")
+            print(f"[{n}/{len(todo)}] {task.path} ({record['items']} {'cards' if task.kind == 'cards' else 'words'}, "
+                  f"{record['seconds']:.1f}s)", file=sys.stderr)
+
+    write_decks(tasks, out_dir, done)
+    return {"tasks": len(tasks), "skipped": len(tasks) - len(todo), "done": len(todo) - len(failed),
+            "failed": list(failed.values()), "seconds": time.perf_counter() - start}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--topics", help="text file with one topic per line")
+    source.add_argument("--toc", action="store_true", help="use each book's table of contents as its topics")
+    parser.add_argument("--books", nargs="+", help="book file names (or shard ids) to restrict to")
+    parser.add_argument("--toc-level", type=int, default=1, help="deepest outline level used as a topic")
+    parser.add_argument("--kinds", default="cards,summary", help="comma-separated: cards, summary")
+    parser.add_argument("--out", default="study_out")
+    parser.add_argument("--jobs", type=int, default=BATCH_JOBS, help="topics generated in parallel")
+    parser.add_argument("--books-dir", default=BOOKS_DIR)
+    parser.add_argument("--index-dir", default=INDEX_DIR)
+    parser.add_argument("--sync", action="store_true", help="sync the index with --books-dir first")
+    parser.add_argument("--top-k", type=int, default=8, help="chunks per flashcard deck")
+    parser.add_argument("--num-cards", type=int, default=10)
+    parser.add_argument("--summary-top-k", type=int, default=8)
+    parser.add_argument("--target-words", type=int, default=1200)
+    parser.add_argument("--reader-level", default="Intermediate", choices=("Beginner", "Intermediate", "Exam-focused"))
+    parser.add_argument("--no-aids", action="store_true", help="summaries without the study-aid sections")
+    args = parser.parse_args(argv)
+    args.kinds = {k.strip() for k in args.kinds.split(",") if k.strip()}
+    if not args.kinds or args.kinds - {"cards", "summary"}:
+        parser.error("--kinds takes cards and/or summary")
+
+    if args.sync:
+        report = sync_library(args.books_dir, args.index_dir, on_progress=lambda m: print(m, file=sys.stderr))
+        if report and report.changed:
+            print(f"Synced: {report.chunks_added} chunks embedded in {report.seconds:.1f}s", file=sys.stderr)
+    library = get_library(args.index_dir)
+    if not library:
+        print(f"No books indexed in {args.index_dir}; run with --sync or start the app first.", file=sys.stderr)
+        return 1
+
+    result = run(library, plan_tasks(library, args), args.out, args.jobs)
+    print(json.dumps(result, indent=2))
+    return 1 if result["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
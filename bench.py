@@ -0,0 +1,257 @@
+"""
+End-to-end benchmark of ingestion, retrieval and generation, runnable offline.
+
+Builds synthetic PDF corpora of increasing size (and optionally runs over a
+folder of real PDFs), then measures each stage with the fake embedding and
+chat backends and their simulated latency:
+
+    parse / chunk      per-file seconds from the parallel ingest
+    embed              chunks/s and tokens/s through the embedding pipeline
+    build / load       shard build and cold-load seconds
+    query              dense, hybrid and reranked retrieval latency percentiles
+    summary            map-reduce summary wall time
+
+Results are written as JSON; --baseline prints the relative change of every
+timing against an earlier run so regressions stand out.
+
+    python bench.py --books 1,4,16 --out bench.json
+    python bench.py --corpus books --llm-latency-ms 300 --baseline bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from backends import FakeChatModel, FakeEmbeddings
+from core import map_reduce_summarize
+from embed_pipeline import TokenRateLimiter, embed_texts
+from embedding_cache import CachedEmbeddings
+from hybrid import HybridRetriever
+from indexer import build_shard, file_sha256, shard_id_for
+from ingest import iter_ingest
+from kvcache import SqliteCache
+from rerank import RERANK_CANDIDATES, RerankRetriever, make_reranker
+from shards import ShardRouter
+
+_TERMS = (
+    "cardiac output stroke volume preload afterload contractility myocardium ventricle atrium "
+    "glomerular filtration nephron tubule aldosterone renin angiotensin sodium potassium "
+    "insulin glucagon glycolysis gluconeogenesis ketone hepatocyte bile enzyme substrate "
+    "alveolus surfactant ventilation perfusion hemoglobin oxygen carbon dioxide acidosis "
+    "neuron synapse dopamine serotonin receptor antagonist agonist clearance half-life dose"
+).split()
+_VERBS = "increases decreases regulates inhibits stimulates depends on determines reflects".split(" ")
+
+
+def _sentence(rng) -> str:
+    a, b, c = rng.sample(_TERMS, 3)
+    return f"{a.capitalize()} {rng.choice(_VERBS)} {b} when {c} changes during normal physiology."
+
+
+def make_pdf(path: str, pages: int, seed: int):
+    """A deterministic textbook-like PDF: a chapter heading and ~20 sentences per page."""
+    import fitz
+    rng = random.Random(seed)
+    doc = fitz.open()
+    for p in range(pages):
+        page = doc.new_page()
+        text = f"Chapter {p + 1} {rng.choice(_TERMS).title()}\n\n" + " ".join(_sentence(rng) for _ in range(20))
+        page.insert_textbox(fitz.Rect(56, 56, 540, 790), text, fontsize=10)
+    doc.save(path)
+    doc.close()
+
+
+def make_corpus(root: str, books: int, pages: int) -> str:
+    os.makedirs(root, exist_ok=True)
+    for i in range(books):
+        make_pdf(os.path.join(root, f"book{i:03d}.pdf"), pages, seed=i)
+    return root
+
+
+def _pct(values, pct) -> float:
+    return float(np.percentile(values, pct)) if values else 0.0
+
+
+def _latency(values) -> dict:
+    ms = [v * 1000 for v in values]
+    return {"p50_ms": _pct(ms, 50), "p95_ms": _pct(ms, 95), "p99_ms": _pct(ms, 99), "mean_ms": float(np.mean(ms))}
+
+
+def run_once(corpus_dir: str, work_dir: str, args) -> dict:
+    """Run every stage over the PDFs in `corpus_dir`; returns the result record."""
+    result = {"corpus": corpus_dir}
+    embedding = CachedEmbeddings(
+        FakeEmbeddings(latency=args.embed_latency_ms / 1000, per_text=args.embed_per_text_ms / 1000),
+        SqliteCache(os.path.join(work_dir, "embeddings.sqlite"), name="bench_embedding_cache"),
+    )
+    llm = FakeChatModel(latency=args.llm_latency_ms / 1000, per_token=args.llm_per_token_ms / 1000)
+
+    # --- parse + chunk ---
+    pdfs = sorted(os.path.join(corpus_dir, n) for n in os.listdir(corpus_dir) if n.lower().endswith(".pdf"))
+    t0 = time.perf_counter()
+    ingested = [r for r in iter_ingest(pdfs, workers=args.workers) if r.ok and r.docs]
+    docs = [d for r in ingested for d in r.docs]
+    result["ingest"] = {
+        "files": len(pdfs),
+        "pages": sum(r.pages for r in ingested),
+        "chunks": len(docs),
+        "wall_seconds": time.perf_counter() - t0,
+        "parse_seconds": sum(r.parse_seconds for r in ingested),
+        "chunk_seconds": sum(r.chunk_seconds for r in ingested),
+    }
+
+    # --- embed (fresh cache, so every chunk is sent) ---
+    _, stats = embed_texts([d.page_content for d in docs], embedding, limiter=TokenRateLimiter(0))
+    result["embed"] = {
+        "chunks": stats.chunks, "tokens": stats.tokens, "batches": stats.batches, "seconds": stats.seconds,
+        "chunks_per_second": stats.chunks_per_second, "tokens_per_second": stats.tokens_per_second,
+    }
+
+    # --- build (vectors now come from the cache) + cold load ---
+    router = ShardRouter(embedding, max_loaded=0)
+    t0 = time.perf_counter()
+    for r in ingested:
+        shard = shard_id_for(r.display_name, file_sha256(r.path))
+        path = os.path.join(work_dir, "shards", shard)
+        build_shard(r.docs, embedding, path)
+        router.add_shard(shard, path, r.display_name, len(r.docs))
+    result["build"] = {"shards": len(ingested), "seconds": time.perf_counter() - t0}
+    t0 = time.perf_counter()
+    router.preload()
+    result["load"] = {"seconds": time.perf_counter() - t0, "memory_bytes": router.memory_bytes()}
+
+    # --- query latency ---
+    rng = random.Random(0)
+    queries = [" ".join(rng.sample(_TERMS, 3)) for _ in range(args.queries)]
+    retriever = HybridRetriever(router=router, k=args.k, fetch_k=max(20, 3 * args.k))
+    candidates = max(RERANK_CANDIDATES, args.k)
+    reranked = RerankRetriever(base=HybridRetriever(router=router, k=candidates, fetch_k=candidates),
+                               scorer=make_reranker(args.reranker), k=args.k)
+    embedding.embed_documents(queries)   # time the search, not the simulated embedding call
+    dense, hybrid, rerank = [], [], []
+    for q in queries:
+        t0 = time.perf_counter()
+        router.similarity_search(q, k=args.k)
+        t1 = time.perf_counter()
+        retriever.invoke(q)
+        t2 = time.perf_counter()
+        reranked.invoke(q)
+        rerank.append(time.perf_counter() - t2)
+        hybrid.append(t2 - t1)
+        dense.append(t1 - t0)
+    result["query"] = {"queries": len(queries), "k": args.k, "dense": _latency(dense), "hybrid": _latency(hybrid),
+                       "rerank": {"scorer": args.reranker, "candidates": candidates, **_latency(rerank)}}
+
+    # --- map-reduce summary under the fake LLM ---
+    topic = queries[0]
+    top = HybridRetriever(router=router, k=args.summary_k, fetch_k=max(20, 3 * args.summary_k)).invoke(topic)
+    t0 = time.perf_counter()
+    summary = map_reduce_summarize(llm, topic, top, 1200, "Intermediate", True)
+    result["summary"] = {"chunks": len(top), "seconds": time.perf_counter() - t0, "words": len(summary.split())}
+    return result
+
+
+def _git_rev() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return ""
+
+
+def _timings(record: dict, prefix: str = ""):
+    # flatten to {"embed.seconds": ...} for every duration-like number
+    for key, value in record.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            yield from _timings(value, name + ".")
+        elif isinstance(value, (int, float)) and (key.endswith("seconds") or key.endswith("_ms")):
+            yield name, float(value)
+
+
+def compare(current: dict, baseline: dict) -> list:
+    """[(run label, metric, baseline, current, relative change)] for runs present in both."""
+    old = {r["label"]: dict(_timings(r)) for r in baseline.get("runs", [])}
+    rows = []
+    for run in current["runs"]:
+        before = old.get(run["label"])
+        if not before:
+            continue
+        for name, value in _timings(run):
+            if before.get(name):
+                rows.append((run["label"], name, before[name], value, value / before[name] - 1))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--books", default="1,4,16", help="synthetic corpus sizes (number of books)")
+    parser.add_argument("--pages", type=int, default=20, help="pages per synthetic book")
+    parser.add_argument("--corpus", action="append", default=[], help="folder of real PDFs (repeatable)")
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--summary-k", type=int, default=12)
+    parser.add_argument("--reranker", default="lexical", help="second-stage scorer timed in the query stage")
+    parser.add_argument("--embed-latency-ms", type=float, default=50)
+    parser.add_argument("--embed-per-text-ms", type=float, default=0.2)
+    parser.add_argument("--llm-latency-ms", type=float, default=200)
+    parser.add_argument("--llm-per-token-ms", type=float, default=0)
+    parser.add_argument("--workdir", help="keep generated corpora and indexes here instead of a temp dir")
+    parser.add_argument("--out", help="write the JSON report here (default: stdout)")
+    parser.add_argument("--baseline", help="earlier JSON report to compare timings against")
+    args = parser.parse_args(argv)
+
+    root = args.workdir or tempfile.mkdtemp(prefix="study-bench-")
+    runs = []
+    try:
+        corpora = [(f"synthetic-{n}x{args.pages}", make_corpus(os.path.join(root, f"corpus-{n}"), n, args.pages))
+                   for n in (int(x) for x in args.books.split(",") if x.strip())]
+        corpora += [(f"corpus:{os.path.basename(os.path.normpath(c))}", c) for c in args.corpus]
+        for label, corpus in corpora:
+            work = os.path.join(root, "work-" + label.replace(":", "-"))
+            shutil.rmtree(work, ignore_errors=True)
+            os.makedirs(work)
+            print(f"Running {label} ...", file=sys.stderr)
+            record = run_once(corpus, work, args)
+            record["label"] = label
+            runs.append(record)
+    finally:
+        if not args.workdir:
+            shutil.rmtree(root, ignore_errors=True)
+
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "git": _git_rev(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "config": {k: v for k, v in vars(args).items() if k not in ("out", "baseline", "workdir")},
+        "runs": runs,
+    }
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            rows = compare(report, json.load(f))
+        for label, name, before, now, change in rows:
+            flag = "  <-- slower" if change > 0.10 else ""
+            print(f"{label:24s} {name:32s} {before:10.4f} -> {now:10.4f} ({change:+.1%}){flag}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,179 @@
+"""
+What the Streamlit app talks to. LocalClient runs the core operations in
+the app's own process; HttpClient (STUDY_API_URL set) sends them to the
+HTTP service, so the UI holds no index or model clients and app workers
+can be scaled separately from the service.
+
+Both return plain data: answers/summaries are a string, or an iterable of
+text pieces with `.text` and `.ttft` once consumed; sources are
+[(label, name)] pairs.
+"""
+import io
+import json
+import os
+import time
+from typing import Iterator, List, Optional
+
+API_URL = os.getenv("STUDY_API_URL")
+API_TIMEOUT = float(os.getenv("STUDY_API_TIMEOUT", "300"))
+
+
+def _report_dict(report) -> Optional[dict]:
+    if report is None:
+        return None
+    return {
+        "changed": report.changed, "added": report.added, "updated": report.updated,
+        "removed": report.removed, "failed": report.failed, "chunks_added": report.chunks_added,
+        "seconds": report.seconds, "chunks_per_second": report.embed.chunks_per_second,
+    }
+
+
+class LocalClient:
+    """Runs core operations in-process against the shared, warm library."""
+
+    def __init__(self, session_id: Optional[str] = None):
+        self.session_id = session_id
+
+    def _library(self):
+        from resources import get_session_library
+        from shared import INDEX_DIR
+        return get_session_library(INDEX_DIR, self.session_id)
+
+    def sync(self, on_progress=None) -> Optional[dict]:
+        from resources import sync_library
+        from shared import BOOKS_DIR, INDEX_DIR
+        return _report_dict(sync_library(BOOKS_DIR, INDEX_DIR, on_progress=on_progress))
+
+    def books(self) -> dict:
+        return self._library().shard_names()
+
+    def upload(self, name: str, data: bytes) -> dict:
+        from resources import get_uploads
+        buf = io.BytesIO(data)
+        buf.name = name
+        return get_uploads().add_upload(self.session_id, buf)
+
+    def upload_stats(self) -> dict:
+        from resources import get_uploads
+        return get_uploads().session_stats(self.session_id)
+
+    def ask(self, question: str, scope: Optional[List[str]] = None, stream: bool = False):
+        from core import answer_question, source_labels
+        answer, docs = answer_question(self._library(), question, scope=scope, stream=stream)
+        return answer, source_labels(docs)
+
+    def summarize(self, topic: str, top_k: int, target_words: int, reader_level: str, include_aids: bool,
+                  scope: Optional[List[str]] = None, stream: bool = False):
+        from core import source_labels, summarize
+        summary, docs = summarize(self._library(), topic, top_k, target_words, reader_level, include_aids,
+                                  scope=scope, stream=stream)
+        return summary, source_labels(docs)
+
+    def cards(self, topic: str, top_k: int, num_cards: int, scope: Optional[List[str]] = None) -> List[dict]:
+        from core import generate_cards
+        return generate_cards(self._library(), topic, top_k, num_cards, scope=scope)
+
+    def diagnostics(self) -> dict:
+        import metrics
+        return metrics.diagnostics()
+
+
+class RemoteStream:
+    """Text pieces of a streamed service response (NDJSON), with `text` and `ttft` like TokenStream."""
+
+    def __init__(self, lines: Iterator[str], start: float):
+        self._lines = lines
+        self._start = start
+        self.text = ""
+        self.ttft = None
+
+    def __iter__(self):
+        parts = []
+        for line in self._lines:
+            event = json.loads(line)
+            if "error" in event:
+                raise RuntimeError(event["error"])
+            piece = event.get("delta")
+            if not piece:
+                continue
+            if self.ttft is None:
+                self.ttft = time.perf_counter() - self._start
+            parts.append(piece)
+            yield piece
+        self.text = "".join(parts)
+
+
+class HttpClient:
+    """Same interface as LocalClient, over the JSON API in service.py."""
+
+    def __init__(self, base_url: str = API_URL, session_id: Optional[str] = None):
+        import httpx
+        self.session_id = session_id
+        self._http = httpx.Client(base_url=base_url.rstrip("/"), timeout=API_TIMEOUT)
+
+    def _post(self, path: str, payload: dict) -> dict:
+        resp = self._http.post(path, json={**payload, "session_id": self.session_id})
+        resp.raise_for_status()
+        return resp.json()
+
+    def _stream(self, path: str, payload: dict):
+        # returns (RemoteStream, sources); the sources event comes first
+        start = time.perf_counter()
+        request = self._http.build_request("POST", path, json={**payload, "session_id": self.session_id,
+                                                               "stream": True})
+        resp = self._http.send(request, stream=True)
+        resp.raise_for_status()
+        lines = (line for line in resp.iter_lines() if line)
+        first = json.loads(next(lines))
+        if "error" in first:
+            raise RuntimeError(first["error"])
+        return RemoteStream(lines, start), [tuple(s) for s in first.get("sources", [])]
+
+    def sync(self, on_progress=None) -> Optional[dict]:
+        return self._post("/sync", {})
+
+    def books(self) -> dict:
+        resp = self._http.get("/books", params={"session_id": self.session_id})
+        resp.raise_for_status()
+        return resp.json()["books"]
+
+    def upload(self, name: str, data: bytes) -> dict:
+        resp = self._http.post("/uploads", params={"session_id": self.session_id, "name": name}, content=data,
+                               headers={"Content-Type": "application/pdf"})
+        resp.raise_for_status()
+        return resp.json()
+
+    def upload_stats(self) -> dict:
+        resp = self._http.get("/uploads", params={"session_id": self.session_id})
+        resp.raise_for_status()
+        return resp.json()
+
+    def ask(self, question: str, scope: Optional[List[str]] = None, stream: bool = False):
+        payload = {"question": question, "books": scope}
+        if stream:
+            return self._stream("/qa", payload)
+        data = self._post("/qa", payload)
+        return data["answer"], [tuple(s) for s in data["sources"]]
+
+    def summarize(self, topic: str, top_k: int, target_words: int, reader_level: str, include_aids: bool,
+                  scope: Optional[List[str]] = None, stream: bool = False):
+        payload = {"topic": topic, "top_k": top_k, "target_words": target_words,
+                   "reader_level": reader_level, "include_aids": include_aids, "books": scope}
+        if stream:
+            return self._stream("/summarize", payload)
+        data = self._post("/summarize", payload)
+        return data["summary"], [tuple(s) for s in data["sources"]]
+
+    def cards(self, topic: str, top_k: int, num_cards: int, scope: Optional[List[str]] = None) -> List[dict]:
+        return self._post("/flashcards", {"topic": topic, "top_k": top_k, "num_cards": num_cards,
+                                          "books": scope})["cards"]
+
+    def diagnostics(self) -> dict:
+        # the work happens in the service, so that is where its metrics and traces are
+        resp = self._http.get("/diagnostics")
+        resp.raise_for_status()
+        return resp.json()
+
+
+def get_client(session_id: Optional[str] = None):
+    return HttpClient(API_URL, session_id) if API_URL else LocalClient(session_id)
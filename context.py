@@ -0,0 +1,138 @@
+"""
+Prompt context assembly: count tokens, drop near-duplicate chunks and pack
+the most relevant distinct chunks into a token budget.
+
+Retrieved chunks arrive in relevance order and often repeat each other
+(overlapping windows, the same passage in two editions). Near-duplicates
+are detected with 64-bit SimHash over word 3-grams; the first (more
+relevant) copy is kept. Packing then fills the budget greedily in relevance
+order, skipping chunks that no longer fit.
+"""
+import hashlib
+import os
+import re
+import threading
+from dataclasses import dataclass, field
+from typing import Optional
+
+import metrics
+
+# token budget for one prompt's context (Q&A, flashcards, single-pass summaries);
+# summaries whose distinct context exceeds it go through map-reduce instead
+CONTEXT_TOKENS = int(os.getenv("STUDY_CONTEXT_TOKENS", "4000"))
+# SimHash bits that may differ for two chunks to count as duplicates
+DEDUP_MAX_DISTANCE = int(os.getenv("STUDY_DEDUP_MAX_DISTANCE", "3"))
+
+# context windows of the chat models in use; unknown models get the smallest
+MODEL_CONTEXT_WINDOWS = {
+    "gpt-4o": 128000, "gpt-4o-mini": 128000, "gpt-4.1": 1000000, "gpt-4.1-mini": 1000000,
+    "gpt-4-turbo": 128000, "gpt-4": 8192, "gpt-3.5-turbo": 16385,
+}
+DEFAULT_CONTEXT_WINDOW = 8192
+
+_encoders = {}
+_encoders_lock = threading.Lock()
+
+
+def _encoder(model: Optional[str]):
+    # tiktoken downloads its tables on first use; without them we fall back to an estimate
+    key = model or "cl100k_base"
+    with _encoders_lock:
+        if key not in _encoders:
+            try:
+                import tiktoken
+                try:
+                    _encoders[key] = tiktoken.encoding_for_model(model) if model else tiktoken.get_encoding(key)
+                except KeyError:
+                    _encoders[key] = tiktoken.get_encoding("cl100k_base")
+            except Exception:
+                _encoders[key] = None
+        return _encoders[key]
+
+
+def count_tokens(text: str, model: Optional[str] = None) -> int:
+    """Tokens of `text` for `model` (tiktoken), or ~4 chars per token when no tokenizer is available."""
+    enc = _encoder(model)
+    if enc is None:
+        return len(text) // 4 + 1
+    return len(enc.encode(text, disallowed_special=()))
+
+
+def context_window(model: Optional[str]) -> int:
+    name = (model or "").lower()
+    # longest matching prefix, so "gpt-4o-mini-2024-07-18" finds "gpt-4o-mini"
+    matches = [m for m in MODEL_CONTEXT_WINDOWS if name.startswith(m)]
+    return MODEL_CONTEXT_WINDOWS[max(matches, key=len)] if matches else DEFAULT_CONTEXT_WINDOW
+
+
+def context_budget(model: Optional[str] = None, reserve: int = 0, budget: int = CONTEXT_TOKENS) -> int:
+    """`budget`, capped so that the context plus `reserve` tokens (prompt + answer) fit the model's window."""
+    return max(256, min(budget, context_window(model) - reserve))
+
+
+# --- Near-duplicate detection ---
+_WORD_RE = re.compile(r"\w+")
+
+
+def simhash(text: str, n: int = 3) -> int:
+    words = _WORD_RE.findall(text.lower())
+    grams = [" ".join(words[i:i + n]) for i in range(max(1, len(words) - n + 1))]
+    weights = [0] * 64
+    for gram in grams:
+        h = int.from_bytes(hashlib.blake2b(gram.encode(), digest_size=8).digest(), "little")
+        for bit in range(64):
+            weights[bit] += 1 if (h >> bit) & 1 else -1
+    return sum(1 << bit for bit in range(64) if weights[bit] > 0)
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+def dedupe(docs, max_distance: int = DEDUP_MAX_DISTANCE):
+    """(distinct docs in input order, number dropped as near-duplicates of an earlier doc)."""
+    kept, hashes = [], []
+    for doc in docs:
+        h = simhash(doc.page_content)
+        if any(hamming(h, other) <= max_distance for other in hashes):
+            continue
+        kept.append(doc)
+        hashes.append(h)
+    return kept, len(docs) - len(kept)
+
+
+# --- Packing ---
+@dataclass
+class PackedContext:
+    docs: list                                  # chunks in the prompt, relevance order
+    distinct: list                              # every non-duplicate chunk, relevance order
+    tokens: int = 0                             # tokens of `docs`
+    duplicates: int = 0                         # dropped as near-duplicates
+    overflow: list = field(default_factory=list)   # distinct chunks that did not fit
+
+    @property
+    def text(self) -> str:
+        return "\n\n".join(d.page_content for d in self.docs)
+
+    @property
+    def fits(self) -> bool:
+        return not self.overflow
+
+
+def pack(docs, budget: int = CONTEXT_TOKENS, model: Optional[str] = None,
+         max_distance: int = DEDUP_MAX_DISTANCE) -> PackedContext:
+    """Drop near-duplicates, then keep the most relevant chunks whose tokens fit in `budget`."""
+    with metrics.span("context.pack", chunks=len(docs), budget=budget) as sp:
+        distinct, duplicates = dedupe(docs, max_distance)
+        packed = PackedContext(docs=[], distinct=distinct, duplicates=duplicates)
+        for doc in distinct:
+            cost = count_tokens(doc.page_content, model) + 1   # + the blank-line separator
+            if packed.tokens + cost <= budget:
+                packed.docs.append(doc)
+                packed.tokens += cost
+            else:
+                packed.overflow.append(doc)
+        sp.set(kept=len(packed.docs), tokens=packed.tokens, duplicates=duplicates, overflow=len(packed.overflow))
+    metrics.inc("context_duplicates_dropped_total", duplicates)
+    metrics.inc("context_tokens_total", packed.tokens)
+    return packed
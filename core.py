@@ -0,0 +1,516 @@
+"""
+UI-free study operations: Q&A, topic summaries and flashcard decks over a
+library (ShardRouter / ShardGroup). Used by the Streamlit app, the HTTP
+service (service.py) and the batch tools; nothing here imports Streamlit.
+"""
+import math
+import os
+import time
+from typing import List, Optional
+
+import numpy as np
+from langchain.chains.question_answering.stuff_prompt import PROMPT_SELECTOR
+
+import metrics
+from context import context_budget, count_tokens, pack
+from digest_store import prompt_version
+from json_stream import ObjectStream
+from llm_exec import TokenStream, content_of, map_invoke, map_stream
+from resources import get_digest_store, get_embedding, get_llm, get_response_cache, get_retriever, llm_model_name
+from response_cache import doc_key
+
+# Max (estimated) tokens of digests fed into one reduce call; above this the
+# digests are merged level by level into intermediate syntheses first.
+REDUCE_TOKEN_BUDGET = int(os.getenv("STUDY_REDUCE_TOKEN_BUDGET", "12000"))
+REDUCE_MAX_LEVELS = 4
+# tokens kept free next to the packed context for the prompt template and the answer
+QA_RESERVE_TOKENS = 1500
+CARD_RESERVE_TOKENS = 1000      # plus ~80 per requested card
+# flashcards: cards asked of one LLM call, extra share requested when sharded, per-call time limit
+CARDS_PER_CALL = int(os.getenv("STUDY_CARDS_PER_CALL", "10"))
+CARDS_OVERGENERATE = float(os.getenv("STUDY_CARDS_OVERGENERATE", "0.2"))
+CARDS_TIMEOUT = float(os.getenv("STUDY_CARDS_TIMEOUT", "120"))
+# cosine similarity of two cards' questions above which the later card is dropped
+CARD_DEDUP_SIMILARITY = float(os.getenv("STUDY_CARD_DEDUP_SIMILARITY", "0.92"))
+
+
+def _cached_lookup(kind: str, query: str, docs, params: Optional[dict] = None):
+    # (cached response or None, query vector, chunk ids) for the semantic response cache
+    query_vec = get_embedding().embed_query(query)
+    chunk_ids = [doc_key(d) for d in docs]
+    return get_response_cache().lookup(kind, query_vec, chunk_ids, params), query_vec, chunk_ids
+
+
+# --- Q&A ---
+def answer_question(library, question: str, scope: Optional[List[str]] = None, k: int = 4,
+                    stream: bool = False, llm=None):
+    """
+    Answer `question` from the distinct top-k chunks that fit the context
+    budget, with the "stuff" prompt RetrievalQA uses. Returns (answer, docs); with stream=True a cache miss returns a
+    TokenStream instead of a string, cached once it has been consumed.
+    """
+    llm = llm or get_llm(temperature=0.3)
+    model = llm_model_name(llm)
+    # Retrieve first so near-identical questions over the same chunks hit the cache
+    docs = get_retriever(library, k=k, shard_ids=scope).invoke(question)
+    context = pack(docs, context_budget(model, reserve=QA_RESERVE_TOKENS), model)
+    docs = context.docs
+    cached, query_vec, chunk_ids = _cached_lookup("qa", question, docs)
+    if cached is not None:
+        return cached, docs
+
+    messages = PROMPT_SELECTOR.get_prompt(llm).format_messages(context=context.text, question=question)
+    def store(text):
+        get_response_cache().store("qa", query_vec, chunk_ids, None, text)
+
+    if stream:
+        return TokenStream(llm, messages, metric="qa", on_complete=store), docs
+    answer = content_of(llm.invoke(messages))
+    store(answer)
+    return answer, docs
+
+
+# --- Summaries ---
+def _shield(text: str) -> str:
+
+    # Avoid backtick confusion inside prompts
+    return (text or "").replace("```", "\\`\\`\\`")
+
+
+def _chunk_digest_prompt(text: str) -> str:
+    return f"""
+    You are creating a structured digest from a textbook excerpt for later synthesis.
+
+    Return Markdown only with these sections (no extra commentary):
+    ### Section Candidates
+    - (Proposed section title): 1–2 lines describing focus
+
+    ### Salient Points
+    - 6–12 bullets of the most important facts, mechanisms, definitions, steps
+
+    ### Key Terms
+    - term — 1-line definition
+
+    ### Data/Formulae (if any)
+    - concise list of equations, numeric ranges, rules
+
+    ### Misconceptions (if any)
+    - common confusion — correction
+
+    EXCERPT:
+    \"\"\"{_shield(text)}\"\"\"""".strip()
+
+
+def _final_summary_prompt(topic: str, combined_digests: str, target_words: int, reader_level: str, include_aids: bool) -> str:
+    aids_block = """
+    Include, after the detailed summary, these study aids:
+
+    **Key Terms & Definitions** — thorough list.
+    **Important Tables / Formulae / Ranges** — Markdown tables if useful.
+    **Common Pitfalls & Misconceptions** — with corrections.
+    **Mini Q&A (5–8)** — exam-style questions with brief answers.
+    **Memory Hooks** — short mnemonics if natural.
+    """.strip() if include_aids else ""
+
+    return f"""
+    You are a meticulous medical textbook summarizer. Produce a **comprehensive, structured Markdown** summary of the TOPIC below,
+    synthesizing all information from the digests provided. Aim for ~{target_words} words (ok to exceed if needed for completeness).
+    Audience: **{reader_level}**.
+
+    Constraints & Style:
+    - Be **faithful** to the digests (no external facts).
+    - Organize with clear H2/H3 headings mirroring the topic's natural structure.
+    - Use paragraphs (not just bullets). Add bullets or tables where appropriate.
+    - Cover **all major sections** and how they connect; explain mechanisms and implications.
+    - Prefer clarity and completeness over brevity.
+
+    Output format (Markdown only):
+    # {topic}
+    ## Executive Overview
+    (2–4 paragraphs that set the whole picture and why it matters)
+
+    ## Detailed Outline
+    (Numbered list of the main sections you will cover)
+
+    ## Deep Dive
+    (For each section: 2–6 paragraphs with subheadings, examples, edge cases, comparisons as relevant)
+
+    ## Applications / Clinical or Practical Relevance (if applicable)
+
+    {aids_block}
+
+    ### Sources Used
+    (List the source labels S1, S2... provided below)
+
+    INPUT DIGESTS (S1..Sn, do not copy verbatim—synthesize):
+    {combined_digests}
+    """.strip()
+
+
+def _intermediate_prompt(topic: str, combined_digests: str) -> str:
+    return f"""
+    You are merging several digests of textbook excerpts about the TOPIC into ONE consolidated digest
+    that will later be synthesized into a final summary.
+
+    Rules:
+    - Keep every distinct fact, mechanism, definition, number and misconception; merge duplicates.
+    - After each bullet, cite the source labels it came from in square brackets, e.g. [S3] or [S2, S7].
+      Only use labels that appear in the input.
+    - No external facts, no introduction or conclusion.
+
+    Return Markdown only with these sections:
+    ### Section Candidates
+    ### Salient Points
+    ### Key Terms
+    ### Data/Formulae (if any)
+    ### Misconceptions (if any)
+
+    TOPIC:
+    \"\"\"{_shield(topic)}\"\"\"
+
+    INPUT DIGESTS:
+    {combined_digests}
+    """.strip()
+
+
+def _single_pass_prompt(topic: str, context: str, target_words: int, reader_level: str, include_aids: bool) -> str:
+    aids_block = """
+    Also include, after the deep dive:
+    - Key Terms & Definitions
+    - Important Tables / Formulae / Ranges
+    - Common Pitfalls & Misconceptions
+    - Mini Q&A (5–8) with brief answers
+    - Memory Hooks (mnemonics, if natural)
+    """.strip() if include_aids else ""
+
+    return f"""
+    Summarize the TOPIC comprehensively from the CONTEXT. Target ~{target_words} words (ok to exceed for completeness).
+    Audience: **{reader_level}**.
+
+    Write **structured Markdown** with:
+    # {topic}
+    ## Executive Overview
+    ## Detailed Outline
+    ## Deep Dive (sectioned, multi-paragraph)
+    ## Applications / Clinical or Practical Relevance (if any)
+    {aids_block}
+
+    Rules:
+    - Ground strictly in the CONTEXT (no outside facts).
+    - Be detailed and explanatory, not terse.
+    - Use headings, paragraphs, and well-placed bullets/tables.
+
+    TOPIC:
+    \"\"\"{_shield(topic)}\"\"\"\n
+    CONTEXT:
+    \"\"\"{_shield(context)}\"\"\"""".strip()
+
+
+def source_labels(docs):
+    labels = []
+    for i, d in enumerate(docs, start=1):
+        meta = getattr(d, "metadata", {}) or {}
+
+        # 1. Try to get the file name
+        name = (
+            meta.get("source")
+            or meta.get("file_path")
+            or meta.get("title")
+            or f"Document {i}"
+        )
+
+        # 2. Add page number if available
+        page = meta.get("page")
+        if page is not None:
+            name = f"{name} (Page {page})"
+
+        # 3. Add a text snippet for clarity
+        snippet = d.page_content[:60].replace("\n", " ")
+        if snippet:
+            name = f"{name}: \"{snippet}...\""
+
+        labels.append((f"S{i}", name))
+    return labels
+
+
+def _label_block(labels, text: str, kind: str = "Digest") -> str:
+    return f"---\n**[{', '.join(labels)}] {kind}**\n\n{text}"
+
+
+def _group_by_budget(items, budget: int):
+    # Consecutive groups whose blocks fit the budget (at least one item each)
+    groups, current, used = [], [], 0
+    for labels, text in items:
+        cost = count_tokens(_label_block(labels, text))
+        if current and used + cost > budget:
+            groups.append(current)
+            current, used = [], 0
+        current.append((labels, text))
+        used += cost
+    if current:
+        groups.append(current)
+    return groups
+
+
+def _tree_reduce(llm, topic: str, items, budget: int):
+    """
+    Merge (labels, digest) items level by level until they fit one reduce
+    call. Each level combines budget-sized groups in parallel; the merged
+    item carries the union of its inputs' S-labels, and the prompt asks the
+    model to keep per-bullet [S#] citations.
+    """
+    for _ in range(REDUCE_MAX_LEVELS):
+        total = sum(count_tokens(_label_block(l, t)) for l, t in items)
+        if total <= budget or len(items) <= 1:
+            break
+        groups = _group_by_budget(items, budget)
+        if len(groups) == len(items):
+            # every item alone fills the budget; merge in pairs to make progress
+            groups = [items[i:i + 2] for i in range(0, len(items), 2)]
+        to_merge = [g for g in groups if len(g) > 1]
+        merged = map_invoke(llm, [
+            _intermediate_prompt(topic, "\n\n".join(_label_block(l, t) for l, t in g))
+            for g in to_merge
+        ])
+        merged_iter = iter(merged)
+        next_items = []
+        for g in groups:
+            if len(g) == 1:
+                next_items.append(g[0])
+            else:
+                labels = [label for l, _ in g for label in l]
+                next_items.append((labels, next(merged_iter)))
+        items = next_items
+    return items
+
+
+def map_reduce_summarize(llm, topic: str, docs, target_words: int, reader_level: str, include_aids: bool,
+                         stream: bool = False, digest_store=None):
+    # Map step: per-chunk digests, run concurrently; order matches docs (S1..Sn).
+    # Digests depend only on the chunk text, so previously seen chunks come from the store.
+    texts = [d.page_content for d in docs]
+
+    def compute(batch):
+        return map_invoke(llm, [_chunk_digest_prompt(t) for t in batch])
+
+    with metrics.span("summary.map", chunks=len(texts)):
+        if digest_store is None:
+            digests = compute(texts)
+        else:
+            digests = digest_store.get_or_compute(
+                texts, prompt_version(_chunk_digest_prompt("")), llm_model_name(llm), compute
+            )
+
+    # Label digests as S1..Sn, merging them hierarchically if they exceed one call's budget
+    items = [([f"S{i}"], dig) for i, dig in enumerate(digests, start=1)]
+    with metrics.span("summary.reduce", digests=len(items)) as sp:
+        items = _tree_reduce(llm, topic, items, REDUCE_TOKEN_BUDGET)
+        sp.set(blocks=len(items))
+    labeled = [
+        _label_block(labels, text, "Digest" if len(labels) == 1 else "Synthesis")
+        for labels, text in items
+    ]
+    combined = "\n\n".join(labeled)
+
+    # Reduce step: synthesize final comprehensive summary
+    final_prompt = _final_summary_prompt(topic, combined, target_words, reader_level, include_aids)
+    if stream:
+        return TokenStream(llm, final_prompt, metric="summary")
+    with metrics.span("summary.final"):
+        final_resp = llm.invoke(final_prompt)
+    return final_resp.content if hasattr(final_resp, "content") else str(final_resp)
+
+
+def single_pass_summarize(llm, topic: str, docs, target_words: int, reader_level: str, include_aids: bool,
+                          stream: bool = False):
+    context = "\n\n".join([d.page_content for d in docs])
+    prompt = _single_pass_prompt(topic, context, target_words, reader_level, include_aids)
+    if stream:
+        return TokenStream(llm, prompt, metric="summary")
+    resp = llm.invoke(prompt)
+    return resp.content if hasattr(resp, "content") else str(resp)
+
+
+def plan_summary(llm, docs, target_words: int):
+    """
+    ("single", docs) when the distinct chunks fit one call's context budget,
+    else ("map_reduce", docs) over every distinct chunk. Near-duplicates are
+    dropped either way.
+    """
+    model = llm_model_name(llm)
+    # the answer and the prompt template need room next to the context
+    reserve = int(target_words * 1.4) + 1000
+    context = pack(docs, context_budget(model, reserve=reserve), model)
+    if context.fits:
+        return "single", context.docs
+    return "map_reduce", context.distinct
+
+
+def summarize(library, topic: str, top_k: int = 8, target_words: int = 1200, reader_level: str = "Intermediate",
+              include_aids: bool = True, scope: Optional[List[str]] = None, stream: bool = False, llm=None):
+    """
+    Returns (summary, docs). With stream=True a cache miss returns a
+    TokenStream for the final generation instead of a string; the result
+    is cached once the stream has been consumed.
+    """
+    llm = llm or get_llm(temperature=0.3)
+    docs = get_retriever(library, k=top_k, shard_ids=scope, rerank=True).invoke(topic)[:top_k]
+    # one call when the distinct chunks fit the context budget, map-reduce otherwise
+    mode, docs = plan_summary(llm, docs, target_words)
+
+    # Same topic (semantically) over the same chunks with the same settings => reuse
+    params = {"top_k": top_k, "target_words": target_words,
+              "reader_level": reader_level, "include_aids": include_aids}
+    cached, query_vec, chunk_ids = _cached_lookup("summary", topic, docs, params)
+    if cached is not None:
+        return cached, docs
+
+    cache = get_response_cache()
+    metrics.inc(f"summary_{mode}_total")
+    if mode == "single":
+        summary = single_pass_summarize(llm, topic, docs, target_words, reader_level, include_aids, stream)
+    else:
+        summary = map_reduce_summarize(llm, topic, docs, target_words, reader_level, include_aids, stream,
+                                       get_digest_store())
+    if isinstance(summary, TokenStream):
+        summary.on_complete = lambda text: cache.store("summary", query_vec, chunk_ids, params, text)
+    else:
+        cache.store("summary", query_vec, chunk_ids, params, summary)
+    return summary, docs
+
+
+# --- Flashcards ---
+def _cards_prompt(topic: str, context: str, n: int) -> str:
+    return f"""
+    You are a study assistant generating **Anki-style** flashcards strictly from the provided textbook context.
+
+    GOAL:
+    - Create {n} high-quality flashcards that test understanding (not trivial recall).
+    - Each card must be grounded in the CONTEXT; do not invent facts.
+
+    FORMAT:
+    Return ONLY a JSON list (no prose) where each item is an object:
+    {{
+    "question": "...",   // one atomic, self-contained question
+    "answer": "...",     // short, factual answer (bullet points allowed)
+    "source_span": "..." // exact phrase/sentence(s) from CONTEXT that justify the answer
+    }}
+
+    GUIDELINES:
+    - Prefer conceptual questions (why/how/compare) when possible, mixed with precise definitions.
+    - Make questions self-contained: include necessary terms (no "this/that").
+    - Keep answers concise (<= 4 bullet points if needed).
+    - Absolutely no text outside the JSON.
+
+    TOPIC:
+    \"\"\"{topic}\"\"\"
+
+    CONTEXT (textbook excerpts):
+    \"\"\"{context}\"\"\"
+    """
+
+
+def _is_card(obj: dict) -> bool:
+    return bool(str(obj.get("question") or "").strip() and str(obj.get("answer") or "").strip())
+
+
+def _clean_card(obj: dict) -> dict:
+    return {key: str(obj.get(key) or "").strip() for key in ("question", "answer", "source_span")}
+
+
+def _tsv_cards(raw: str) -> List[dict]:
+    # models that ignore the JSON instruction tend to answer "Question<TAB>Answer" per line
+    cards = []
+    for line in raw.splitlines():
+        if "\t" in line:
+            q, a = line.split("\t", 1)
+            if q.strip() and a.strip():
+                cards.append({"question": q.strip(), "answer": a.strip(), "source_span": ""})
+    return cards
+
+
+def dedupe_cards(cards: List[dict], threshold: float = CARD_DEDUP_SIMILARITY) -> List[dict]:
+    """Drop cards whose question embeds within `threshold` cosine of an earlier card's."""
+    if len(cards) < 2:
+        return cards
+    vectors = np.asarray(get_embedding().embed_documents([c["question"] for c in cards]), dtype="float32")
+    vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    sims = vectors @ vectors.T
+    kept = []
+    for i in range(len(cards)):
+        if all(sims[i, j] < threshold for j in kept):
+            kept.append(i)
+    metrics.inc("flashcards_duplicates_dropped_total", len(cards) - len(kept))
+    return [cards[i] for i in kept]
+
+
+def _interleave(groups: List[List[dict]]) -> List[dict]:
+    # first card of every shard, then the second of every shard, ...
+    out = []
+    for i in range(max((len(g) for g in groups), default=0)):
+        out.extend(g[i] for g in groups if i < len(g))
+    return out
+
+
+def generate_cards(library, topic: str, top_k: int = 8, num_cards: int = 10,
+                   scope: Optional[List[str]] = None, llm=None) -> List[dict]:
+    """
+    A deck of {question, answer, source_span} cards on `topic`, grounded in
+    the top-k chunks. The chunks are split into shards of about
+    CARDS_PER_CALL cards each, generated concurrently and parsed while they
+    stream; a shard still running after CARDS_TIMEOUT seconds keeps the cards
+    it finished. The merged deck is deduplicated and trimmed to `num_cards`.
+    """
+    llm = llm or get_llm(temperature=0.3)
+    model = llm_model_name(llm)
+    k, n = top_k, num_cards
+    # retrieve textbook chunks for THIS topic, then keep the distinct ones that fit the budget
+    relevant_docs = get_retriever(library, k=k, shard_ids=scope, rerank=True).invoke(topic)[:k]
+    packed = pack(relevant_docs, context_budget(model, reserve=CARD_RESERVE_TOKENS + 80 * n), model)
+    relevant_docs = packed.docs
+
+    # near-identical topic over the same chunks => reuse the deck
+    params = {"top_k": k, "num_cards": n}
+    cached, query_vec, chunk_ids = _cached_lookup("flashcards", topic, relevant_docs, params)
+    if cached is not None:
+        return [dict(c) for c in cached]
+
+    # round-robin the chunks (best first) so every shard gets a share of the most relevant ones
+    shards = max(1, min(len(relevant_docs), math.ceil(n / CARDS_PER_CALL)))
+    groups = [relevant_docs[i::shards] for i in range(shards)]
+    # ask for a few extra when sharded: shards covering related chunks overlap
+    per_shard = math.ceil(n * (1 + CARDS_OVERGENERATE) / shards) if shards > 1 else n
+    prompts = [_cards_prompt(topic, "\n\n".join(d.page_content for d in g), per_shard) for g in groups]
+
+    streams = [ObjectStream(accept=_is_card) for _ in prompts]
+    found: List[List[dict]] = [[] for _ in prompts]
+    parse_seconds = [0.0] * len(prompts)
+
+    def on_piece(i, text):
+        t0 = time.perf_counter()
+        found[i].extend(_clean_card(c) for c in streams[i].feed(text))
+        parse_seconds[i] += time.perf_counter() - t0
+
+    with metrics.span("flashcards.generate", shards=shards, per_shard=per_shard) as sp:
+        parse_start = time.time()
+        errors = map_stream(llm, prompts, on_piece, timeout=CARDS_TIMEOUT)
+        t0 = time.perf_counter()
+        salvaged = 0
+        for i, stream in enumerate(streams):
+            if not found[i]:
+                found[i] = _tsv_cards(stream.buffer)
+                salvaged += bool(found[i])
+        # parsing is spread over the stream callbacks; record it as one span of their summed time
+        metrics.record_span("flashcards.parse", parse_start, sum(parse_seconds) + time.perf_counter() - t0, sp,
+                            cards=sum(len(f) for f in found), malformed=sum(s.malformed for s in streams),
+                            truncated=sum(s.truncated for s in streams), tsv_salvaged=salvaged)
+        cards = dedupe_cards(_interleave(found))[:n]
+        sp.set(cards=len(cards), malformed=sum(s.malformed for s in streams),
+               incomplete=sum(e is not None for e in errors))
+    if not cards and any(errors):
+        raise RuntimeError(next(e for e in errors if e))
+
+    # a deck cut short by a timeout or failed shard is not cached, so the next request retries it
+    if cards and not any(errors):
+        get_response_cache().store("flashcards", query_vec, chunk_ids, params, [dict(c) for c in cards])
+    return cards
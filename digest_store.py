@@ -0,0 +1,74 @@
+import hashlib
+import os
+from typing import Callable, List, Sequence
+
+import metrics
+from embedding_cache import text_hash
+from kvcache import SqliteCache
+
+DIGEST_STORE_PATH = os.getenv("STUDY_DIGEST_STORE_PATH", os.path.join(".cache", "digests.sqlite"))
+DIGEST_TTL_DAYS = float(os.getenv("STUDY_DIGEST_TTL_DAYS", "30"))
+DIGEST_MAX_ENTRIES = int(os.getenv("STUDY_DIGEST_MAX_ENTRIES", "50000"))
+
+
+def prompt_version(template: str) -> str:
+    """Short hash of a prompt template; editing the prompt invalidates old digests."""
+    return hashlib.sha1(template.encode("utf-8")).hexdigest()[:12]
+
+
+class DigestStore:
+    """
+    Persistent memo of per-chunk digests keyed by (prompt version, model,
+    normalized chunk text hash). Only chunks not seen before are sent to the
+    LLM; entries expire after a TTL and the least recently used are evicted
+    beyond a size cap.
+    """
+
+    def __init__(self, cache: SqliteCache):
+        self.cache = cache
+
+    @staticmethod
+    def key(text: str, version: str, model: str) -> str:
+        return f"{version}:{model}:{text_hash(text)}"
+
+    def get_or_compute(
+        self,
+        texts: Sequence[str],
+        version: str,
+        model: str,
+        compute: Callable[[List[str]], List[str]],
+    ) -> List[str]:
+        """
+        Return one digest per text, in order. `compute` receives the texts
+        that missed the store (each distinct text once) and must return their
+        digests in the same order.
+        """
+        keys = [self.key(t, version, model) for t in texts]
+        found = {k: v.decode("utf-8") for k, v in self.cache.get_many(keys).items()}
+
+        missing = {}
+        for k, t in zip(keys, texts):
+            if k not in found and k not in missing:
+                missing[k] = t
+        sp = metrics.current_span()
+        if sp is not None:
+            sp.set(digest_hits=len(texts) - sum(k in missing for k in keys), digest_misses=len(missing))
+        if missing:
+            fresh = compute(list(missing.values()))
+            new = dict(zip(missing.keys(), fresh))
+            # do not memoize empty completions
+            self.cache.put_many((k, v.encode("utf-8")) for k, v in new.items() if v)
+            found.update(new)
+        return [found[k] for k in keys]
+
+    def stats(self) -> dict:
+        return self.cache.stats()
+
+
+def open_digest_store(path: str = DIGEST_STORE_PATH) -> DigestStore:
+    return DigestStore(SqliteCache(
+        path,
+        name="digest_store",
+        max_entries=DIGEST_MAX_ENTRIES,
+        ttl_seconds=DIGEST_TTL_DAYS * 86400,
+    ))
@@ -0,0 +1,148 @@
+"""
+On-disk chunk store for FAISS shards, replacing LangChain's pickled
+index.pkl.
+
+`docstore.sqlite` holds one row per vector: its FAISS position, docstore
+ID, text and JSON metadata. Opening it reads nothing but the schema, so a
+shard's cold load costs the same for ten chunks as for a million, and only
+the chunks a search actually returns are turned into Documents.
+
+Loading never unpickles. The one place a pickle is still read is
+migrate_pickle, which sync runs once on shards written by older versions
+of this app; after that the index directory holds no pickles at all.
+"""
+import json
+import os
+import pickle
+import sqlite3
+import threading
+from collections.abc import Mapping
+from typing import Dict, Iterable, List, Optional, Union
+
+from langchain_community.docstore.base import Docstore
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_core.documents import Document
+
+DOCSTORE_NAME = "docstore.sqlite"
+PICKLE_NAME = "index.pkl"           # LangChain's format; only read by migrate_pickle
+
+
+def write_docstore(path: str, index_to_docstore_id: Dict[int, str], docstore) -> str:
+    """Write the (position, ID, text, metadata) rows of a FAISS store to `path` atomically."""
+    tmp = f"{path}.tmp-{os.getpid()}"
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    conn = sqlite3.connect(tmp)
+    try:
+        conn.execute("CREATE TABLE chunks (pos INTEGER PRIMARY KEY, id TEXT NOT NULL UNIQUE,"
+                     " text TEXT NOT NULL, metadata TEXT NOT NULL)")
+        conn.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        text_bytes = 0
+        rows = []
+        for pos, doc_id in sorted(index_to_docstore_id.items()):
+            doc = docstore.search(doc_id)
+            text_bytes += len(doc.page_content.encode("utf-8"))
+            rows.append((pos, doc_id, doc.page_content, json.dumps(doc.metadata or {})))
+        conn.executemany("INSERT INTO chunks VALUES (?, ?, ?, ?)", rows)
+        conn.executemany("INSERT INTO meta VALUES (?, ?)",
+                         [("version", "1"), ("count", str(len(rows))), ("text_bytes", str(text_bytes))])
+        conn.commit()
+    finally:
+        conn.close()
+    os.replace(tmp, path)
+    return path
+
+
+class SqliteDocstore(Docstore):
+    """
+    Read-only docstore over `docstore.sqlite`: chunks are fetched by ID on
+    each search. Safe to share between threads. It is not addable, so a
+    FAISS store built on it rejects add/merge, like the other serving stores.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+        self._meta = dict(self._conn.execute("SELECT key, value FROM meta").fetchall())
+
+    def __len__(self):
+        return int(self._meta.get("count", 0))
+
+    @property
+    def text_bytes(self) -> int:
+        return int(self._meta.get("text_bytes", 0))
+
+    def _query(self, sql: str, args=()) -> list:
+        with self._lock:
+            return self._conn.execute(sql, args).fetchall()
+
+    @staticmethod
+    def _document(doc_id: str, text: str, metadata: str) -> Document:
+        return Document(id=doc_id, page_content=text, metadata=json.loads(metadata))
+
+    def search(self, search: str) -> Union[str, Document]:
+        rows = self._query("SELECT text, metadata FROM chunks WHERE id = ?", (search,))
+        if not rows:
+            return f"ID {search} not found."
+        return self._document(search, *rows[0])
+
+    def mget(self, ids: Iterable[str]) -> List[Optional[Document]]:
+        """Documents for `ids` in order (None where missing), in as few queries as possible."""
+        ids = list(ids)
+        found = {}
+        for i in range(0, len(ids), 500):
+            part = ids[i:i + 500]
+            rows = self._query(f"SELECT id, text, metadata FROM chunks WHERE id IN ({','.join('?' * len(part))})",
+                               part)
+            found.update({row[0]: self._document(*row) for row in rows})
+        return [found.get(doc_id) for doc_id in ids]
+
+    def id_map(self) -> "PositionMap":
+        return PositionMap(self)
+
+    def to_memory(self) -> InMemoryDocstore:
+        """Every chunk as an InMemoryDocstore, for stores that will be mutated."""
+        rows = self._query("SELECT id, text, metadata FROM chunks")
+        return InMemoryDocstore({row[0]: self._document(*row) for row in rows})
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class PositionMap(Mapping):
+    """FAISS position -> docstore ID, looked up in the docstore file instead of held in a dict."""
+
+    def __init__(self, store: SqliteDocstore):
+        self._store = store
+
+    def __getitem__(self, pos) -> str:
+        rows = self._store._query("SELECT id FROM chunks WHERE pos = ?", (int(pos),))
+        if not rows:
+            raise KeyError(pos)
+        return rows[0][0]
+
+    def __iter__(self):
+        return iter(pos for (pos,) in self._store._query("SELECT pos FROM chunks ORDER BY pos"))
+
+    def __len__(self):
+        return len(self._store)
+
+    def items(self):
+        return self._store._query("SELECT pos, id FROM chunks ORDER BY pos")
+
+    def values(self):
+        return [doc_id for _, doc_id in self.items()]
+
+
+def migrate_pickle(store_dir: str) -> bool:
+    """Convert a store's index.pkl to docstore.sqlite; returns False when there was nothing to do."""
+    pkl = os.path.join(store_dir, PICKLE_NAME)
+    if not os.path.exists(pkl) or os.path.exists(os.path.join(store_dir, DOCSTORE_NAME)):
+        return False
+    with open(pkl, "rb") as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+    write_docstore(os.path.join(store_dir, DOCSTORE_NAME), index_to_docstore_id, docstore)
+    os.remove(pkl)
+    return True
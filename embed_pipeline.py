@@ -0,0 +1,184 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, List, Optional, Sequence, Tuple
+
+import metrics
+from llm_exec import backoff_delay, is_rate_limit_error
+
+# chunks per embedding request, and tokens per request (OpenAI caps a request at ~300k tokens)
+EMBED_BATCH_SIZE = int(os.getenv("STUDY_EMBED_BATCH_SIZE", "256"))
+EMBED_BATCH_TOKENS = int(os.getenv("STUDY_EMBED_BATCH_TOKENS", "60000"))
+EMBED_MAX_CONCURRENCY = int(os.getenv("STUDY_EMBED_MAX_CONCURRENCY", "4"))
+# tokens per minute across all builds in this process; 0 = unlimited
+EMBED_TPM_LIMIT = int(os.getenv("STUDY_EMBED_TPM_LIMIT", "1000000"))
+EMBED_MAX_RETRIES = int(os.getenv("STUDY_EMBED_MAX_RETRIES", "6"))
+
+
+def estimate_tokens(text: str) -> int:
+    # ~4 chars per token for English prose
+    return len(text) // 4 + 1
+
+
+def token_batches(tokens: Sequence[int], max_tokens: int = EMBED_BATCH_TOKENS,
+                  max_items: int = EMBED_BATCH_SIZE) -> List[List[int]]:
+    """Group consecutive positions into batches under both the token and the item budget."""
+    batches, current, used = [], [], 0
+    for i, n in enumerate(tokens):
+        if current and (used + n > max_tokens or len(current) >= max_items):
+            batches.append(current)
+            current, used = [], 0
+        current.append(i)
+        used += n
+    if current:
+        batches.append(current)
+    return batches
+
+
+class TokenRateLimiter:
+    """
+    Tokens-per-minute budget shared by concurrent embedding requests.
+
+    `acquire` blocks until the request fits in the last minute's budget.
+    A rate-limit response halves the effective rate and pauses every
+    caller for the backoff delay; each success then restores 5% of the
+    nominal rate (AIMD), so throughput settles just under the real limit.
+    """
+
+    def __init__(self, tokens_per_minute: int = EMBED_TPM_LIMIT):
+        self.nominal = tokens_per_minute
+        self.rate = float(tokens_per_minute)
+        self._lock = threading.Lock()
+        self._sent = []            # (timestamp, tokens) within the last minute
+        self._paused_until = 0.0
+
+    def acquire(self, tokens: int):
+        if not self.nominal:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._sent = [(t, n) for t, n in self._sent if now - t < 60]
+                used = sum(n for _, n in self._sent)
+                wait = self._paused_until - now
+                if wait <= 0 and (used + tokens <= self.rate or not self._sent):
+                    self._sent.append((now, tokens))
+                    return
+                if wait <= 0:
+                    wait = 60 - (now - self._sent[0][0])
+            metrics.inc("embed_throttle_waits_total")
+            time.sleep(min(max(wait, 0.01), 5.0))
+
+    def penalize(self, delay: float):
+        with self._lock:
+            self.rate = max(self.nominal * 0.05, self.rate / 2)
+            self._paused_until = max(self._paused_until, time.monotonic() + delay)
+
+    def reward(self):
+        with self._lock:
+            self.rate = min(self.nominal, self.rate + self.nominal * 0.05)
+
+
+_default_limiter = TokenRateLimiter()
+
+
+@dataclass
+class EmbedStats:
+    chunks: int = 0          # texts requested
+    cached: int = 0          # served from the embedding cache (e.g. a resumed build)
+    tokens: int = 0          # estimated tokens actually sent
+    batches: int = 0
+    retries: int = 0
+    seconds: float = 0.0
+
+    @property
+    def chunks_per_second(self) -> float:
+        return self.chunks / self.seconds if self.seconds else 0.0
+
+    @property
+    def tokens_per_second(self) -> float:
+        return self.tokens / self.seconds if self.seconds else 0.0
+
+    def add(self, other: "EmbedStats"):
+        for name in ("chunks", "cached", "tokens", "batches", "retries", "seconds"):
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+
+    def summary(self) -> str:
+        return (f"{self.chunks} chunks ({self.cached} cached) in {self.seconds:.1f}s, "
+                f"{self.chunks_per_second:.1f} chunks/s, {self.tokens_per_second:.0f} tokens/s")
+
+
+def embed_texts(
+    texts: Sequence[str],
+    embedding,
+    batch_tokens: int = EMBED_BATCH_TOKENS,
+    batch_size: int = EMBED_BATCH_SIZE,
+    max_concurrency: int = EMBED_MAX_CONCURRENCY,
+    limiter: Optional[TokenRateLimiter] = None,
+    on_batch: Optional[Callable[[EmbedStats], None]] = None,
+) -> Tuple[List[List[float]], EmbedStats]:
+    """
+    Embed `texts` in token-budgeted batches with at most `max_concurrency`
+    requests in flight, throttled by `limiter` and retried with backoff on
+    rate limits. Returns (vectors in input order, stats).
+
+    With a CachedEmbeddings client every finished batch is written to the
+    embedding cache, which is the checkpoint: texts already cached are not
+    sent again, so an interrupted build resumes where it stopped.
+    """
+    start = time.perf_counter()
+    limiter = limiter or _default_limiter
+    stats = EmbedStats(chunks=len(texts))
+    vectors: List[Optional[List[float]]] = [None] * len(texts)
+
+    lookup = getattr(embedding, "get_cached", None)
+    if lookup is not None:
+        for i, vector in lookup(texts).items():
+            vectors[i] = vector
+        stats.cached = sum(v is not None for v in vectors)
+    todo = [i for i, v in enumerate(vectors) if v is None]
+    tokens = [estimate_tokens(texts[i]) for i in todo]
+    batches = [[todo[j] for j in batch] for batch in token_batches(tokens, batch_tokens, batch_size)]
+    lock = threading.Lock()
+
+    def _run(batch):
+        n_tokens = sum(estimate_tokens(texts[i]) for i in batch)
+        attempt = 0
+        while True:
+            limiter.acquire(n_tokens)
+            try:
+                result = embedding.embed_documents([texts[i] for i in batch])
+                break
+            except Exception as e:
+                if attempt >= EMBED_MAX_RETRIES or not is_rate_limit_error(e):
+                    raise
+                limiter.penalize(backoff_delay(attempt))
+                metrics.inc("embed_rate_limit_retries_total")
+                with lock:
+                    stats.retries += 1
+                attempt += 1
+        limiter.reward()
+        with lock:
+            for i, vector in zip(batch, result):
+                vectors[i] = vector
+            stats.tokens += n_tokens
+            stats.batches += 1
+            stats.seconds = time.perf_counter() - start
+            if on_batch:
+                on_batch(stats)
+        metrics.inc("embed_tokens_total", n_tokens)
+        metrics.inc("embed_batches_total")
+
+    if batches:
+        with ThreadPoolExecutor(max_workers=max(1, min(max_concurrency, len(batches)))) as pool:
+            # list() re-raises the first failed batch; finished batches stay checkpointed
+            list(pool.map(_run, batches))
+
+    stats.seconds = time.perf_counter() - start
+    metrics.inc("embed_chunks_total", stats.chunks)
+    if stats.tokens:
+        metrics.set_gauge("embed_chunks_per_second", stats.chunks_per_second)
+        metrics.set_gauge("embed_tokens_per_second", stats.tokens_per_second)
+    return vectors, stats
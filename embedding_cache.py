@@ -0,0 +1,87 @@
+import hashlib
+import os
+import re
+import unicodedata
+from array import array
+from typing import Dict, List
+
+from langchain_core.embeddings import Embeddings
+from kvcache import SqliteCache
+
+EMBED_CACHE_PATH = os.getenv("STUDY_EMBED_CACHE_PATH", os.path.join(".cache", "embeddings.sqlite"))
+EMBED_CACHE_MAX_MB = float(os.getenv("STUDY_EMBED_CACHE_MAX_MB", "1024"))
+
+_WS_RE = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    # Whitespace/unicode-form differences from PDF extraction should not cause misses
+    return _WS_RE.sub(" ", unicodedata.normalize("NFC", text or "")).strip()
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+def _pack(vector: List[float]) -> bytes:
+    return array("f", vector).tobytes()
+
+
+def _unpack(blob: bytes) -> List[float]:
+    arr = array("f")
+    arr.frombytes(blob)
+    return arr.tolist()
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings wrapper that serves vectors from an on-disk cache keyed by
+    (model, hash of normalized text) and only sends unseen texts to the
+    underlying client. Identical chunks across books, rebuilds and repeated
+    uploads therefore cost no API calls.
+    """
+
+    def __init__(self, underlying: Embeddings, cache: SqliteCache, model: str = None):
+        self.underlying = underlying
+        self.cache = cache
+        self.model = model or str(getattr(underlying, "model", None) or type(underlying).__name__)
+
+    def _key(self, text: str) -> str:
+        return f"{self.model}:{text_hash(text)}"
+
+    def get_cached(self, texts: List[str]) -> Dict[int, List[float]]:
+        """{position: vector} for the texts already in the cache; nothing is embedded."""
+        keys = [self._key(t) for t in texts]
+        cached = self.cache.get_many(keys)
+        return {i: _unpack(cached[k]) for i, k in enumerate(keys) if k in cached}
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [self._key(t) for t in texts]
+        cached = self.cache.get_many(keys)
+
+        # embed each distinct missing text once
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached and key not in missing:
+                missing[key] = text
+        if missing:
+            vectors = self.underlying.embed_documents(list(missing.values()))
+            fresh = dict(zip(missing.keys(), vectors))
+            self.cache.put_many((k, _pack(v)) for k, v in fresh.items())
+        else:
+            fresh = {}
+
+        return [list(fresh[k]) if k in fresh else _unpack(cached[k]) for k in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        key = self._key(text)
+        blob = self.cache.get(key)
+        if blob is not None:
+            return _unpack(blob)
+        vector = self.underlying.embed_query(text)
+        self.cache.put(key, _pack(vector))
+        return list(vector)
+
+
+def open_embedding_cache(path: str = EMBED_CACHE_PATH, max_mb: float = EMBED_CACHE_MAX_MB) -> SqliteCache:
+    return SqliteCache(path, name="embedding_cache", max_bytes=int(max_mb * 1024 * 1024))
@@ -1,18 +1,9 @@
-import os
 import streamlit as st
-from dotenv import load_dotenv
-from langchain_openai import OpenAIEmbeddings, ChatOpenAI
+from shared import to_anki_tsv
+import metrics
 
 
-load_dotenv()
-openai_key = os.getenv("OPENAI_API_KEY")
-
-
-def generate_flashcard(vectorstore):
-
-    if vectorstore:
-        retriever = vectorstore.as_retriever()
-        llm = ChatOpenAI(openai_api_key=openai_key, temperature=0.3)
+def generate_flashcard(client, scope=None):
 
     # optional: let user tune number of cards and top_k retrieval
     cols = st.columns(3)
@@ -47,107 +38,14 @@ def generate_flashcard(vectorstore):
         st.session_state.fc_ratings[st.session_state.fc_idx] = r
         _next_card()
 
-    def _build_prompt(topic: str, context: str, n: int) -> str:
-        return f"""
-    You are a study assistant generating **Anki-style** flashcards strictly from the provided textbook context.
-
-    GOAL:
-    - Create {n} high-quality flashcards that test understanding (not trivial recall).
-    - Each card must be grounded in the CONTEXT; do not invent facts.
-
-    FORMAT:
-    Return ONLY a JSON list (no prose) where each item is an object:
-    {{
-    "question": "...",   // one atomic, self-contained question
-    "answer": "...",     // short, factual answer (bullet points allowed)
-    "source_span": "..." // exact phrase/sentence(s) from CONTEXT that justify the answer
-    }}
-
-    GUIDELINES:
-    - Prefer conceptual questions (why/how/compare) when possible, mixed with precise definitions.
-    - Make questions self-contained: include necessary terms (no "this/that").
-    - Keep answers concise (<= 4 bullet points if needed).
-    - Absolutely no text outside the JSON.
-
-    TOPIC:
-    \"\"\"{topic}\"\"\"
-
-    CONTEXT (textbook excerpts):
-    \"\"\"{context}\"\"\"
-    """
-
-    def _parse_cards(raw: str):
-        import json, re
-        try:
-            # sometimes models wrap JSON in code fences
-            raw = re.sub(r"^```(?:json)?|```$", "", raw.strip(), flags=re.MULTILINE)
-            data = json.loads(raw)
-            out = []
-            if isinstance(data, list):
-                for c in data:
-                    q = (c.get("question") or "").strip()
-                    a = (c.get("answer") or "").strip()
-                    s = (c.get("source_span") or "").strip()
-                    if q and a:
-                        out.append({"question": q, "answer": a, "source_span": s})
-            return out
-        except Exception:
-            return []
-
-    def _to_anki_tsv(cards):
-        # Question<TAB>Answer format
-        import io
-        buf = io.StringIO()
-        for c in cards:
-            q = c["question"].replace("\n", " ").strip()
-            a = c["answer"].strip()
-            buf.write(f"{q}\t{a}\n")
-        return buf.getvalue()
-
-    def _generate_cards(topic: str, k: int, n: int):
-        # retrieve textbook chunks for THIS topic
-        relevant_docs = retriever.get_relevant_documents(topic)
-        # limit to top_k
-        context = "\n\n".join([doc.page_content for doc in relevant_docs[:k]])
-
-        prompt = _build_prompt(topic, context, n)
-        # Use your existing LLM wrapper
-        result = llm.invoke(prompt)
-        raw = result.content if hasattr(result, "content") else str(result)
-        cards = _parse_cards(raw)
-
-        # Fallback: if model ignored JSON instruction, try your old TSV approach
-        if not cards:
-            fallback_prompt = f"""
-    You are a study assistant generating Anki-style flashcards.
-
-    - Based ONLY on the CONTEXT below and the TOPIC, create {n} flashcards.
-    - Format: "Question<TAB>Answer" per line.
-    - No numbering, no extra text.
-
-    TOPIC: {topic}
-
-    CONTEXT:
-    {context}
-
-    OUTPUT:
-    """
-            fb = llm.invoke(fallback_prompt)
-            text = fb.content.strip()
-            # parse tsv lines
-            lines = [ln for ln in text.split("\n") if "\t" in ln]
-            for ln in lines:
-                q, a = ln.split("\t", 1)
-                cards.append({"question": q.strip(), "answer": a.strip(), "source_span": ""})
-
-        return cards
-
     # UI
     if flashcard_topic:
-        if vectorstore:
+        if client:
             if st.button("Generate flashcards"):
-                with st.spinner("Generating flashcards from textbook context..."):
-                    cards = _generate_cards(flashcard_topic, int(top_k), int(num_cards))
+                with st.spinner("Generating flashcards from textbook context..."), \
+                        metrics.span("flashcards.request", top_k=int(top_k), num_cards=int(num_cards)) as sp:
+                    cards = client.cards(flashcard_topic, int(top_k), int(num_cards), scope=scope)
+                    sp.set(cards=len(cards))
                     if not cards:
                         st.error("Could not generate flashcards. Try a different topic or increase Top-K.")
                     else:
@@ -204,7 +102,7 @@ def generate_flashcard(vectorstore):
                 st.divider()
 
                 # Export buttons
-                tsv_data = _to_anki_tsv(cards)
+                tsv_data = to_anki_tsv(cards)
                 st.download_button(
                     "⬇️ Export Anki TSV",
                     data=tsv_data.encode("utf-8"),
@@ -0,0 +1,60 @@
+import os
+from typing import Any, List, Optional
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+import metrics
+from response_cache import doc_key
+
+RRF_K = int(os.getenv("STUDY_HYBRID_RRF_K", "60"))
+DENSE_WEIGHT = float(os.getenv("STUDY_HYBRID_DENSE_WEIGHT", "1.0"))
+LEXICAL_WEIGHT = float(os.getenv("STUDY_HYBRID_LEXICAL_WEIGHT", "1.0"))
+
+
+def reciprocal_rank_fusion(ranked_lists, weights=None, rrf_k: int = RRF_K):
+    """
+    Fuse ranked lists of (key, item) with weighted RRF:
+    score(key) = sum_i w_i / (rrf_k + rank_i). Returns [(key, item, score)], best first.
+    """
+    weights = weights or [1.0] * len(ranked_lists)
+    scores, items = {}, {}
+    for w, ranked in zip(weights, ranked_lists):
+        for rank, (key, item) in enumerate(ranked, start=1):
+            scores[key] = scores.get(key, 0.0) + w / (rrf_k + rank)
+            items.setdefault(key, item)
+    order = sorted(scores, key=scores.get, reverse=True)
+    return [(key, items[key], scores[key]) for key in order]
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    Dense FAISS similarity + BM25 over the same chunks, fused with
+    reciprocal rank fusion. Each side fetches `fetch_k` candidates from the
+    router's selected shards (all when `shard_ids` is None); the top `k`
+    fused chunks are returned with metadata['hybrid_score'].
+    """
+
+    router: Any
+    k: int = 4
+    fetch_k: int = 20
+    shard_ids: Optional[List[str]] = None
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        fetch_k = max(self.fetch_k, self.k)
+        with metrics.span("retrieve", k=self.k, fetch_k=fetch_k) as sp:
+            dense = self.router.similarity_search(query, k=fetch_k, shard_ids=self.shard_ids)
+            dense_ranked = [(doc_key(d), d) for d in dense]
+            lexical = self.router.lexical_search(query, k=fetch_k, shard_ids=self.shard_ids)
+            lexical_ranked = [(doc_key(d), d) for d, _ in lexical]
+
+            fused = reciprocal_rank_fusion([dense_ranked, lexical_ranked], [DENSE_WEIGHT, LEXICAL_WEIGHT])
+            out = []
+            for _, doc, score in fused[: self.k]:
+                doc = Document(page_content=doc.page_content, metadata={**doc.metadata, "hybrid_score": score})
+                out.append(doc)
+            sp.set(results=len(out))
+            return out
@@ -0,0 +1,253 @@
+"""
+Build and tune approximate (ANN) FAISS indexes from the existing flat index.
+
+The flat `index.faiss` written by LangChain stays the source of truth that
+syncs mutate; the tuned index is written next to it as `index.ann.faiss`
+with the same vector positions, so it can be served with the same docstore.
+In the sharded layout every book's shard gets its own tuned index, and the
+manifest's `ann` entry makes later syncs build it for new shards too.
+
+    python index_tools.py build  --index-dir faiss_index --type hnsw --report
+    python index_tools.py report --index-dir faiss_index --type ivf-pq --nlist 1024
+    python index_tools.py drop   --index-dir faiss_index
+"""
+import argparse
+import json
+import math
+import os
+import sys
+import time
+
+import faiss
+import numpy as np
+
+from utils import ANN_INDEX_NAME
+
+FLAT_INDEX_NAME = "index.faiss"
+INDEX_TYPES = ("flat", "ivf-flat", "hnsw", "ivf-pq")
+# IVF needs enough points to train its centroids; smaller stores (most
+# single-book shards) are served flat, where exact search is already fast
+MIN_IVF_VECTORS = 1024
+
+
+def flat_vectors(index) -> np.ndarray:
+    """All vectors of a flat index, in position order."""
+    if index.ntotal == 0:
+        return np.zeros((0, index.d), dtype="float32")
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def default_nlist(n: int) -> int:
+    # ~4*sqrt(n) lists, but keep >= 39 training points per centroid
+    return max(1, min(int(4 * math.sqrt(n)), n // 39 or 1))
+
+
+def default_pq_m(d: int) -> int:
+    # ~16 dims per sub-quantizer; m must divide d
+    for m in range(max(1, d // 16), 0, -1):
+        if d % m == 0:
+            return m
+    return 1
+
+
+def build_ann(vectors: np.ndarray, kind: str, metric: int = faiss.METRIC_L2, nlist: int = None,
+              nprobe: int = None, hnsw_m: int = 32, ef_construction: int = 200, ef_search: int = 64,
+              pq_m: int = None, pq_bits: int = 8):
+    """
+    Build (and train) an index of `kind` over `vectors`; positions match input
+    rows. IVF parameters are clamped to what `vectors` can train, and below
+    MIN_IVF_VECTORS an IVF kind falls back to flat, so one config fits every shard.
+    """
+    n, d = vectors.shape
+    if kind in ("ivf-flat", "ivf-pq") and n < MIN_IVF_VECTORS:
+        kind = "flat"
+    if kind == "flat":
+        index = faiss.IndexFlat(d, metric)
+    elif kind == "hnsw":
+        index = faiss.IndexHNSWFlat(d, hnsw_m, metric)
+        index.hnsw.efConstruction = ef_construction
+        index.hnsw.efSearch = ef_search
+    elif kind in ("ivf-flat", "ivf-pq"):
+        nlist = min(nlist or default_nlist(n), max(1, n // 39))
+        pq_bits = min(pq_bits, int(math.log2(n)))
+        quantizer = faiss.IndexFlat(d, metric)
+        if kind == "ivf-flat":
+            index = faiss.IndexIVFFlat(quantizer, d, nlist, metric)
+        else:
+            index = faiss.IndexIVFPQ(quantizer, d, nlist, pq_m or default_pq_m(d), pq_bits, metric)
+        index.train(vectors)
+        index.nprobe = nprobe or max(1, nlist // 16)
+    else:
+        raise ValueError(f"Unknown index type: {kind!r} (use one of {INDEX_TYPES})")
+    if n:
+        index.add(vectors)
+    return index
+
+
+def index_kind(index) -> str:
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(index, faiss.IndexIVFPQ):
+        return "ivf-pq"
+    if isinstance(index, faiss.IndexIVF):
+        return "ivf-flat"
+    return "flat"
+
+
+def index_bytes(index) -> int:
+    return int(faiss.serialize_index(index).nbytes)
+
+
+def evaluate(flat, candidate, queries: np.ndarray, k: int = 10) -> dict:
+    """Recall@k of `candidate` against exact search on `flat`, plus per-query latency."""
+    _, truth = flat.search(queries, k)
+    lat_flat, lat_cand, hits = [], [], 0
+    for i in range(len(queries)):
+        q = queries[i:i + 1]
+        t0 = time.perf_counter()
+        flat.search(q, k)
+        t1 = time.perf_counter()
+        _, got = candidate.search(q, k)
+        t2 = time.perf_counter()
+        lat_flat.append(t1 - t0)
+        lat_cand.append(t2 - t1)
+        hits += len(set(got[0]) & set(truth[i])) - (1 if -1 in truth[i] else 0)
+    expected = sum(len([x for x in row if x >= 0]) for row in truth) or 1
+
+    def _ms(values, pct):
+        return float(np.percentile(values, pct) * 1000) if values else 0.0
+
+    return {
+        "type": index_kind(candidate),
+        "k": k,
+        "queries": len(queries),
+        "recall": hits / expected,
+        "flat_p50_ms": _ms(lat_flat, 50),
+        "flat_p95_ms": _ms(lat_flat, 95),
+        "p50_ms": _ms(lat_cand, 50),
+        "p95_ms": _ms(lat_cand, 95),
+        "flat_bytes": index_bytes(flat),
+        "bytes": index_bytes(candidate),
+    }
+
+
+def sample_queries(vectors: np.ndarray, n: int = 200, noise: float = 0.01, seed: int = 0) -> np.ndarray:
+    """Perturbed copies of stored vectors, used when no real query set is given."""
+    rng = np.random.default_rng(seed)
+    rows = vectors[rng.choice(len(vectors), size=min(n, len(vectors)), replace=False)]
+    scale = float(vectors.std()) * noise
+    return (rows + rng.normal(0, scale, rows.shape)).astype("float32")
+
+
+def embed_queries(path: str) -> np.ndarray:
+    from resources import get_embedding
+    with open(path, encoding="utf-8") as f:
+        texts = [line.strip() for line in f if line.strip()]
+    return np.array(get_embedding().embed_documents(texts), dtype="float32")
+
+
+def _ann_params(args) -> dict:
+    params = {
+        "nlist": args.nlist, "nprobe": args.nprobe, "hnsw_m": args.hnsw_m,
+        "ef_construction": args.ef_construction, "ef_search": args.ef_search,
+        "pq_m": args.pq_m, "pq_bits": args.pq_bits,
+    }
+    return {k: v for k, v in params.items() if v is not None}
+
+
+def read_flat(index_dir: str):
+    return faiss.read_index(os.path.join(index_dir, FLAT_INDEX_NAME))
+
+
+def rebuild_ann(flat, ann_config: dict, out_dir: str):
+    """Rebuild the tuned index described by the manifest's `ann` entry into `out_dir`."""
+    index = build_ann(flat_vectors(flat), ann_config["type"], flat.metric_type, **ann_config.get("params", {}))
+    faiss.write_index(index, os.path.join(out_dir, ANN_INDEX_NAME))
+    return index
+
+
+def store_dirs(index_dir: str) -> list:
+    """The FAISS store directories under `index_dir` (one per shard, or the dir itself)."""
+    from indexer import load_manifest, shard_entries
+    manifest = load_manifest(index_dir)
+    if manifest and manifest.get("layout") == "shards":
+        return [path for path, _, _ in shard_entries(index_dir, manifest).values()]
+    return [index_dir]
+
+
+def _update_manifest(index_dir: str, ann):
+    from indexer import load_manifest, write_manifest
+    manifest = load_manifest(index_dir)
+    if manifest is None:
+        return
+    if ann is None:
+        manifest.pop("ann", None)
+    else:
+        manifest["ann"] = ann
+    write_manifest(manifest, index_dir)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=("build", "report", "drop"))
+    parser.add_argument("--index-dir", default="faiss_index")
+    parser.add_argument("--type", choices=INDEX_TYPES, default="hnsw")
+    parser.add_argument("--nlist", type=int)
+    parser.add_argument("--nprobe", type=int)
+    parser.add_argument("--hnsw-m", type=int)
+    parser.add_argument("--ef-construction", type=int)
+    parser.add_argument("--ef-search", type=int)
+    parser.add_argument("--pq-m", type=int)
+    parser.add_argument("--pq-bits", type=int)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=200, help="sampled queries when --query-file is not given")
+    parser.add_argument("--query-file", help="text file with one real query per line (embedded with the app's model)")
+    parser.add_argument("--report", action="store_true", help="with build: also print the recall/latency report")
+    args = parser.parse_args(argv)
+
+    dirs = store_dirs(args.index_dir)
+    if args.command == "drop":
+        for store in dirs:
+            path = os.path.join(store, ANN_INDEX_NAME)
+            if os.path.exists(path):
+                os.remove(path)
+        _update_manifest(args.index_dir, None)
+        print(f"Removed {ANN_INDEX_NAME} from {len(dirs)} store(s); the flat index will be served.")
+        return 0
+
+    params = _ann_params(args)
+    query_vectors = embed_queries(args.query_file) if args.query_file else None
+    reports = []
+    for store in dirs:
+        flat = read_flat(store)
+        vectors = flat_vectors(flat)
+
+        t0 = time.perf_counter()
+        candidate = build_ann(vectors, args.type, flat.metric_type, **params)
+        build_seconds = time.perf_counter() - t0
+
+        if args.command == "build":
+            tmp = os.path.join(store, ANN_INDEX_NAME + ".tmp")
+            faiss.write_index(candidate, tmp)
+            os.replace(tmp, os.path.join(store, ANN_INDEX_NAME))
+            print(f"{store}: wrote {index_kind(candidate)} index over {candidate.ntotal} vectors in {build_seconds:.1f}s",
+                  file=sys.stderr)
+
+        if args.command == "report" or args.report:
+            queries = query_vectors if query_vectors is not None else sample_queries(vectors, args.queries)
+            result = evaluate(flat, candidate, queries, args.k)
+            result["store"] = store
+            result["build_seconds"] = build_seconds
+            result["params"] = params
+            reports.append(result)
+
+    if args.command == "build":
+        _update_manifest(args.index_dir, {"type": args.type, "params": params})
+    if reports:
+        print(json.dumps(reports[0] if len(reports) == 1 else reports, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,340 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional
+
+from langchain_community.vectorstores import FAISS
+from docstore import DOCSTORE_NAME, migrate_pickle
+from embed_pipeline import EMBED_BATCH_SIZE, EmbedStats, embed_texts
+from load_and_split import chunking_signature
+from ingest import iter_ingest
+from lexical_index import BM25Index
+from shards import SHARDS_DIR
+from utils import save_faiss_index
+
+try:
+    import fcntl
+except ImportError:      # Windows: syncs are not serialized across processes
+    fcntl = None
+
+MANIFEST_NAME = "manifest.json"
+MANIFEST_VERSION = 2          # 2: one FAISS shard per book under shards/
+SYNC_LOCK_NAME = ".sync.lock"
+
+
+@dataclass
+class SyncReport:
+    added: List[str] = field(default_factory=list)
+    updated: List[str] = field(default_factory=list)
+    removed: List[str] = field(default_factory=list)
+    unchanged: List[str] = field(default_factory=list)
+    failed: Dict[str, str] = field(default_factory=dict)       # name -> error
+    timings: Dict[str, dict] = field(default_factory=dict)     # name -> parse/chunk seconds
+    chunks_added: int = 0
+    chunks_deleted: int = 0
+    deleted_ids: List[str] = field(default_factory=list)
+    embed: EmbedStats = field(default_factory=EmbedStats)
+    seconds: float = 0.0
+
+    @property
+    def changed(self) -> bool:
+        return bool(self.added or self.updated or self.removed)
+
+
+def embedding_model_name(embedding) -> str:
+    return str(getattr(embedding, "model", None) or type(embedding).__name__)
+
+
+def file_sha256(path, block_size: int = 1 << 20) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def chunk_ids_for(docs) -> List[str]:
+    # Stable per (source, offset, text), so re-adding the same book yields the same IDs
+    return [d.metadata["chunk_id"] for d in docs]
+
+
+def load_manifest(index_dir: str) -> Optional[dict]:
+    path = os.path.join(index_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def shard_id_for(name: str, sha256: str) -> str:
+    # readable and content-addressed: a changed book gets a new shard
+    stem = re.sub(r"[^A-Za-z0-9]+", "-", os.path.splitext(name)[0]).strip("-")[:40] or "book"
+    return f"{stem}-{sha256[:12]}"
+
+
+def shard_entries(index_dir: str, manifest: Optional[dict]) -> Dict[str, tuple]:
+    """{shard_id: (path, book name, chunk count)} for every book in the manifest."""
+    out = {}
+    for name, entry in ((manifest or {}).get("books") or {}).items():
+        shard = entry.get("shard")
+        if shard:
+            out[shard] = (os.path.join(index_dir, SHARDS_DIR, shard), name, len(entry["chunk_ids"]))
+    return out
+
+
+def _empty_manifest(model: str) -> dict:
+    return {
+        "version": MANIFEST_VERSION,
+        "embedding_model": model,
+        "chunking": chunking_signature(),
+        "layout": "shards",
+        "books": {},
+    }
+
+
+def _list_pdfs(books_dir: str) -> Dict[str, os.stat_result]:
+    if not os.path.isdir(books_dir):
+        return {}
+    return {
+        name: os.stat(os.path.join(books_dir, name))
+        for name in sorted(os.listdir(books_dir))
+        if name.lower().endswith(".pdf")
+    }
+
+
+def write_manifest(manifest: dict, index_dir: str):
+    path = os.path.join(index_dir, MANIFEST_NAME)
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def build_shard(docs, embedding, shard_dir: str, ann: Optional[dict] = None,
+                batch_size: int = EMBED_BATCH_SIZE) -> EmbedStats:
+    """
+    Embed `docs` into a standalone FAISS store + BM25 index at `shard_dir`.
+    Vectors come from the batched embedding pipeline, so a build interrupted
+    part-way resumes from the embedding cache. The shard is written to a temp
+    dir and renamed into place, so readers never see a partial shard.
+    Returns the embedding stats.
+    """
+    ids = chunk_ids_for(docs)
+    texts = [d.page_content for d in docs]
+    vectors, stats = embed_texts(texts, embedding, batch_size=batch_size)
+    vectorstore = FAISS.from_embeddings(
+        list(zip(texts, vectors)), embedding, metadatas=[d.metadata for d in docs], ids=ids
+    )
+    lexical = BM25Index()
+    lexical.add((i, d.page_content) for i, d in zip(ids, docs))
+
+    tmp_dir = f"{shard_dir}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    save_faiss_index(vectorstore, tmp_dir)
+    lexical.save(tmp_dir)
+    if ann:
+        from index_tools import rebuild_ann
+        rebuild_ann(vectorstore.index, ann, tmp_dir)
+    shutil.rmtree(shard_dir, ignore_errors=True)
+    os.replace(tmp_dir, shard_dir)
+    return stats
+
+
+def _remove_legacy_files(index_dir: str):
+    # single-index layout from before shards: index.faiss/index.pkl/bm25 at the top level
+    for name in os.listdir(index_dir):
+        full = os.path.join(index_dir, name)
+        if os.path.isfile(full) and name not in (MANIFEST_NAME, SYNC_LOCK_NAME):
+            os.remove(full)
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _in_use_tmp(name: str) -> bool:
+    # "<shard>.tmp-<pid>" being written by another live process
+    _, sep, pid = name.rpartition(".tmp-")
+    if not sep or not pid.isdigit():
+        return False
+    return int(pid) != os.getpid() and _pid_alive(int(pid))
+
+
+@contextmanager
+def sync_lock(index_dir: str):
+    """
+    Exclusive lock on `index_dir` across processes (e.g. several uvicorn
+    workers syncing at startup); the later sync finds the work done.
+    """
+    os.makedirs(index_dir, exist_ok=True)
+    if fcntl is None:
+        yield
+        return
+    with open(os.path.join(index_dir, SYNC_LOCK_NAME), "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def sync_books(
+    books_dir: str,
+    index_dir: str,
+    embedding,
+    on_progress: Optional[Callable[[str], None]] = None,
+    workers: Optional[int] = None,
+) -> SyncReport:
+    """
+    Bring the per-book shards under `index_dir` in line with the PDFs in
+    `books_dir`.
+
+    Only new or changed books are embedded, each into its own shard; shards
+    of removed or changed books are deleted. Unchanged books are detected by
+    (size, mtime) first and by content hash only when those differ. PDFs are
+    parsed in parallel by `workers` processes and each book's shard is built
+    as soon as its file finishes; a file that fails to parse is reported in
+    `failed` and left out of the manifest so the next sync retries it. The
+    manifest is replaced atomically once all new shards are on disk.
+    Concurrent syncs of the same `index_dir` run one at a time (sync_lock).
+    """
+    with sync_lock(index_dir):
+        return _sync_books(books_dir, index_dir, embedding, on_progress, workers)
+
+
+def _sync_books(books_dir, index_dir, embedding, on_progress, workers) -> SyncReport:
+    start = time.perf_counter()
+    report = SyncReport()
+    notify = on_progress or (lambda msg: None)
+    model = embedding_model_name(embedding)
+
+    os.makedirs(os.path.join(index_dir, SHARDS_DIR), exist_ok=True)
+    manifest = load_manifest(index_dir)
+    manifest_dirty = False
+    legacy = os.path.exists(os.path.join(index_dir, "index.faiss"))
+
+    if legacy:
+        # chunks already embedded are served by the embedding cache, so this costs no API calls for them
+        notify("Migrating single index to per-book shards")
+        manifest = None
+    elif manifest is not None and manifest.get("embedding_model") != model:
+        notify(f"Embedding model changed ({manifest.get('embedding_model')} -> {model}); rebuilding")
+        manifest = None
+    elif manifest is not None and manifest.get("chunking") != chunking_signature():
+        notify(f"Chunking config changed ({manifest.get('chunking')} -> {chunking_signature()}); rebuilding")
+        manifest = None
+
+    if manifest is None:
+        stale = load_manifest(index_dir) or {}
+        for entry in (stale.get("books") or {}).values():
+            report.deleted_ids.extend(entry.get("chunk_ids", []))
+        manifest = _empty_manifest(model)
+        if stale.get("ann"):
+            manifest["ann"] = stale["ann"]
+        manifest_dirty = True
+
+    # --- Plan: compare books on disk with the manifest ---
+    on_disk = _list_pdfs(books_dir)
+    books = manifest["books"]
+    to_embed: Dict[str, str] = {}     # name -> sha256
+
+    for name in list(books):
+        if name not in on_disk:
+            report.removed.append(name)
+
+    for name, st in on_disk.items():
+        entry = books.get(name)
+        if entry and entry["size"] == st.st_size and entry["mtime_ns"] == st.st_mtime_ns:
+            report.unchanged.append(name)
+            continue
+        sha = file_sha256(os.path.join(books_dir, name))
+        if entry and entry["sha256"] == sha:
+            # touched but identical content: refresh stat info only
+            entry["size"], entry["mtime_ns"] = st.st_size, st.st_mtime_ns
+            manifest_dirty = True
+            report.unchanged.append(name)
+            continue
+        if entry:
+            report.updated.append(name)
+        else:
+            report.added.append(name)
+        to_embed[name] = sha
+
+    for name in report.removed + report.updated:
+        report.deleted_ids.extend(books.pop(name)["chunk_ids"])
+    report.chunks_deleted = len(report.deleted_ids)
+
+    # --- Apply: build one shard per new/changed book as its file finishes ---
+    paths = [(os.path.join(books_dir, name), name) for name in to_embed]
+    for result in iter_ingest(paths, workers=workers):
+        name = result.display_name
+        if not result.ok:
+            notify(f"Failed: {name} ({result.error})")
+            report.failed[name] = result.error
+            continue
+        notify(f"Processed: {name} ({result.pages} pages, {len(result.docs)} chunks, "
+               f"{result.parse_seconds + result.chunk_seconds:.2f}s)")
+        report.timings[name] = {
+            "pages": result.pages,
+            "parse_seconds": result.parse_seconds,
+            "chunk_seconds": result.chunk_seconds,
+        }
+        if not result.docs:
+            report.failed[name] = "no text extracted"
+            continue
+
+        shard = shard_id_for(name, to_embed[name])
+        try:
+            stats = build_shard(result.docs, embedding, os.path.join(index_dir, SHARDS_DIR, shard),
+                                manifest.get("ann"))
+        except Exception as e:
+            # batches embedded before the failure are cached; the next sync resumes from there
+            notify(f"Failed to embed: {name} ({e})")
+            report.failed[name] = f"embedding failed: {e}"
+            continue
+        report.embed.add(stats)
+        notify(f"Embedded: {name} ({stats.summary()})")
+        st = on_disk[name]
+        books[name] = {
+            "sha256": to_embed[name],
+            "size": st.st_size,
+            "mtime_ns": st.st_mtime_ns,
+            "shard": shard,
+            "chunk_ids": chunk_ids_for(result.docs),
+            "embedding_model": model,
+        }
+        report.chunks_added += len(result.docs)
+
+    if report.changed or manifest_dirty:
+        write_manifest(manifest, index_dir)
+
+    # only now that the manifest no longer references them: drop shards of
+    # removed/changed books and leftovers of interrupted builds, and convert
+    # pickled docstores of the remaining shards
+    live = {entry.get("shard") for entry in books.values()}
+    shards_root = os.path.join(index_dir, SHARDS_DIR)
+    for shard in os.listdir(shards_root):
+        if _in_use_tmp(shard):
+            continue
+        if shard not in live:
+            shutil.rmtree(os.path.join(shards_root, shard), ignore_errors=True)
+        elif migrate_pickle(os.path.join(shards_root, shard)):
+            notify(f"Converted {shard} to {DOCSTORE_NAME}")
+    if legacy:
+        _remove_legacy_files(index_dir)
+
+    report.seconds = time.perf_counter() - start
+    return report
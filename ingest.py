@@ -0,0 +1,125 @@
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+from typing import Iterable, Iterator, List, Optional, Tuple, Union
+
+from langchain.schema import Document
+
+import metrics
+from load_and_split import load_pages, split_documents
+
+# 0 / unset -> one worker per core
+INGEST_WORKERS = int(os.getenv("STUDY_INGEST_WORKERS", "0")) or (os.cpu_count() or 1)
+# parse in this process instead of a worker: faster for one file, but a
+# parser crash then takes the app or service down with it (opt-in, for debugging)
+INGEST_IN_PROCESS = os.getenv("STUDY_INGEST_IN_PROCESS", "0") == "1"
+
+
+@dataclass
+class IngestResult:
+    path: str
+    display_name: str
+    docs: List[Document] = field(default_factory=list)
+    pages: int = 0
+    parse_seconds: float = 0.0
+    chunk_seconds: float = 0.0
+    error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+def _ingest_one(path: str, display_name: str, loader, strategy, chunk_size, chunk_overlap) -> IngestResult:
+    # Runs in a worker process; must stay a top-level function so it pickles
+    result = IngestResult(path=path, display_name=display_name)
+    try:
+        t0 = time.perf_counter()
+        pages = load_pages(path, display_name, loader)
+        t1 = time.perf_counter()
+        result.docs = split_documents(pages, strategy, chunk_size, chunk_overlap)
+        result.pages = len(pages)
+        result.parse_seconds = t1 - t0
+        result.chunk_seconds = time.perf_counter() - t1
+    except Exception as e:
+        result.error = f"{type(e).__name__}: {e}"
+    return result
+
+
+def _normalize(inputs) -> List[Tuple[str, str]]:
+    out = []
+    for item in inputs:
+        if isinstance(item, tuple):
+            path, name = item
+        else:
+            path, name = item, os.path.basename(str(item))
+        out.append((str(path), name))
+    return out
+
+
+def _observed(result: IngestResult) -> IngestResult:
+    # workers run in other processes, so their stage timings are recorded here
+    if result.ok:
+        metrics.observe("stage_ingest.parse_seconds", result.parse_seconds)
+        metrics.observe("stage_ingest.chunk_seconds", result.chunk_seconds)
+    else:
+        metrics.inc("ingest_failures_total")
+    return result
+
+
+def iter_ingest(
+    inputs: Iterable[Union[str, os.PathLike, Tuple[Union[str, os.PathLike], str]]],
+    workers: Optional[int] = None,
+    loader: Optional[str] = None,
+    strategy: Optional[str] = None,
+    chunk_size: Optional[int] = None,
+    chunk_overlap: Optional[int] = None,
+    in_process: bool = INGEST_IN_PROCESS,
+) -> Iterator[IngestResult]:
+    """
+    Parse and chunk PDFs across a process pool, yielding one IngestResult per
+    file as soon as it finishes (completion order, not input order).
+
+    `inputs` are paths or (path, display_name) pairs. A file that fails to
+    parse, or crashes its worker, yields a result with `error` set instead of
+    aborting the whole run. A single file goes through a worker too, so a
+    crashing parser never takes down the calling process; pass
+    in_process=True to skip the pool.
+    """
+    items = _normalize(inputs)
+    if not items:
+        return
+    opts = (loader, strategy, chunk_size, chunk_overlap)
+    workers = max(1, min(workers or INGEST_WORKERS, len(items)))
+
+    if in_process:
+        for path, name in items:
+            yield _observed(_ingest_one(path, name, *opts))
+        return
+
+    # spawn: forking a process that already runs Streamlit/FAISS threads is unsafe
+    ctx = multiprocessing.get_context("spawn")
+    pending = list(items)
+    while pending:
+        crashed = set()
+        with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+            futures = {pool.submit(_ingest_one, path, name, *opts): (path, name) for path, name in pending}
+            for fut in as_completed(futures):
+                path, name = futures[fut]
+                try:
+                    yield _observed(fut.result())
+                except BrokenProcessPool:
+                    # a worker died (e.g. a parser segfault); we cannot tell
+                    # which file did it, so rerun the unfinished ones
+                    crashed.add((path, name))
+                except Exception as e:
+                    yield IngestResult(path=path, display_name=name, error=f"{type(e).__name__}: {e}")
+        retry = [item for item in pending if item in crashed]
+        if retry and workers == 1:
+            # with a single worker files run in order, so the first unfinished one is the culprit
+            path, name = retry.pop(0)
+            yield IngestResult(path=path, display_name=name, error="worker process crashed while parsing")
+        pending, workers = retry, 1
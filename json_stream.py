@@ -0,0 +1,87 @@
+"""
+Incremental, forgiving extraction of JSON objects from streamed LLM output.
+
+Models asked for "a JSON list of objects" wrap it in code fences, prefix it
+with prose, copy `// comments` from the prompt's example, leave trailing
+commas, or get cut off mid-array. ObjectStream is fed the text as it
+arrives and returns every object as soon as its closing brace is seen, so
+whatever was complete before a truncation or a malformed item is kept.
+"""
+import json
+import re
+from typing import Callable, List, Optional
+
+_LINE_COMMENT_RE = re.compile(r'("(?:[^"\\]|\\.)*")|//[^\n]*')
+_TRAILING_COMMA_RE = re.compile(r'("(?:[^"\\]|\\.)*")|,(\s*[}\]])')
+
+
+def _repair(text: str) -> str:
+    # drop // comments and trailing commas, leaving string contents alone
+    text = _LINE_COMMENT_RE.sub(lambda m: m.group(1) or "", text)
+    return _TRAILING_COMMA_RE.sub(lambda m: m.group(1) or m.group(2), text)
+
+
+def loads_lenient(text: str):
+    try:
+        return json.loads(text)
+    except ValueError:
+        return json.loads(_repair(text))
+
+
+class ObjectStream:
+    """
+    Feed text chunks; get back the objects completed by each chunk.
+
+    Every `{...}` is tracked, at any depth, with string/escape awareness;
+    when one closes it is parsed (with light repair) and returned if
+    `accept(obj)` holds. Objects that still fail to parse are counted in
+    `malformed` and skipped.
+    """
+
+    def __init__(self, accept: Optional[Callable[[dict], bool]] = None):
+        self.accept = accept or (lambda obj: True)
+        self.buffer = ""
+        self.malformed = 0
+        self.found = 0
+        self._pos = 0
+        self._starts: List[int] = []
+        self._in_string = False
+        self._escape = False
+
+    def feed(self, text: str) -> List[dict]:
+        self.buffer += text
+        out = []
+        buf = self.buffer
+        for i in range(self._pos, len(buf)):
+            ch = buf[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = bool(self._starts)   # quotes in prose outside any object are ignored
+            elif ch == "{":
+                self._starts.append(i)
+            elif ch == "}" and self._starts:
+                obj = self._parse(buf[self._starts.pop():i + 1])
+                if obj is not None:
+                    out.append(obj)
+        self._pos = len(buf)
+        self.found += len(out)
+        return out
+
+    def _parse(self, text: str) -> Optional[dict]:
+        try:
+            obj = loads_lenient(text)
+        except ValueError:
+            self.malformed += 1
+            return None
+        return obj if isinstance(obj, dict) and self.accept(obj) else None
+
+    @property
+    def truncated(self) -> bool:
+        """True when the text ended inside an unfinished object."""
+        return bool(self._starts)
@@ -0,0 +1,182 @@
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, Optional, Tuple
+
+import metrics
+
+
+class SqliteCache:
+    """
+    Small persistent key -> bytes store on SQLite with LRU eviction.
+
+    Entries are evicted least-recently-used first once the stored values
+    exceed `max_bytes` or `max_entries`, and are treated as missing once
+    older than `ttl_seconds`. Hits and misses are counted per instance and
+    mirrored into the process metrics as `<name>_hits_total` /
+    `<name>_misses_total`. Safe to share between threads; several processes
+    may open the same file.
+
+    Entry count and byte totals live in a one-row `totals` table kept up to
+    date by triggers, so checking the limits on a write is a single-row read
+    rather than a scan of every entry.
+    """
+
+    def __init__(self, path: str, name: str = "cache", max_bytes: Optional[int] = None,
+                 max_entries: Optional[int] = None, ttl_seconds: Optional[float] = None):
+        self.path = path
+        self.name = name
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL,"
+            " created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries(accessed)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS entries_created ON entries(created)")
+        self._conn.commit()
+        self._init_totals()
+
+    def _init_totals(self):
+        # created and seeded once per file, in one transaction so concurrent openers agree
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS totals ("
+                " id INTEGER PRIMARY KEY CHECK (id = 0), count INTEGER NOT NULL, bytes INTEGER NOT NULL)"
+            )
+            if self._conn.execute("SELECT 1 FROM totals").fetchone() is None:
+                self._conn.execute("INSERT INTO totals SELECT 0, COUNT(*), COALESCE(SUM(size), 0) FROM entries")
+            self._conn.execute(
+                "CREATE TRIGGER IF NOT EXISTS entries_insert AFTER INSERT ON entries BEGIN"
+                " UPDATE totals SET count = count + 1, bytes = bytes + new.size; END"
+            )
+            self._conn.execute(
+                "CREATE TRIGGER IF NOT EXISTS entries_delete AFTER DELETE ON entries BEGIN"
+                " UPDATE totals SET count = count - 1, bytes = bytes - old.size; END"
+            )
+            self._conn.execute(
+                "CREATE TRIGGER IF NOT EXISTS entries_resize AFTER UPDATE OF size ON entries BEGIN"
+                " UPDATE totals SET bytes = bytes + new.size - old.size; END"
+            )
+            self._conn.commit()
+        except BaseException:
+            self._conn.rollback()
+            raise
+
+    def _totals(self) -> Tuple[int, int]:
+        return self._conn.execute("SELECT count, bytes FROM totals").fetchone()
+
+    # --- reads ---
+    def get(self, key: str) -> Optional[bytes]:
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, bytes]:
+        keys = list(dict.fromkeys(keys))
+        if not keys:
+            return {}
+        now = time.time()
+        found: Dict[str, bytes] = {}
+        with self._lock:
+            # stay well below SQLite's bound-variable limit
+            for i in range(0, len(keys), 500):
+                part = keys[i:i + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, value, created FROM entries WHERE key IN ({','.join('?' * len(part))})",
+                    part,
+                ).fetchall()
+                for key, value, created in rows:
+                    if self.ttl_seconds is None or now - created <= self.ttl_seconds:
+                        found[key] = value
+            if found:
+                self._conn.executemany(
+                    "UPDATE entries SET accessed=? WHERE key=?", [(now, k) for k in found]
+                )
+                self._conn.commit()
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        metrics.inc(f"{self.name}_hits_total", len(found))
+        metrics.inc(f"{self.name}_misses_total", len(keys) - len(found))
+        return found
+
+    # --- writes ---
+    def put(self, key: str, value: bytes):
+        self.put_many([(key, value)])
+
+    def put_many(self, items: Iterable[Tuple[str, bytes]]):
+        now = time.time()
+        rows = [(k, sqlite3.Binary(v), len(v), now, now) for k, v in items]
+        if not rows:
+            return
+        with self._lock:
+            # an upsert rather than INSERT OR REPLACE: REPLACE's implicit delete skips the totals trigger
+            self._conn.executemany(
+                "INSERT INTO entries(key, value, size, created, accessed) VALUES (?,?,?,?,?)"
+                " ON CONFLICT(key) DO UPDATE SET value=excluded.value, size=excluded.size,"
+                " created=excluded.created, accessed=excluded.accessed",
+                rows,
+            )
+            self._conn.commit()
+            self._evict()
+
+    def delete(self, keys: Iterable[str]):
+        with self._lock:
+            self._conn.executemany("DELETE FROM entries WHERE key=?", [(k,) for k in keys])
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM entries")
+            self._conn.commit()
+
+    def _evict(self):
+        # caller holds the lock
+        if self.ttl_seconds is not None:
+            cur = self._conn.execute("DELETE FROM entries WHERE created < ?", (time.time() - self.ttl_seconds,))
+            self.evictions += cur.rowcount
+        count, total = self._totals()
+        over_bytes = self.max_bytes is not None and total > self.max_bytes
+        over_count = self.max_entries is not None and count > self.max_entries
+        if not (over_bytes or over_count):
+            self._conn.commit()
+            return
+        # trim to 90% of the limits so we do not evict on every insert
+        byte_target = int(self.max_bytes * 0.9) if self.max_bytes is not None else None
+        count_target = int(self.max_entries * 0.9) if self.max_entries is not None else None
+        doomed = []
+        for key, size in self._conn.execute("SELECT key, size FROM entries ORDER BY accessed ASC"):
+            if (byte_target is None or total <= byte_target) and (count_target is None or count <= count_target):
+                break
+            doomed.append((key,))
+            total -= size
+            count -= 1
+        self._conn.executemany("DELETE FROM entries WHERE key=?", doomed)
+        self._conn.commit()
+        self.evictions += len(doomed)
+        metrics.inc(f"{self.name}_evictions_total", len(doomed))
+
+    def stats(self) -> dict:
+        with self._lock:
+            count, total = self._totals()
+        lookups = self.hits + self.misses
+        return {
+            "entries": count,
+            "bytes": total,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / lookups) if lookups else 0.0,
+            "evictions": self.evictions,
+        }
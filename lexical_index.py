@@ -0,0 +1,112 @@
+import gzip
+import heapq
+import json
+import math
+import os
+import re
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+LEXICAL_INDEX_NAME = "bm25.json.gz"
+
+# Keeps drug names, abbreviations and formula-ish tokens together:
+# "HbA1c", "CO2", "Na+", "beta-blocker", "t1/2", "5.5"
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:[-+./][a-z0-9]+)*\+?")
+_STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that the this to was were "
+    "which with what how why when where who explain describe".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    return [t for t in _TOKEN_RE.findall((text or "").lower()) if t not in _STOPWORDS]
+
+
+class BM25Index:
+    """
+    In-process inverted index with Okapi BM25 scoring, keyed by the same
+    chunk IDs as the FAISS docstore so both can be updated together.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, Dict[str, int]] = {}   # term -> {doc_id: tf}
+        self.doc_len: Dict[str, int] = {}
+        self.total_len = 0
+
+    def __len__(self):
+        return len(self.doc_len)
+
+    def add(self, items: Iterable[Tuple[str, str]]):
+        """Index (doc_id, text) pairs; re-adding an ID replaces it."""
+        items = list(items)
+        self.remove([doc_id for doc_id, _ in items if doc_id in self.doc_len])
+        for doc_id, text in items:
+            terms = tokenize(text)
+            self.doc_len[doc_id] = len(terms)
+            self.total_len += len(terms)
+            for term, tf in Counter(terms).items():
+                self.postings.setdefault(term, {})[doc_id] = tf
+
+    def remove(self, doc_ids: Iterable[str]):
+        doomed = {d for d in doc_ids if d in self.doc_len}
+        if not doomed:
+            return
+        for d in doomed:
+            self.total_len -= self.doc_len.pop(d)
+        # one pass over the vocabulary per batch of removals
+        for term in list(self.postings):
+            plist = self.postings[term]
+            for d in doomed.intersection(plist):
+                del plist[d]
+            if not plist:
+                del self.postings[term]
+
+    def search(self, query: str, k: int = 10, allowed: Optional[set] = None) -> List[Tuple[str, float]]:
+        n = len(self.doc_len)
+        if not n:
+            return []
+        avgdl = self.total_len / n or 1.0
+        scores: Dict[str, float] = {}
+        for term in set(tokenize(query)):
+            plist = self.postings.get(term)
+            if not plist:
+                continue
+            idf = math.log(1 + (n - len(plist) + 0.5) / (len(plist) + 0.5))
+            for doc_id, tf in plist.items():
+                if allowed is not None and doc_id not in allowed:
+                    continue
+                norm = tf + self.k1 * (1 - self.b + self.b * self.doc_len[doc_id] / avgdl)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / norm
+        return heapq.nlargest(k, scores.items(), key=lambda kv: kv[1])
+
+    # --- persistence ---
+    def save(self, index_dir: str):
+        path = os.path.join(index_dir, LEXICAL_INDEX_NAME)
+        data = {"version": 1, "k1": self.k1, "b": self.b, "doc_len": self.doc_len, "postings": self.postings}
+        with gzip.open(path, "wt", encoding="utf-8") as f:
+            json.dump(data, f, separators=(",", ":"))
+
+    @classmethod
+    def load(cls, index_dir: str) -> Optional["BM25Index"]:
+        path = os.path.join(index_dir, LEXICAL_INDEX_NAME)
+        if not os.path.exists(path):
+            return None
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            data = json.load(f)
+        index = cls(data.get("k1", 1.5), data.get("b", 0.75))
+        index.doc_len = data["doc_len"]
+        index.postings = data["postings"]
+        index.total_len = sum(index.doc_len.values())
+        return index
+
+    @classmethod
+    def from_vectorstore(cls, vectorstore) -> "BM25Index":
+        """Build from a FAISS store's docstore (for indexes saved before BM25 existed)."""
+        index = cls()
+        index.add(
+            (doc_id, vectorstore.docstore.search(doc_id).page_content)
+            for doc_id in vectorstore.index_to_docstore_id.values()
+        )
+        return index
@@ -0,0 +1,241 @@
+import asyncio
+import contextvars
+import os
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+import metrics
+
+# Upper bound on in-flight LLM requests per map step
+LLM_MAX_CONCURRENCY = int(os.getenv("STUDY_LLM_MAX_CONCURRENCY", "8"))
+LLM_MAX_RETRIES = int(os.getenv("STUDY_LLM_MAX_RETRIES", "5"))
+LLM_BACKOFF_BASE = float(os.getenv("STUDY_LLM_BACKOFF_BASE", "1.0"))
+LLM_BACKOFF_MAX = 30.0
+
+
+def content_of(resp) -> str:
+    return resp.content if hasattr(resp, "content") else str(resp)
+
+
+def is_rate_limit_error(exc: BaseException) -> bool:
+    try:
+        import openai
+        if isinstance(exc, openai.RateLimitError):
+            return True
+    except ImportError:
+        pass
+    status = getattr(exc, "status_code", None) or getattr(getattr(exc, "response", None), "status_code", None)
+    return status == 429 or "rate limit" in str(exc).lower()
+
+
+def backoff_delay(attempt: int, base: Optional[float] = None) -> float:
+    # exponential with full jitter
+    base = LLM_BACKOFF_BASE if base is None else base
+    return random.uniform(0, min(LLM_BACKOFF_MAX, base * (2 ** attempt)))
+
+
+async def ainvoke_with_retry(llm, prompt, retries: int = LLM_MAX_RETRIES):
+    attempt = 0
+    while True:
+        try:
+            return await llm.ainvoke(prompt)
+        except Exception as e:
+            if attempt >= retries or not is_rate_limit_error(e):
+                raise
+            metrics.inc("llm_rate_limit_retries_total")
+            await asyncio.sleep(backoff_delay(attempt))
+            attempt += 1
+
+
+async def amap_invoke(llm, prompts: Sequence, max_concurrency: Optional[int] = None,
+                      retries: int = LLM_MAX_RETRIES) -> List[str]:
+    """
+    Run `prompts` through `llm` concurrently (at most `max_concurrency` in
+    flight), retrying rate-limited calls with backoff. Returns the completion
+    texts in the same order as `prompts`.
+    """
+    sem = asyncio.Semaphore(max_concurrency or LLM_MAX_CONCURRENCY)
+
+    async def _one(prompt):
+        async with sem:
+            return content_of(await ainvoke_with_retry(llm, prompt, retries)).strip()
+
+    with metrics.span("llm.map", prompts=len(prompts)):
+        return list(await asyncio.gather(*(_one(p) for p in prompts)))
+
+
+def run_async(coro):
+    """Run a coroutine from sync code, even if the calling thread already has a running loop."""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+    box = {}
+
+    def _runner():
+        try:
+            box["result"] = asyncio.run(coro)
+        except BaseException as e:
+            box["error"] = e
+
+    # carry the caller's context over, so spans opened inside nest under the caller's span
+    ctx = contextvars.copy_context()
+    t = threading.Thread(target=ctx.run, args=(_runner,))
+    t.start()
+    t.join()
+    if "error" in box:
+        raise box["error"]
+    return box["result"]
+
+
+def map_invoke(llm, prompts: Sequence, max_concurrency: Optional[int] = None,
+               retries: int = LLM_MAX_RETRIES) -> List[str]:
+    """Blocking wrapper around amap_invoke for sync callers (e.g. Streamlit callbacks)."""
+    if not prompts:
+        return []
+    return run_async(amap_invoke(llm, prompts, max_concurrency, retries))
+
+
+async def amap_stream(llm, prompts: Sequence, on_piece: Callable[[int, str], None],
+                      max_concurrency: Optional[int] = None, timeout: Optional[float] = None,
+                      retries: int = LLM_MAX_RETRIES) -> List[Optional[str]]:
+    """
+    Stream `prompts` through `llm` concurrently (at most `max_concurrency` in
+    flight), calling `on_piece(i, text)` for every chunk of prompt i as it
+    arrives. A stream still running after `timeout` seconds is cut off, keeping
+    what it produced. Returns, per prompt, None when it finished or the reason
+    it did not ("timeout" or the error). Rate-limited calls are retried only
+    before their first chunk, so no text is delivered twice.
+    """
+    sem = asyncio.Semaphore(max_concurrency or LLM_MAX_CONCURRENCY)
+
+    async def _consume(i, prompt):
+        attempt, received = 0, False
+        while True:
+            try:
+                async for chunk in llm.astream(prompt):
+                    piece = content_of(chunk)
+                    if piece:
+                        received = True
+                        on_piece(i, piece)
+                return
+            except Exception as e:
+                if received or attempt >= retries or not is_rate_limit_error(e):
+                    raise
+                metrics.inc("llm_rate_limit_retries_total")
+                await asyncio.sleep(backoff_delay(attempt))
+                attempt += 1
+
+    async def _one(i, prompt):
+        async with sem:
+            try:
+                await asyncio.wait_for(_consume(i, prompt), timeout)
+                return None
+            except asyncio.TimeoutError:
+                metrics.inc("llm_stream_timeouts_total")
+                return "timeout"
+            except Exception as e:
+                metrics.inc("llm_stream_errors_total")
+                return f"{type(e).__name__}: {e}"
+
+    with metrics.span("llm.map_stream", prompts=len(prompts)) as sp:
+        results = list(await asyncio.gather(*(_one(i, p) for i, p in enumerate(prompts))))
+        sp.set(failed=sum(r is not None for r in results))
+        return results
+
+
+def map_stream(llm, prompts: Sequence, on_piece: Callable[[int, str], None],
+               max_concurrency: Optional[int] = None, timeout: Optional[float] = None,
+               retries: int = LLM_MAX_RETRIES) -> List[Optional[str]]:
+    """Blocking wrapper around amap_stream."""
+    if not prompts:
+        return []
+    return run_async(amap_stream(llm, prompts, on_piece, max_concurrency, timeout, retries))
+
+
+class TokenStream:
+    """
+    Iterable over the text chunks of a streamed completion, for
+    st.write_stream and similar consumers. Once exhausted, `text` holds the
+    full completion and `ttft` the seconds until the first token; both are
+    also recorded as `<metric>_ttft_seconds` / `<metric>_stream_seconds`.
+    `on_complete(text)` runs after the last chunk.
+    """
+
+    def __init__(self, llm, prompt, metric: str = "llm", on_complete=None):
+        self.llm = llm
+        self.prompt = prompt
+        self.metric = metric
+        self.on_complete = on_complete
+        self.text = ""
+        self.ttft = None
+
+    def __iter__(self):
+        start = time.perf_counter()
+        parts = []
+        for chunk in self.llm.stream(self.prompt):
+            piece = content_of(chunk)
+            if not piece:
+                continue
+            if self.ttft is None:
+                self.ttft = time.perf_counter() - start
+                metrics.set_gauge(f"{self.metric}_ttft_seconds", self.ttft)
+            parts.append(piece)
+            yield piece
+        self.text = "".join(parts)
+        metrics.set_gauge(f"{self.metric}_stream_seconds", time.perf_counter() - start)
+        if self.on_complete is not None:
+            self.on_complete(self.text)
+
+
+class TracingCallback(BaseCallbackHandler):
+    """
+    Records every chat model call as an `llm.call` span under the span that
+    was current when the call started, with input/output token counts
+    (from the provider's usage data, estimated when it reports none).
+    """
+
+    run_inline = True   # keep the caller's context so spans nest correctly
+
+    def __init__(self):
+        self._runs: Dict[UUID, tuple] = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id: UUID, **kwargs: Any):
+        prompt = "".join(str(m.content) for batch in messages for m in batch)
+        self._runs[run_id] = (time.time(), time.perf_counter(), metrics.current_span(), prompt)
+
+    def on_llm_start(self, serialized, prompts, *, run_id: UUID, **kwargs: Any):
+        self._runs[run_id] = (time.time(), time.perf_counter(), metrics.current_span(), "".join(prompts))
+
+    def on_llm_end(self, response, *, run_id: UUID, **kwargs: Any):
+        started = self._runs.pop(run_id, None)
+        if started is None:
+            return
+        from embed_pipeline import estimate_tokens   # local: embed_pipeline imports this module
+        start, t0, parent, prompt = started
+        text = "".join(g.text for gens in response.generations for g in gens)
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        if not usage:
+            message = getattr(response.generations[0][0], "message", None) if response.generations else None
+            meta = getattr(message, "usage_metadata", None) or {}
+            usage = {"prompt_tokens": meta.get("input_tokens"), "completion_tokens": meta.get("output_tokens")}
+        input_tokens = usage.get("prompt_tokens") or estimate_tokens(prompt)
+        output_tokens = usage.get("completion_tokens") or estimate_tokens(text)
+        metrics.record_span("llm.call", start, time.perf_counter() - t0, parent,
+                            input_tokens=input_tokens, output_tokens=output_tokens)
+        metrics.inc("llm_calls_total")
+        metrics.inc("llm_input_tokens_total", input_tokens)
+        metrics.inc("llm_output_tokens_total", output_tokens)
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any):
+        started = self._runs.pop(run_id, None)
+        metrics.inc("llm_errors_total")
+        if started is not None:
+            start, t0, parent, _ = started
+            metrics.record_span("llm.call", start, time.perf_counter() - t0, parent,
+                                error=f"{type(error).__name__}: {error}")
@@ -1,9 +1,27 @@
-import os, uuid, shutil
+import os, re, uuid, shutil, hashlib
+from bisect import bisect_right
 from pathlib import Path
-from typing import Iterable, Union, List
-from langchain_community.document_loaders import PyPDFLoader
+from typing import Iterable, Union, List, Optional, Tuple
+from langchain_community.document_loaders import PyPDFLoader, PyMuPDFLoader
 from langchain.schema import Document  # or from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter, TokenTextSplitter
 from streamlit.runtime.uploaded_file_manager import UploadedFile
+import metrics
+
+
+# PDF parser: "pymupdf" (fast, C-backed) or "pypdf"
+PDF_LOADER = os.getenv("STUDY_PDF_LOADER", "pymupdf")
+_LOADERS = {"pypdf": PyPDFLoader, "pymupdf": PyMuPDFLoader}
+
+# --- Chunking config ---
+# chunk_size is in characters for "recursive"/"heading" and in tokens for "token"
+CHUNK_STRATEGY = os.getenv("STUDY_CHUNK_STRATEGY", "recursive")
+CHUNK_SIZE = int(os.getenv("STUDY_CHUNK_SIZE", "0")) or None
+CHUNK_OVERLAP = int(os.getenv("STUDY_CHUNK_OVERLAP", "-1"))
+if CHUNK_OVERLAP < 0:
+    CHUNK_OVERLAP = None
+
+_DEFAULT_SIZES = {"recursive": (1200, 150), "heading": (1200, 150), "token": (300, 40)}
 
 
 # Detect if it's a Streamlit UploadedFile (avoid strict import here)
@@ -21,38 +39,236 @@ def _save_uploaded_to_temp(uploaded_file) -> Path:
         f.write(uploaded_file.getvalue())
     return tmp_path
 
-def process_pdf(input_obj: Union[str, os.PathLike, "UploadedFile"]) -> List[Document]:
+def resolve_input(input_obj: Union[str, os.PathLike, "UploadedFile"]) -> Tuple[Path, str]:
+    """Return (on-disk PDF path, display name), saving uploads to tmp_uploads/ first."""
+    if _is_uploaded_file(input_obj):
+        return _save_uploaded_to_temp(input_obj), Path(input_obj.name).name
+    pdf_path = Path(input_obj)
+    if not pdf_path.exists():
+        raise FileNotFoundError(f"PDF not found: {pdf_path}")
+    return pdf_path, pdf_path.name
+
+def load_pages(pdf_path: Union[str, os.PathLike], display_name: Optional[str] = None,
+               loader: Optional[str] = None) -> List[Document]:
+    """Parse a PDF into one Document per page with normalized metadata."""
+    loader = (loader or PDF_LOADER).lower()
+    if loader not in _LOADERS:
+        raise ValueError(f"Unknown PDF loader: {loader!r} (use one of {sorted(_LOADERS)})")
+    pages = _LOADERS[loader](str(pdf_path)).load()
+
+    # Normalize metadata
+    for doc in pages:
+        doc.metadata = dict(doc.metadata or {})
+        doc.metadata["path"] = str(pdf_path)                              # actual on-disk path used
+        doc.metadata["source"] = display_name or Path(pdf_path).name      # nice display name for UI
+    return pages
+
+def process_pdf(
+    input_obj: Union[str, os.PathLike, "UploadedFile"],
+    strategy: Optional[str] = None,
+    chunk_size: Optional[int] = None,
+    chunk_overlap: Optional[int] = None,
+    loader: Optional[str] = None,
+) -> List[Document]:
     """
     Accepts either:
       - str/path: path to an existing PDF on disk
       - Streamlit UploadedFile
-    Returns: list[Document] with metadata['source'] (display name) and metadata['path'] (actual path)
+    Returns: list[Document] chunks (see split_documents) with metadata['source']
+    (display name) and metadata['path'] (actual path).
+    Pass strategy="none" to get whole pages.
     """
-    # Resolve source path & display name
-    if _is_uploaded_file(input_obj):
-        display_name = Path(input_obj.name).name
-        pdf_path = _save_uploaded_to_temp(input_obj)
-    else:
-        pdf_path = Path(input_obj)
-        if not pdf_path.exists():
-            raise FileNotFoundError(f"PDF not found: {pdf_path}")
-        display_name = pdf_path.name
-
-    # Load pages
-    loader = PyPDFLoader(str(pdf_path))
-    pages = loader.load()
+    pdf_path, display_name = resolve_input(input_obj)
+    with metrics.span("ingest.parse", file=display_name) as sp:
+        pages = load_pages(pdf_path, display_name, loader)
+        sp.set(pages=len(pages))
+    with metrics.span("ingest.chunk", file=display_name) as sp:
+        chunks = split_documents(pages, strategy, chunk_size, chunk_overlap)
+        sp.set(chunks=len(chunks))
+    return chunks
 
-    # Normalize metadata
+# --- Chunking ---
+# only the keyword is case-insensitive: the numbered and ALL-CAPS forms rely
+# on capitals to tell a heading from an ordinary line of prose
+_HEADING_RE = re.compile(
+    r"^(?:(?i:chapter|section|part|unit)\s+(?:\d[\d.]*|[IVXLCDM]+)\b[^\n]{0,80}"   # Chapter 3 / SECTION 2.1 / Part IV
+    r"|\d+(?:\.\d+)*\.?\s+[A-Z][^\n]{2,80}"                            # 3.2 Cardiac Cycle
+    r"|[A-Z][A-Z0-9 ,&\-:()]{3,80})$",                                  # CARDIAC CYCLE
+    re.MULTILINE,
+)
+_MIN_SECTION_CHARS = 200
+_MIN_CHUNK_CHARS = 80
+
+
+def chunking_signature(strategy: Optional[str] = None, chunk_size: Optional[int] = None,
+                       chunk_overlap: Optional[int] = None, loader: Optional[str] = None) -> str:
+    """Identifies the parse + chunking config, so indexes built with another config can be detected."""
+    strategy, size, overlap = _resolve(strategy, chunk_size, chunk_overlap)
+    return f"{(loader or PDF_LOADER).lower()}/{strategy}:{size}:{overlap}"
+
+
+def _resolve(strategy, chunk_size, chunk_overlap) -> Tuple[str, int, int]:
+    strategy = (strategy or CHUNK_STRATEGY).lower()
+    if strategy == "none":
+        return strategy, 0, 0
+    if strategy not in _DEFAULT_SIZES:
+        raise ValueError(f"Unknown chunk strategy: {strategy!r} (use one of {sorted(_DEFAULT_SIZES)} or 'none')")
+    default_size, default_overlap = _DEFAULT_SIZES[strategy]
+    size = chunk_size or CHUNK_SIZE or default_size
+    overlap = chunk_overlap if chunk_overlap is not None else CHUNK_OVERLAP
+    overlap = default_overlap if overlap is None else overlap
+    return strategy, size, min(overlap, size // 2)
+
+
+def _locate(text: str, pieces: List[str], overlap: int) -> List[Tuple[int, str]]:
+    # Map each split back to its start offset in `text` (splitters drop offsets).
+    # Each piece starts strictly after the previous one, so a repeated passage
+    # (running headers, boilerplate) never maps back onto an earlier copy.
+    out, cursor, prev = [], 0, -1
+    for piece in pieces:
+        pos = text.find(piece, max(prev + 1, cursor - overlap - len(piece)))
+        if pos < 0:
+            pos = max(cursor, prev + 1)
+        out.append((pos, piece))
+        cursor, prev = pos + len(piece), pos
+    return out
+
+
+def _split_recursive(text: str, size: int, overlap: int) -> List[Tuple[int, str, dict]]:
+    splitter = RecursiveCharacterTextSplitter(chunk_size=size, chunk_overlap=overlap)
+    return [(pos, piece, {}) for pos, piece in _locate(text, splitter.split_text(text), overlap)]
+
+
+def _split_token(text: str, size: int, overlap: int) -> List[Tuple[int, str, dict]]:
+    splitter = TokenTextSplitter(encoding_name="cl100k_base", chunk_size=size, chunk_overlap=overlap)
+    # token overlap is measured in tokens; allow a generous char window when locating
+    return [(pos, piece, {}) for pos, piece in _locate(text, splitter.split_text(text), overlap * 8)]
+
+
+def _split_heading(text: str, size: int, overlap: int) -> List[Tuple[int, str, dict]]:
+    starts = [m.start() for m in _HEADING_RE.finditer(text)]
+    if not starts or starts[0] != 0:
+        starts.insert(0, 0)
+    bounds = list(zip(starts, starts[1:] + [len(text)]))
+
+    # fold tiny sections (stray headings, running headers) into the next one
+    sections, pending = [], None
+    for beg, end in bounds:
+        beg = pending if pending is not None else beg
+        if end - beg < _MIN_SECTION_CHARS and end != len(text):
+            pending = beg
+            continue
+        pending = None
+        sections.append((beg, end))
+
+    out = []
+    for beg, end in sections:
+        body = text[beg:end]
+        title = body.strip().split("\n", 1)[0][:120]
+        pieces = [(0, body, {})] if len(body) <= size else _split_recursive(body, size, overlap)
+        for pos, piece, _ in pieces:
+            if piece.strip():
+                out.append((beg + pos, piece.strip(), {"section": title}))
+    return out
+
+
+_SPLITTERS = {
+    "recursive": _split_recursive,
+    "token": _split_token,
+    "heading": _split_heading,
+}
+
+
+def _merge_small(text: str, pieces: List[Tuple[int, str, dict]]) -> List[Tuple[int, str, dict]]:
+    # Glue fragments such as a lone heading line onto the following chunk
+    out, carry = [], None
+    for start, piece, extra in pieces:
+        if carry is not None and carry < start:
+            piece = text[carry:start + len(piece)].strip()
+            start = carry
+        carry = None
+        if len(piece) < _MIN_CHUNK_CHARS:
+            carry = start
+            continue
+        out.append((start, piece, extra))
+    if carry is not None:
+        if out:
+            start, _, extra = out[-1]
+            out[-1] = (start, text[start:].strip(), extra)
+        else:
+            out.append((carry, text[carry:].strip(), {}))
+    return [p for p in out if p[1]]
+
+
+def _chunk_id(source: str, index: int, start: int, text: str) -> str:
+    h = hashlib.sha1(f"{source}\0{index}\0{start}\0{text}".encode("utf-8"))
+    return h.hexdigest()[:20]
+
+
+def split_documents(
+    pages: List[Document],
+    strategy: Optional[str] = None,
+    chunk_size: Optional[int] = None,
+    chunk_overlap: Optional[int] = None,
+) -> List[Document]:
+    """
+    Split loader pages into chunks (PyMuPDF by default). Pages of the same file are joined
+    first, so chunks can span page breaks; each chunk records page_start /
+    page_end (and 'page' = page_start for existing display code), its
+    start_index in the joined text, and a stable chunk_id derived from the
+    source, ordinal, offset and text (unique within a file).
+    """
+    strategy, size, overlap = _resolve(strategy, chunk_size, chunk_overlap)
+    if strategy == "none":
+        return pages
+
+    # group pages by file, keeping order
+    by_path = {}
     for doc in pages:
-        doc.metadata = dict(doc.metadata or {})
-        doc.metadata.setdefault("path", str(pdf_path))      # actual on-disk path used
-        doc.metadata.setdefault("source", display_name)     # nice display name for UI
+        by_path.setdefault(doc.metadata.get("path") or doc.metadata.get("source"), []).append(doc)
 
-    return pages
+    chunks: List[Document] = []
+    split = _SPLITTERS[strategy]
+    for group in by_path.values():
+        page_starts, parts, offset = [], [], 0
+        for doc in group:
+            page_starts.append(offset)
+            parts.append(doc.page_content)
+            offset += len(doc.page_content) + 2
+        text = "\n\n".join(parts)
+        base_meta = {k: v for k, v in group[0].metadata.items() if k not in ("page", "page_label")}
+        source = str(base_meta.get("source", ""))
+
+        for i, (start, piece, extra) in enumerate(_merge_small(text, split(text, size, overlap))):
+            first = group[bisect_right(page_starts, start) - 1]
+            last = group[bisect_right(page_starts, start + max(len(piece) - 1, 0)) - 1]
+            meta = dict(base_meta)
+            meta.update(extra)
+            meta.update({
+                "page": first.metadata.get("page"),
+                "page_start": first.metadata.get("page"),
+                "page_end": last.metadata.get("page"),
+                "start_index": start,
+                "chunk_index": i,
+                "chunk_strategy": strategy,
+                "chunk_id": _chunk_id(source, i, start, piece),
+            })
+            chunks.append(Document(page_content=piece, metadata=meta))
+    return chunks
+
+
+def process_many(inputs: Iterable[Union[str, os.PathLike, "UploadedFile"]],
+                 workers: Optional[int] = None) -> List[Document]:
+    """
+    Process a mix of file paths and UploadedFiles, return a single list of Documents.
+    Files are parsed in parallel (see ingest.iter_ingest); files that fail to
+    parse are skipped rather than aborting the batch.
+    """
+    from ingest import iter_ingest
 
-def process_many(inputs: Iterable[Union[str, os.PathLike, "UploadedFile"]]) -> List[Document]:
-    """Process a mix of file paths and UploadedFiles, return a single list of Documents."""
+    resolved = [resolve_input(item) for item in inputs]
+    results = {r.path: r for r in iter_ingest(resolved, workers=workers)}
     all_docs: List[Document] = []
-    for item in inputs:
-        all_docs.extend(process_pdf(item))
+    for pdf_path, _ in resolved:   # keep input order
+        all_docs.extend(results[str(pdf_path)].docs)
     return all_docs
@@ -0,0 +1,227 @@
+import contextvars
+import json
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+
+# Finished spans kept in memory for the diagnostics panel
+TRACE_BUFFER = int(os.getenv("STUDY_TRACE_BUFFER", "2000"))
+# Samples kept per timing for percentiles
+TIMING_SAMPLES = int(os.getenv("STUDY_TIMING_SAMPLES", "512"))
+# When set, every finished span is also appended to this JSONL file
+TRACE_JSONL_PATH = os.getenv("STUDY_TRACE_JSONL")
+
+# Process-wide metric registry. Values live as long as the Python process,
+# so they survive Streamlit reruns and are shared by every session.
+_lock = threading.Lock()
+_gauges = {}
+_counters = {}
+_timings = {}        # name -> {"count", "sum", "samples": deque}
+_spans = deque(maxlen=TRACE_BUFFER)
+_current_span = contextvars.ContextVar("study_current_span", default=None)
+
+
+def set_gauge(name: str, value: float):
+    with _lock:
+        _gauges[name] = float(value)
+
+
+def inc(name: str, amount: float = 1):
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + amount
+
+
+def observe(name: str, value: float):
+    """Record one sample of a timing (or size) distribution."""
+    with _lock:
+        t = _timings.get(name)
+        if t is None:
+            t = _timings[name] = {"count": 0, "sum": 0.0, "samples": deque(maxlen=TIMING_SAMPLES)}
+        t["count"] += 1
+        t["sum"] += value
+        t["samples"].append(value)
+
+
+def _quantile(sorted_values, q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+def timing_summary() -> dict:
+    """{name: {count, sum, mean, p50, p95, max}} over the recent samples of each timing."""
+    with _lock:
+        items = [(name, t["count"], t["sum"], sorted(t["samples"])) for name, t in _timings.items()]
+    return {
+        name: {"count": count, "sum": total, "mean": total / count if count else 0.0,
+               "p50": _quantile(vals, 0.5), "p95": _quantile(vals, 0.95), "max": vals[-1] if vals else 0.0}
+        for name, count, total, vals in sorted(items)
+    }
+
+
+def snapshot() -> dict:
+    """Return a copy of all gauges, counters and timing summaries."""
+    with _lock:
+        out = {"gauges": dict(_gauges), "counters": dict(_counters), "ts": time.time()}
+    out["timings"] = timing_summary()
+    return out
+
+
+# --- Tracing ---
+class Span:
+    """One timed stage. Attributes (token counts, cache hits, sizes) are set while it runs."""
+
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "start", "duration", "attrs", "error")
+
+    def __init__(self, name: str, parent: "Span" = None, attrs: dict = None):
+        self.name = name
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex[:16]
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent else None
+        self.start = time.time()
+        self.duration = None
+        self.attrs = dict(attrs or {})
+        self.error = None
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+        return self
+
+    def to_dict(self) -> dict:
+        return {"trace_id": self.trace_id, "span_id": self.span_id, "parent_id": self.parent_id,
+                "name": self.name, "start": self.start, "duration": self.duration,
+                "attrs": self.attrs, "error": self.error}
+
+
+def current_span():
+    return _current_span.get()
+
+
+def _finish(span: Span):
+    observe(f"stage_{span.name}_seconds", span.duration)
+    with _lock:
+        _spans.append(span)
+    if TRACE_JSONL_PATH:
+        try:
+            with open(TRACE_JSONL_PATH, "a", encoding="utf-8") as f:
+                f.write(json.dumps(span.to_dict(), default=str) + "\n")
+        except OSError:
+            pass
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """
+    Time a stage as a child of the current span (or as a new trace).
+    The duration feeds the `stage_<name>_seconds` timing; the span itself
+    goes to the trace buffer and, if configured, the JSONL file.
+    """
+    sp = Span(name, _current_span.get(), attrs)
+    token = _current_span.set(sp)
+    t0 = time.perf_counter()
+    try:
+        yield sp
+    except BaseException as e:
+        sp.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        sp.duration = time.perf_counter() - t0
+        _current_span.reset(token)
+        _finish(sp)
+
+
+def record_span(name: str, start: float, duration: float, parent: Span = None, error: str = None,
+                **attrs) -> Span:
+    """Record a span measured elsewhere (e.g. by a callback), under `parent`."""
+    sp = Span(name, parent, attrs)
+    sp.start, sp.duration, sp.error = start, duration, error
+    _finish(sp)
+    return sp
+
+
+def traced(name: str):
+    """Decorator form of `span`."""
+    def _wrap(fn):
+        @wraps(fn)
+        def _inner(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return _inner
+    return _wrap
+
+
+def recent_spans(limit: int = 200) -> list:
+    with _lock:
+        return [s.to_dict() for s in list(_spans)[-limit:]]
+
+
+def recent_traces(limit: int = 5) -> list:
+    """The last `limit` traces as lists of spans, oldest span first."""
+    with _lock:
+        spans = list(_spans)
+    traces = {}
+    for s in spans:
+        traces.setdefault(s.trace_id, []).append(s)
+    latest = sorted(traces.values(), key=lambda ss: max(s.start for s in ss))[-limit:]
+    return [[s.to_dict() for s in sorted(ss, key=lambda s: s.start)] for ss in reversed(latest)]
+
+
+# --- Export ---
+_PROM_NAME_RE = re.compile(r"[^a-zA-Z0-9_]")
+
+
+def _prom_name(name: str) -> str:
+    return "study_" + _PROM_NAME_RE.sub("_", name)
+
+
+def to_prometheus() -> str:
+    """All metrics in the Prometheus text exposition format."""
+    snap = snapshot()
+    lines = []
+    for name, value in sorted(snap["counters"].items()):
+        n = _prom_name(name)
+        lines += [f"# TYPE {n} counter", f"{n} {value}"]
+    for name, value in sorted(snap["gauges"].items()):
+        n = _prom_name(name)
+        lines += [f"# TYPE {n} gauge", f"{n} {value}"]
+    for name, t in snap["timings"].items():
+        n = _prom_name(name)
+        lines.append(f"# TYPE {n} summary")
+        lines += [f'{n}{{quantile="0.5"}} {t["p50"]}', f'{n}{{quantile="0.95"}} {t["p95"]}']
+        lines += [f"{n}_sum {t['sum']}", f"{n}_count {t['count']}"]
+    return "\n".join(lines) + "\n"
+
+
+def spans_jsonl(limit: int = TRACE_BUFFER) -> str:
+    """Recent spans, one JSON object per line."""
+    return "".join(json.dumps(s, default=str) + "\n" for s in recent_spans(limit))
+
+
+def diagnostics(traces: int = 3) -> dict:
+    """What the app's metrics and diagnostics panels show, as plain data (also served at /diagnostics)."""
+    snap = snapshot()
+    return {"gauges": snap["gauges"], "counters": snap["counters"], "timings": snap["timings"],
+            "traces": recent_traces(traces), "prometheus": to_prometheus(), "spans_jsonl": spans_jsonl()}
+
+
+def process_rss_bytes() -> int:
+    """Resident set size of this process (0 if it cannot be determined)."""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+        # peak rather than current; KiB on Linux, bytes on macOS
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rss if sys.platform == "darwin" else rss * 1024
+    except Exception:
+        return 0
@@ -0,0 +1,153 @@
+"""
+Second retrieval stage: rescore an over-fetched candidate list and pick a
+diverse top-k with maximal marginal relevance (MMR).
+
+    STUDY_RERANKER = auto | cross-encoder | lexical | none
+
+`cross-encoder` scores (query, chunk) pairs with a small local model on CPU
+(needs sentence-transformers); `lexical` blends BM25 over the candidates
+with the first-stage hybrid score and needs nothing; `auto` uses the
+cross-encoder when it can be loaded. Rerank time is traced as its own
+`retrieve.rerank` stage.
+"""
+import math
+import os
+from collections import Counter
+from typing import Any, List, Optional, Sequence
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+import metrics
+from lexical_index import BM25Index, tokenize
+
+RERANKER = os.getenv("STUDY_RERANKER", "auto").lower()
+RERANK_MODEL = os.getenv("STUDY_RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+RERANK_CANDIDATES = int(os.getenv("STUDY_RERANK_CANDIDATES", "40"))
+# 1.0 = pure relevance, lower trades relevance for diversity
+MMR_LAMBDA = float(os.getenv("STUDY_MMR_LAMBDA", "0.7"))
+
+
+class CrossEncoderScorer:
+    """Local cross-encoder relevance model; needs `pip install sentence-transformers`."""
+
+    name = "cross-encoder"
+
+    def __init__(self, model: str = RERANK_MODEL, device: str = "cpu", batch_size: int = 32):
+        try:
+            from sentence_transformers import CrossEncoder
+        except ImportError as e:
+            raise ImportError(
+                "The cross-encoder reranker needs sentence-transformers: pip install sentence-transformers"
+            ) from e
+        self.model = model
+        self.batch_size = batch_size
+        self._model = CrossEncoder(model, device=device)
+
+    def score(self, query: str, docs: Sequence[Document]) -> List[float]:
+        pairs = [(query, d.page_content) for d in docs]
+        return [float(s) for s in self._model.predict(pairs, batch_size=self.batch_size)]
+
+
+class LexicalScorer:
+    """BM25 over the candidate set, averaged with the first-stage hybrid score (both min-max scaled)."""
+
+    name = "lexical"
+
+    def score(self, query: str, docs: Sequence[Document]) -> List[float]:
+        index = BM25Index()
+        index.add((str(i), d.page_content) for i, d in enumerate(docs))
+        bm25 = dict(index.search(query, k=len(docs)))
+        lexical = _scale([bm25.get(str(i), 0.0) for i in range(len(docs))])
+        first = _scale([d.metadata.get("hybrid_score", 0.0) for d in docs])
+        return [(a + b) / 2 for a, b in zip(lexical, first)]
+
+
+def make_reranker(name: Optional[str] = None):
+    """Scorer for `name` (STUDY_RERANKER by default); None when reranking is off."""
+    name = (name or RERANKER).lower()
+    if name == "none":
+        return None
+    if name == "lexical":
+        return LexicalScorer()
+    if name == "cross-encoder":
+        return CrossEncoderScorer()
+    if name != "auto":
+        raise ValueError(f"Unknown reranker: {name!r} (use auto, cross-encoder, lexical or none)")
+    try:
+        return CrossEncoderScorer()
+    except Exception:
+        # not installed or the model could not be fetched
+        return LexicalScorer()
+
+
+def _scale(values: Sequence[float]) -> List[float]:
+    lo, hi = min(values, default=0.0), max(values, default=0.0)
+    return [(v - lo) / (hi - lo) if hi > lo else 1.0 for v in values]
+
+
+def _term_vectors(docs: Sequence[Document]):
+    out = []
+    for d in docs:
+        tf = Counter(tokenize(d.page_content))
+        out.append((tf, math.sqrt(sum(v * v for v in tf.values())) or 1.0))
+    return out
+
+
+def _cosine(a, b) -> float:
+    (ta, na), (tb, nb) = a, b
+    if len(ta) > len(tb):
+        ta, tb = tb, ta
+    return sum(v * tb.get(t, 0) for t, v in ta.items()) / (na * nb)
+
+
+def mmr_select(docs: Sequence[Document], relevance: Sequence[float], k: int,
+               lambda_mult: float = MMR_LAMBDA) -> List[int]:
+    """
+    Indices of `k` docs chosen greedily by lambda * relevance - (1 - lambda) *
+    (max similarity to the docs already chosen). Similarity is cosine over
+    term counts, so no vectors need to be fetched or computed.
+    """
+    rel = _scale(relevance)
+    vectors = _term_vectors(docs)
+    chosen: List[int] = []
+    max_sim = [0.0] * len(docs)
+    remaining = set(range(len(docs)))
+    while remaining and len(chosen) < k:
+        best = max(remaining, key=lambda i: lambda_mult * rel[i] - (1 - lambda_mult) * max_sim[i])
+        chosen.append(best)
+        remaining.discard(best)
+        for i in remaining:
+            max_sim[i] = max(max_sim[i], _cosine(vectors[i], vectors[best]))
+    return chosen
+
+
+class RerankRetriever(BaseRetriever):
+    """
+    Take the candidate list from `base` (a HybridRetriever over-fetching
+    RERANK_CANDIDATES chunks, which is cheap: ANN + BM25), rescore it with
+    `scorer`, and return `k` chosen by MMR with metadata['rerank_score'].
+    Without a scorer the first-stage order is kept.
+    """
+
+    base: Any
+    scorer: Any = None
+    k: int = 8
+    lambda_mult: float = MMR_LAMBDA
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        docs = self.base.invoke(query)
+        if self.scorer is None or len(docs) <= 1:
+            return docs[: self.k]
+
+        with metrics.span("retrieve.rerank", scorer=self.scorer.name, candidates=len(docs), k=self.k) as sp:
+            scores = self.scorer.score(query, docs)
+            order = mmr_select(docs, scores, self.k, self.lambda_mult)
+            out = [Document(page_content=docs[i].page_content,
+                            metadata={**docs[i].metadata, "rerank_score": scores[i]}) for i in order]
+            # how far the chosen chunks sat down the first-stage list
+            sp.set(results=len(out), deepest_rank=max(order) + 1 if order else 0)
+        return out
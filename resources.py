@@ -0,0 +1,178 @@
+import os
+import threading
+import time
+from dotenv import load_dotenv
+from backends import make_embedding, make_llm
+from utils import index_signature
+from indexer import sync_books, load_manifest, shard_entries
+from shards import ShardGroup, ShardRouter
+from uploads import UploadManager
+from embedding_cache import CachedEmbeddings, open_embedding_cache
+from digest_store import open_digest_store
+from response_cache import SemanticResponseCache
+from hybrid import HybridRetriever
+from rerank import RERANK_CANDIDATES, RerankRetriever, make_reranker
+from llm_exec import TracingCallback
+import metrics
+from shared import BOOKS_DIR, INDEX_DIR
+
+
+load_dotenv()
+openai_key = os.getenv("OPENAI_API_KEY")
+
+# books that failed to index are retried at most this often when books/ is unchanged
+SYNC_RETRY_SECONDS = float(os.getenv("STUDY_SYNC_RETRY_SECONDS", "30"))
+
+# --- Process-wide shared clients ---
+# Streamlit re-executes app.py on every widget interaction but keeps imported
+# modules in sys.modules, so these globals are built once per process and
+# shared by every session and rerun.
+_lock = threading.RLock()
+_reranker_lock = threading.Lock()
+_sync_lock = threading.Lock()   # held for a whole sync; _lock is not, so readers are never blocked by one
+_embedding = None
+_llms = {}
+_digest_store = None
+_response_cache = None
+_libraries = {}      # index_dir -> (manifest signature, ShardRouter)
+_library_sigs = {}   # (books_dir, index_dir) -> (books/ signature at last sync, retry failed books after)
+_uploads = None
+_reranker = False    # False = not built yet; None = reranking off
+
+
+def get_embedding():
+    """
+    Shared embedding client for the configured backend (STUDY_EMBEDDING_BACKEND);
+    vectors already seen are served from the on-disk cache.
+    """
+    global _embedding
+    with _lock:
+        if _embedding is None:
+            _embedding = CachedEmbeddings(make_embedding(), open_embedding_cache())
+        return _embedding
+
+
+def get_llm(temperature: float = 0.3):
+    with _lock:
+        llm = _llms.get(temperature)
+        if llm is None:
+            llm = make_llm(temperature=temperature)
+            llm.callbacks = [TracingCallback()]
+            _llms[temperature] = llm
+        return llm
+
+
+def get_digest_store():
+    global _digest_store
+    with _lock:
+        if _digest_store is None:
+            _digest_store = open_digest_store()
+        return _digest_store
+
+
+def get_response_cache():
+    global _response_cache
+    with _lock:
+        if _response_cache is None:
+            _response_cache = SemanticResponseCache()
+        return _response_cache
+
+
+def llm_model_name(llm) -> str:
+    return str(getattr(llm, "model_name", None) or getattr(llm, "model", None) or type(llm).__name__)
+
+
+def get_library(index_dir=INDEX_DIR):
+    """
+    Return the shared ShardRouter over the per-book shards in `index_dir`.
+    Membership is re-read only when the manifest changed on disk; shards of
+    unchanged books stay loaded across syncs. The router is empty (falsy)
+    when no library has been indexed yet.
+    """
+    sig = index_signature(index_dir)
+    with _lock:
+        cached = _libraries.get(index_dir)
+        if cached and cached[0] == sig:
+            return cached[1]
+        manifest = load_manifest(index_dir)
+        router = cached[1] if cached else ShardRouter(get_embedding(), openai_key)
+        router.reconcile(shard_entries(index_dir, manifest))
+        _libraries[index_dir] = (sig, router)
+        metrics.inc("library_reloads_total")
+        return router
+
+
+def get_uploads():
+    """Process-wide manager of per-session upload indexes."""
+    global _uploads
+    with _lock:
+        if _uploads is None:
+            _uploads = UploadManager(get_embedding(), openai_key)
+        return _uploads
+
+
+def get_session_library(index_dir=INDEX_DIR, session_id=None):
+    """The shared book library plus `session_id`'s own uploads, searched as one."""
+    library = get_library(index_dir)
+    if session_id is None:
+        return library
+    return ShardGroup(library, get_uploads().session(session_id).router)
+
+
+def get_reranker():
+    """Shared second-stage scorer (STUDY_RERANKER); None when reranking is off."""
+    global _reranker
+    if _reranker is not False:
+        return _reranker
+    # the cross-encoder may be downloaded on first use; build it under its own
+    # lock so callers of the other getters are not held up meanwhile
+    with _reranker_lock:
+        if _reranker is False:
+            _reranker = make_reranker()
+        return _reranker
+
+
+def get_retriever(library, k: int = 4, shard_ids=None, rerank: bool = False):
+    """
+    Retriever used by Q&A, summaries and flashcards: dense + BM25 over the
+    selected shards (all when `shard_ids` is None), fused with RRF. With
+    rerank=True it over-fetches RERANK_CANDIDATES chunks and returns the k
+    best by the reranker, diversified with MMR.
+    """
+    if not rerank:
+        return HybridRetriever(router=library, k=k, fetch_k=max(20, 3 * k), shard_ids=shard_ids)
+    candidates = max(RERANK_CANDIDATES, k)
+    base = HybridRetriever(router=library, k=candidates, fetch_k=candidates, shard_ids=shard_ids)
+    return RerankRetriever(base=base, scorer=get_reranker(), k=k)
+
+
+def invalidate(index_dir=None):
+    with _lock:
+        if index_dir is None:
+            _libraries.clear()
+        else:
+            _libraries.pop(index_dir, None)
+
+
+def sync_library(books_dir=BOOKS_DIR, index_dir=INDEX_DIR, on_progress=None):
+    """
+    Incrementally sync `index_dir` with the PDFs in `books_dir`, but only when
+    the folder listing (names, sizes, mtimes) changed since the last sync in
+    this process, or when the last sync left books failed and
+    SYNC_RETRY_SECONDS have passed. Returns the SyncReport, or None when the
+    sync was skipped.
+    """
+    key = (books_dir, index_dir)
+    sig = index_signature(books_dir)
+    with _sync_lock:
+        last_sig, retry_at = _library_sigs.get(key, (None, None))
+        if key in _library_sigs and last_sig == sig and (retry_at is None or time.time() < retry_at):
+            return None
+        report = sync_books(books_dir, index_dir, get_embedding(), on_progress=on_progress)
+        if report.deleted_ids:
+            get_response_cache().invalidate_chunks(report.deleted_ids)
+        # a failed book stays out of the manifest, so keep retrying it until it goes in
+        _library_sigs[key] = (sig, time.time() + SYNC_RETRY_SECONDS if report.failed else None)
+        metrics.set_gauge("library_sync_seconds", report.seconds)
+        metrics.inc("library_chunks_embedded_total", report.chunks_added)
+        return report
@@ -0,0 +1,198 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Iterable, Optional, Sequence
+
+import numpy as np
+
+import metrics
+from embedding_cache import text_hash
+
+RESPONSE_CACHE_THRESHOLD = float(os.getenv("STUDY_RESPONSE_CACHE_THRESHOLD", "0.93"))
+RESPONSE_CACHE_CHUNK_OVERLAP = float(os.getenv("STUDY_RESPONSE_CACHE_CHUNK_OVERLAP", "0.8"))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("STUDY_RESPONSE_CACHE_MAX_ENTRIES", "2000"))
+RESPONSE_CACHE_TTL_HOURS = float(os.getenv("STUDY_RESPONSE_CACHE_TTL_HOURS", "24"))
+
+
+def doc_key(doc) -> str:
+    """Stable identity of a retrieved chunk (chunk_id, or a text hash for older indexes)."""
+    meta = getattr(doc, "metadata", None) or {}
+    return meta.get("chunk_id") or text_hash(doc.page_content)
+
+
+def _unit(vec: Sequence[float]) -> np.ndarray:
+    v = np.asarray(vec, dtype="float32")
+    return v / (float(np.linalg.norm(v)) or 1.0)
+
+
+def _jaccard(a: frozenset, b: frozenset) -> float:
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+class SemanticResponseCache:
+    """
+    In-process cache of generated answers, summaries and decks.
+
+    A lookup hits when an entry of the same kind and generation parameters
+    has a query embedding with cosine similarity >= `threshold` and its
+    retrieved chunk IDs overlap the current ones by at least `chunk_overlap`
+    (Jaccard). Entries expire after `ttl_seconds`, are LRU-evicted beyond
+    `max_entries`, and are dropped when any of their chunks is invalidated.
+
+    Query vectors live as rows of one matrix (a slot per entry, reused after
+    a drop), so a lookup scores every entry in a single matrix-vector
+    product; only the few entries above the threshold are checked further.
+    """
+
+    def __init__(self, threshold: float = RESPONSE_CACHE_THRESHOLD,
+                 chunk_overlap: float = RESPONSE_CACHE_CHUNK_OVERLAP,
+                 max_entries: int = RESPONSE_CACHE_MAX_ENTRIES,
+                 ttl_seconds: float = RESPONSE_CACHE_TTL_HOURS * 3600):
+        self.threshold = threshold
+        self.chunk_overlap = chunk_overlap
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()    # entry id -> dict
+        self._by_chunk = {}              # chunk id -> set(entry id)
+        self._next_id = 0
+        # per slot: unit query vector, owning entry id (-1 = free), params code, creation time
+        self._vecs = None
+        self._slot_entry = np.zeros(0, dtype="int64")
+        self._slot_params = np.zeros(0, dtype="int64")
+        self._slot_created = np.zeros(0, dtype="float64")
+        self._used = 0                   # slots ever handed out
+        self._free = []
+        self._param_codes = {}           # params key -> small int
+
+    @staticmethod
+    def _params_key(kind: str, params: dict) -> str:
+        return kind + ":" + json.dumps(params or {}, sort_keys=True, default=str)
+
+    def lookup(self, kind: str, query_vec: Sequence[float], chunk_ids: Iterable[str],
+               params: Optional[dict] = None) -> Optional[Any]:
+        pkey = self._params_key(kind, params)
+        q = _unit(query_vec)
+        chunks = frozenset(chunk_ids)
+        now = time.time()
+        best_id = None
+        with self._lock:
+            n = self._used
+            code = self._param_codes.get(pkey)
+            if n and code is not None and self._vecs.shape[1] == len(q):
+                live = self._slot_entry[:n] >= 0
+                expired = live & (now - self._slot_created[:n] > self.ttl_seconds)
+                for slot in np.flatnonzero(expired):
+                    self._drop(int(self._slot_entry[slot]))
+                sims = self._vecs[:n] @ q
+                candidates = np.flatnonzero(live & ~expired & (self._slot_params[:n] == code)
+                                            & (sims >= self.threshold))
+                for slot in candidates[np.argsort(-sims[candidates], kind="stable")]:
+                    entry_id = int(self._slot_entry[slot])
+                    if _jaccard(self._entries[entry_id]["chunks"], chunks) >= self.chunk_overlap:
+                        best_id = entry_id
+                        break
+            sp = metrics.current_span()
+            if sp is not None:
+                sp.set(response_cache_hit=best_id is not None)
+            if best_id is None:
+                self.misses += 1
+                metrics.inc("response_cache_misses_total")
+                return None
+            self._entries.move_to_end(best_id)
+            self.hits += 1
+            metrics.inc("response_cache_hits_total")
+            return self._entries[best_id]["response"]
+
+    def store(self, kind: str, query_vec: Sequence[float], chunk_ids: Iterable[str],
+              params: Optional[dict], response: Any):
+        chunks = frozenset(chunk_ids)
+        vec = _unit(query_vec)
+        pkey = self._params_key(kind, params)
+        with self._lock:
+            if self._vecs is not None and self._vecs.shape[1] != len(vec):
+                # the embedding model changed; older vectors are not comparable
+                self._clear()
+            entry_id = self._next_id
+            self._next_id += 1
+            slot = self._take_slot(len(vec))
+            self._vecs[slot] = vec
+            self._slot_entry[slot] = entry_id
+            self._slot_params[slot] = self._param_codes.setdefault(pkey, len(self._param_codes))
+            self._slot_created[slot] = time.time()
+            self._entries[entry_id] = {"slot": slot, "chunks": chunks, "response": response}
+            for c in chunks:
+                self._by_chunk.setdefault(c, set()).add(entry_id)
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+
+    def _take_slot(self, dim: int) -> int:
+        # caller holds the lock
+        if self._free:
+            return self._free.pop()
+        if self._vecs is None or self._used == len(self._vecs):
+            capacity = max(64, 2 * self._used)
+            vecs = np.zeros((capacity, dim), dtype="float32")
+            if self._vecs is not None:
+                vecs[: self._used] = self._vecs[: self._used]
+            self._vecs = vecs
+            self._slot_entry = np.concatenate([self._slot_entry, np.full(capacity - len(self._slot_entry), -1)])
+            self._slot_params = np.resize(self._slot_params, capacity)
+            self._slot_created = np.resize(self._slot_created, capacity)
+        self._used += 1
+        return self._used - 1
+
+    def invalidate_chunks(self, chunk_ids: Iterable[str]) -> int:
+        """Drop every entry built from any of `chunk_ids`; returns how many were dropped."""
+        dropped = 0
+        with self._lock:
+            for c in chunk_ids:
+                for entry_id in list(self._by_chunk.get(c, ())):
+                    self._drop(entry_id)
+                    dropped += 1
+        return dropped
+
+    def clear(self):
+        with self._lock:
+            self._clear()
+
+    def _clear(self):
+        # caller holds the lock
+        self._entries.clear()
+        self._by_chunk.clear()
+        self._vecs = None
+        self._slot_entry = np.zeros(0, dtype="int64")
+        self._slot_params = np.zeros(0, dtype="int64")
+        self._slot_created = np.zeros(0, dtype="float64")
+        self._used = 0
+        self._free = []
+        self._param_codes = {}
+
+    def _drop(self, entry_id):
+        # caller holds the lock
+        entry = self._entries.pop(entry_id, None)
+        if entry is None:
+            return
+        self._slot_entry[entry["slot"]] = -1
+        self._free.append(entry["slot"])
+        for c in entry["chunks"]:
+            ids = self._by_chunk.get(c)
+            if ids is not None:
+                ids.discard(entry_id)
+                if not ids:
+                    del self._by_chunk[c]
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / lookups) if lookups else 0.0,
+        }
@@ -0,0 +1,269 @@
+"""
+HTTP service over the core study operations, for headless use and for
+running the Streamlit app as a thin client (STUDY_API_URL).
+
+    uvicorn service:app --host 0.0.0.0 --port 8000 --workers 2
+
+Each worker process loads the library once at startup and keeps it warm
+(shards are memory-mapped, so workers share the pages). At most
+STUDY_SERVICE_MAX_CONCURRENCY requests run per worker; up to
+STUDY_SERVICE_MAX_QUEUE more wait up to STUDY_SERVICE_QUEUE_TIMEOUT
+seconds for a slot, and anything beyond that gets 503 with Retry-After.
+
+With "stream": true, /qa and /summarize answer in NDJSON: a
+{"sources": [...]} line, then {"delta": "..."} lines, then {"done": true}
+(or {"error": "..."}).
+"""
+import asyncio
+import io
+import json
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import List, Optional
+
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import BaseModel
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
+
+import core
+import metrics
+from client import _report_dict
+from resources import get_library, get_session_library, get_uploads, sync_library
+from shared import BOOKS_DIR, INDEX_DIR, to_anki_tsv
+
+MAX_CONCURRENCY = int(os.getenv("STUDY_SERVICE_MAX_CONCURRENCY", "4"))
+MAX_QUEUE = int(os.getenv("STUDY_SERVICE_MAX_QUEUE", "32"))
+QUEUE_TIMEOUT = float(os.getenv("STUDY_SERVICE_QUEUE_TIMEOUT", "30"))
+SYNC_ON_START = os.getenv("STUDY_SERVICE_SYNC_ON_START", "1") == "1"
+
+
+class Admission:
+    """Bounded concurrency with a bounded, time-limited wait queue in front of it."""
+
+    def __init__(self, limit: int = MAX_CONCURRENCY, max_queue: int = MAX_QUEUE, timeout: float = QUEUE_TIMEOUT):
+        self.limit = limit
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.active = 0
+        self.waiting = 0
+        self._sem = asyncio.Semaphore(limit)
+
+    def _reject(self, reason: str):
+        metrics.inc(f"service_rejected_{reason}_total")
+        raise HTTPException(503, detail=f"Service busy ({reason}), retry shortly",
+                            headers={"Retry-After": str(max(1, int(self.timeout // 4)))})
+
+    async def acquire(self):
+        if self._sem.locked() and self.waiting >= self.max_queue:
+            self._reject("queue_full")
+        self.waiting += 1
+        metrics.set_gauge("service_queued", self.waiting)
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(self._sem.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            self._reject("queue_timeout")
+        finally:
+            self.waiting -= 1
+            metrics.set_gauge("service_queued", self.waiting)
+        metrics.observe("service_queue_wait_seconds", time.perf_counter() - start)
+        self.active += 1
+        metrics.set_gauge("service_inflight", self.active)
+
+    def release(self):
+        self.active -= 1
+        metrics.set_gauge("service_inflight", self.active)
+        self._sem.release()
+
+
+admission = Admission()
+
+
+def _warm():
+    if SYNC_ON_START:
+        sync_library(BOOKS_DIR, INDEX_DIR)
+    get_library(INDEX_DIR).preload()
+
+
+@asynccontextmanager
+async def lifespan(app):
+    await run_in_threadpool(_warm)
+    yield
+
+
+app = FastAPI(title="Student Study Agent", lifespan=lifespan)
+
+
+# --- Request bodies ---
+class Scoped(BaseModel):
+    books: Optional[List[str]] = None     # shard ids from /books; all when omitted
+    session_id: Optional[str] = None      # adds that session's uploads to the search
+    stream: bool = False
+
+
+class QARequest(Scoped):
+    question: str
+    k: int = 4
+
+
+class SummarizeRequest(Scoped):
+    topic: str
+    top_k: int = 8
+    target_words: int = 1200
+    reader_level: str = "Intermediate"
+    include_aids: bool = True
+
+
+class FlashcardRequest(Scoped):
+    topic: str
+    top_k: int = 8
+    num_cards: int = 10
+    format: str = "json"                  # json | tsv
+
+
+# --- Helpers ---
+async def _library(session_id: Optional[str]):
+    # resolving may load shards or wait on resources' lock; keep it off the event loop
+    library = await run_in_threadpool(get_session_library, INDEX_DIR, session_id)
+    if not library:
+        raise HTTPException(404, detail="No books indexed yet")
+    return library
+
+
+async def _run(fn, *args, **kwargs):
+    """Run blocking core work in the threadpool under an admission slot."""
+    await admission.acquire()
+    try:
+        return await run_in_threadpool(fn, *args, **kwargs)
+    finally:
+        admission.release()
+
+
+def _ndjson(event: dict) -> str:
+    return json.dumps(event) + "\n"
+
+
+class SlotStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse that gives back its admission slot however sending
+    ends: after the last chunk, on an error, or when the client is gone
+    before the body generator has even started (its `finally` never runs then).
+    """
+
+    def __init__(self, content, release, **kwargs):
+        super().__init__(content, **kwargs)
+        self._release = release
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self._release()
+
+
+async def _stream(fn, *args, **kwargs) -> StreamingResponse:
+    # the admission slot is held until the last token has been sent (or the client went away)
+    await admission.acquire()
+    released = False
+
+    def release():
+        nonlocal released
+        if not released:
+            released = True
+            admission.release()
+
+    try:
+        result, docs = await run_in_threadpool(fn, *args, stream=True, **kwargs)
+    except BaseException:
+        release()
+        raise
+
+    async def events():
+        try:
+            yield _ndjson({"sources": core.source_labels(docs)})
+            pieces = [result] if isinstance(result, str) else result
+            async for piece in iterate_in_threadpool(iter(pieces)):
+                yield _ndjson({"delta": piece})
+            yield _ndjson({"done": True})
+        except Exception as e:
+            metrics.inc("service_stream_errors_total")
+            yield _ndjson({"error": str(e)})
+        finally:
+            release()
+
+    return SlotStreamingResponse(events(), release, media_type="application/x-ndjson")
+
+
+# --- Endpoints ---
+@app.get("/health")
+async def health():
+    library = await run_in_threadpool(get_library, INDEX_DIR)
+    return {"status": "ok", "books": len(library), "inflight": admission.active,
+            "queued": admission.waiting, "max_concurrency": admission.limit}
+
+
+@app.get("/books")
+async def books(session_id: Optional[str] = None):
+    library = await run_in_threadpool(get_session_library, INDEX_DIR, session_id)
+    return {"books": library.shard_names()}
+
+
+@app.post("/sync")
+async def sync():
+    report = await _run(sync_library, BOOKS_DIR, INDEX_DIR)
+    return _report_dict(report)   # null when books/ is unchanged since the last sync
+
+
+@app.post("/uploads")
+async def upload(request: Request, session_id: str, name: str = "upload.pdf"):
+    buf = io.BytesIO(await request.body())
+    buf.name = name
+    try:
+        return await _run(lambda: get_uploads().add_upload(session_id, buf))
+    except ValueError as e:
+        raise HTTPException(422, detail=str(e))
+
+
+@app.get("/uploads")
+async def upload_stats(session_id: str):
+    return await run_in_threadpool(lambda: get_uploads().session_stats(session_id))
+
+
+@app.post("/qa")
+async def qa(req: QARequest):
+    library = await _library(req.session_id)
+    if req.stream:
+        return await _stream(core.answer_question, library, req.question, scope=req.books, k=req.k)
+    answer, docs = await _run(core.answer_question, library, req.question, scope=req.books, k=req.k)
+    return {"answer": answer, "sources": core.source_labels(docs)}
+
+
+@app.post("/summarize")
+async def summarize(req: SummarizeRequest):
+    library = await _library(req.session_id)
+    args = (core.summarize, library, req.topic, req.top_k, req.target_words, req.reader_level, req.include_aids)
+    if req.stream:
+        return await _stream(*args, scope=req.books)
+    summary, docs = await _run(*args, scope=req.books)
+    return {"summary": summary, "sources": core.source_labels(docs)}
+
+
+@app.post("/flashcards")
+async def flashcards(req: FlashcardRequest):
+    library = await _library(req.session_id)
+    cards = await _run(core.generate_cards, library, req.topic, req.top_k, req.num_cards, scope=req.books)
+    if req.format == "tsv":
+        return PlainTextResponse(to_anki_tsv(cards), media_type="text/tab-separated-values")
+    return {"cards": cards}
+
+
+@app.get("/metrics")
+async def prometheus():
+    return PlainTextResponse(metrics.to_prometheus(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/diagnostics")
+async def diagnostics():
+    return metrics.diagnostics()
@@ -0,0 +1,286 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from langchain_community.vectorstores.utils import DistanceStrategy
+from langchain_core.documents import Document
+
+import metrics
+from docstore import SqliteDocstore
+from lexical_index import BM25Index
+from utils import load_faiss_index
+
+SHARDS_DIR = "shards"
+# 0 = keep every shard that has been searched loaded
+MAX_LOADED_SHARDS = int(os.getenv("STUDY_MAX_LOADED_SHARDS", "0"))
+SHARD_SEARCH_THREADS = int(os.getenv("STUDY_SHARD_SEARCH_THREADS", "8"))
+
+
+class Shard:
+    """One book's (or upload's) FAISS store + BM25 index, loaded on first use."""
+
+    def __init__(self, shard_id: str, path: str, name: str, chunks: int = 0):
+        self.shard_id = shard_id
+        self.path = path
+        self.name = name
+        self.chunks = chunks
+        self.vectorstore = None
+        self.lexical = None
+        self.load_seconds = 0.0
+        self.text_bytes = 0         # chunk text, whether resident or not
+        self.docstore_bytes = 0     # chunk text held in memory (pickled docstores only)
+
+    @property
+    def loaded(self) -> bool:
+        return self.vectorstore is not None
+
+    def load(self, embedding, openai_key=None):
+        start = time.perf_counter()
+        with metrics.span("index.load", shard=self.shard_id) as sp:
+            self.vectorstore = load_faiss_index(openai_key, self.path, embedding=embedding, serving=True)
+            self.lexical = BM25Index.load(self.path) or BM25Index.from_vectorstore(self.vectorstore)
+            docstore = self.vectorstore.docstore
+            if isinstance(docstore, SqliteDocstore):
+                self.text_bytes, self.docstore_bytes = docstore.text_bytes, 0
+            else:
+                docs = getattr(docstore, "_dict", {}).values()
+                self.text_bytes = self.docstore_bytes = sum(len(d.page_content.encode("utf-8")) for d in docs)
+            sp.set(vectors=self.vectorstore.index.ntotal)
+        self.load_seconds = time.perf_counter() - start
+
+    def unload(self):
+        self.vectorstore = None
+        self.lexical = None
+        self.text_bytes = self.docstore_bytes = 0
+
+    def vector_bytes(self) -> int:
+        index = getattr(self.vectorstore, "index", None)
+        return index.ntotal * index.d * 4 if index is not None else 0
+
+    def memory_bytes(self) -> int:
+        """Rough resident size: vectors, BM25 postings (of the order of the text) and any in-memory chunk text."""
+        return self.vector_bytes() + self.text_bytes + self.docstore_bytes
+
+
+class ShardRouter:
+    """
+    Routes searches to a subset of per-document shards and merges their
+    top-k. Shards load lazily on first search and, with `max_loaded`, the
+    least recently searched ones are unloaded. Dense results are merged on
+    the raw FAISS distance (all shards share one embedding model); lexical
+    results on each shard's BM25 score.
+    """
+
+    def __init__(self, embedding, openai_key=None, max_loaded: int = MAX_LOADED_SHARDS):
+        self.embedding = embedding
+        self.openai_key = openai_key
+        self.max_loaded = max_loaded
+        self._lock = threading.RLock()
+        self._shards: "OrderedDict[str, Shard]" = OrderedDict()   # LRU order of use
+
+    # --- membership ---
+    def add_shard(self, shard_id: str, path: str, name: str, chunks: int = 0):
+        with self._lock:
+            current = self._shards.get(shard_id)
+            if current is None or current.path != path:
+                self._shards[shard_id] = Shard(shard_id, path, name, chunks)
+            else:
+                current.name, current.chunks = name, chunks
+
+    def remove_shard(self, shard_id: str):
+        with self._lock:
+            self._shards.pop(shard_id, None)
+
+    def reconcile(self, entries: Dict[str, Tuple[str, str, int]]):
+        """Make membership match {shard_id: (path, name, chunks)}; unchanged shards stay loaded."""
+        with self._lock:
+            for shard_id in [s for s in self._shards if s not in entries]:
+                self.remove_shard(shard_id)
+            for shard_id, (path, name, chunks) in entries.items():
+                self.add_shard(shard_id, path, name, chunks)
+
+    def shard_names(self) -> Dict[str, str]:
+        with self._lock:
+            return {s.shard_id: s.name for s in self._shards.values()}
+
+    def __len__(self):
+        return len(self._shards)
+
+    def __bool__(self):
+        # an empty router is still a valid object, but "no material" for the UI
+        return len(self._shards) > 0
+
+    # --- loading ---
+    def _resolve(self, shard_ids: Optional[Iterable[str]]) -> List[Tuple[object, BM25Index]]:
+        """
+        Load the wanted shards and return their (vectorstore, lexical) pairs.
+        The pairs are captured under the lock, so a concurrent eviction that
+        unloads a shard does not pull them out from under a running search.
+        """
+        with self._lock:
+            wanted = list(self._shards) if shard_ids is None else [s for s in shard_ids if s in self._shards]
+            shards = []
+            for shard_id in wanted:
+                shard = self._shards[shard_id]
+                if not shard.loaded:
+                    try:
+                        shard.load(self.embedding, self.openai_key)
+                    except Exception:
+                        # e.g. shard deleted by a concurrent sync; skip it
+                        metrics.inc("shard_load_errors_total")
+                        continue
+                    metrics.inc("shard_loads_total")
+                    metrics.set_gauge("shard_last_load_seconds", shard.load_seconds)
+                self._shards.move_to_end(shard_id)
+                shards.append(shard)
+            self._evict(keep={s.shard_id for s in shards})
+            self._record_metrics()
+            return [(s.vectorstore, s.lexical) for s in shards]
+
+    def _evict(self, keep):
+        if not self.max_loaded:
+            return
+        loaded = [s for s in self._shards.values() if s.loaded]
+        for shard in loaded[: max(0, len(loaded) - self.max_loaded)]:
+            if shard.shard_id not in keep:
+                shard.unload()
+
+    def preload(self, shard_ids: Optional[Iterable[str]] = None) -> int:
+        """Load shards ahead of the first search; returns how many are loaded."""
+        return len(self._resolve(shard_ids))
+
+    def unload(self, shard_id: Optional[str] = None):
+        with self._lock:
+            for shard in self._shards.values():
+                if shard_id is None or shard.shard_id == shard_id:
+                    shard.unload()
+            self._record_metrics()
+
+    def _record_metrics(self):
+        loaded = [s for s in self._shards.values() if s.loaded]
+        metrics.set_gauge("shards_total", len(self._shards))
+        metrics.set_gauge("shards_loaded", len(loaded))
+        metrics.set_gauge("vectorstore_vectors", sum(s.vectorstore.index.ntotal for s in loaded))
+        metrics.set_gauge("vectorstore_vector_bytes", sum(s.vector_bytes() for s in loaded))
+        metrics.set_gauge("process_rss_bytes", metrics.process_rss_bytes())
+
+    def memory_bytes(self) -> int:
+        with self._lock:
+            return sum(s.memory_bytes() for s in self._shards.values())
+
+    # --- search ---
+    def _map(self, fn, shards):
+        if len(shards) <= 1:
+            return [fn(s) for s in shards]
+        with ThreadPoolExecutor(max_workers=min(SHARD_SEARCH_THREADS, len(shards))) as pool:
+            return list(pool.map(fn, shards))
+
+    def similarity_search_with_score(self, query: str, k: int = 4,
+                                     shard_ids: Optional[Iterable[str]] = None) -> List[Tuple[Document, float]]:
+        with metrics.span("retrieve.dense", k=k) as sp:
+            shards = self._resolve(shard_ids)
+            if not shards:
+                return []
+            with metrics.span("embed.query"):
+                vector = self.embedding.embed_query(query)
+            per_shard = self._map(
+                lambda pair: pair[0].similarity_search_with_score_by_vector(vector, k=k), shards
+            )
+            merged = [pair for results in per_shard for pair in results]
+            lower_is_better = shards[0][0].distance_strategy == DistanceStrategy.EUCLIDEAN_DISTANCE
+            merged.sort(key=lambda pair: pair[1], reverse=not lower_is_better)
+            sp.set(shards=len(shards))
+            return merged[:k]
+
+    def lower_is_better(self) -> bool:
+        """Whether dense scores are distances (L2, the FAISS default) rather than similarities."""
+        with self._lock:
+            for shard in self._shards.values():
+                if shard.loaded:
+                    return shard.vectorstore.distance_strategy == DistanceStrategy.EUCLIDEAN_DISTANCE
+        return True
+
+    def similarity_search(self, query: str, k: int = 4, shard_ids: Optional[Iterable[str]] = None) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, shard_ids)]
+
+    def lexical_search(self, query: str, k: int = 10,
+                       shard_ids: Optional[Iterable[str]] = None) -> List[Tuple[Document, float]]:
+        shards = self._resolve(shard_ids)
+
+        def _search(pair):
+            vectorstore, lexical = pair
+            hits = lexical.search(query, k=k)
+            docstore = vectorstore.docstore
+            if isinstance(docstore, SqliteDocstore):
+                docs = docstore.mget(doc_id for doc_id, _ in hits)
+            else:
+                docs = [docstore.search(doc_id) for doc_id, _ in hits]
+            return [(doc, score) for doc, (_, score) in zip(docs, hits) if isinstance(doc, Document)]
+
+        with metrics.span("retrieve.lexical", k=k, shards=len(shards)):
+            merged = [pair for results in self._map(_search, shards) for pair in results]
+            merged.sort(key=lambda pair: pair[1], reverse=True)
+            return merged[:k]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                s.shard_id: {"name": s.name, "chunks": s.chunks, "loaded": s.loaded,
+                             "vector_bytes": s.vector_bytes(), "memory_bytes": s.memory_bytes()}
+                for s in self._shards.values()
+            }
+
+
+class ShardGroup:
+    """
+    Searches several routers as one library, e.g. the shared books plus one
+    session's uploads. Shard IDs must be unique across the routers; a scope
+    is split per router and routers with nothing in scope are skipped.
+    """
+
+    def __init__(self, *routers: ShardRouter):
+        self.routers = [r for r in routers if r is not None]
+
+    def _scoped(self, shard_ids):
+        for router in self.routers:
+            if shard_ids is None:
+                yield router, None
+                continue
+            ids = [s for s in shard_ids if s in router.shard_names()]
+            if ids:
+                yield router, ids
+
+    def shard_names(self) -> Dict[str, str]:
+        names = {}
+        for router in self.routers:
+            names.update(router.shard_names())
+        return names
+
+    def __len__(self):
+        return sum(len(r) for r in self.routers)
+
+    def __bool__(self):
+        return any(self.routers)
+
+    def similarity_search_with_score(self, query: str, k: int = 4,
+                                     shard_ids: Optional[Iterable[str]] = None) -> List[Tuple[Document, float]]:
+        merged, lower_is_better = [], True
+        for router, ids in self._scoped(shard_ids):
+            merged.extend(router.similarity_search_with_score(query, k, ids))
+            lower_is_better = router.lower_is_better()
+        merged.sort(key=lambda pair: pair[1], reverse=not lower_is_better)
+        return merged[:k]
+
+    def similarity_search(self, query: str, k: int = 4, shard_ids: Optional[Iterable[str]] = None) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, shard_ids)]
+
+    def lexical_search(self, query: str, k: int = 10,
+                       shard_ids: Optional[Iterable[str]] = None) -> List[Tuple[Document, float]]:
+        merged = []
+        for router, ids in self._scoped(shard_ids):
+            merged.extend(router.lexical_search(query, k, ids))
+        merged.sort(key=lambda pair: pair[1], reverse=True)
+        return merged[:k]
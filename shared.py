@@ -0,0 +1,24 @@
+"""
+Settings and helpers used by both the Streamlit UI and the core/service
+side. Importing this pulls in no index, embedding or LLM code, so the UI
+stays light when it runs as a thin client of the HTTP service.
+"""
+import io
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+BOOKS_DIR = os.getenv("STUDY_BOOKS_DIR", "books")          # permanent PDFs
+INDEX_DIR = os.getenv("STUDY_INDEX_DIR", "faiss_index")    # per-book shards + manifest
+
+
+def to_anki_tsv(cards):
+    # Question<TAB>Answer format
+    buf = io.StringIO()
+    for c in cards:
+        q = c["question"].replace("\n", " ").strip()
+        a = c["answer"].strip()
+        buf.write(f"{q}\t{a}\n")
+    return buf.getvalue()
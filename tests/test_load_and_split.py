@@ -0,0 +1,36 @@
+from langchain_core.documents import Document
+
+from load_and_split import _HEADING_RE, split_documents
+
+
+def _is_heading(line: str) -> bool:
+    return _HEADING_RE.fullmatch(line) is not None
+
+
+def test_headings_are_recognized():
+    for line in ("Chapter 3 The Heart", "SECTION 2.1", "Part IV", "3.2 Cardiac Cycle", "CARDIAC CYCLE"):
+        assert _is_heading(line), line
+
+
+def test_ordinary_sentences_are_not_headings():
+    for line in ("it pumps blood", "the heart has four chambers", "part of the wall thickens",
+                 "3 valves close in turn", "section by section"):
+        assert not _is_heading(line), line
+
+
+def test_heading_strategy_keeps_prose_in_one_section():
+    prose = "\n".join(["the atria contract first", "then the ventricles follow", "and blood leaves the heart"] * 8)
+    pages = [Document(page_content=f"CARDIAC CYCLE\n{prose}", metadata={"source": "b.pdf", "page": 0})]
+    chunks = split_documents(pages, "heading", 2000, 100)
+    assert len(chunks) == 1
+    assert chunks[0].metadata["section"] == "CARDIAC CYCLE"
+
+
+def test_repeated_passages_get_distinct_offsets_and_ids():
+    para = ("Boilerplate definition of the cardiac cycle repeated verbatim in every chapter. " * 3).strip()
+    pages = [Document(page_content="\n\n".join([para] * 4), metadata={"source": "b.pdf", "page": p}) for p in (0, 1)]
+    chunks = split_documents(pages, "recursive", 300, 50)
+    starts = [c.metadata["start_index"] for c in chunks]
+    assert starts == sorted(set(starts))
+    assert len({c.metadata["chunk_id"] for c in chunks}) == len(chunks)
+    assert [c.metadata["page_start"] for c in chunks] == [0] * 4 + [1] * 4
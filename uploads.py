@@ -0,0 +1,189 @@
+import hashlib
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Optional
+
+import metrics
+from docstore import DOCSTORE_NAME
+from indexer import build_shard
+from load_and_split import load_pages, resolve_input, split_documents
+from shards import ShardRouter
+
+UPLOAD_DIR = "tmp_uploads"          # raw PDFs, only kept while they are being indexed
+UPLOAD_INDEX_DIR = "upload_index"   # one shard per distinct uploaded file
+UPLOAD_TTL_MINUTES = float(os.getenv("STUDY_UPLOAD_TTL_MINUTES", "60"))
+UPLOAD_SWEEP_SECONDS = float(os.getenv("STUDY_UPLOAD_SWEEP_SECONDS", "60"))
+
+
+def upload_hash(uploaded_file) -> str:
+    return hashlib.sha256(uploaded_file.getvalue()).hexdigest()
+
+
+def upload_shard_id(sha: str) -> str:
+    return f"upload-{sha[:16]}"
+
+
+class UploadSession:
+    """One browser session's uploads, searchable only from that session."""
+
+    def __init__(self, session_id: str, embedding, openai_key=None):
+        self.session_id = session_id
+        self.router = ShardRouter(embedding, openai_key, max_loaded=0)
+        self.last_seen = time.time()
+
+    def touch(self):
+        self.last_seen = time.time()
+
+
+class UploadManager:
+    """
+    Per-session ephemeral indexes for uploaded PDFs.
+
+    Each distinct file (by content hash) is embedded once into its own shard
+    under `index_dir`; every session that uploads the same file reuses it,
+    but only sees the uploads it made itself. Sessions idle for longer than
+    `ttl_seconds` are dropped, and shards no live session references are
+    deleted from disk once they are older than the TTL, together with any
+    stray temp PDFs.
+    """
+
+    def __init__(self, embedding, openai_key=None, index_dir: str = UPLOAD_INDEX_DIR,
+                 upload_dir: str = UPLOAD_DIR, ttl_seconds: float = UPLOAD_TTL_MINUTES * 60):
+        self.embedding = embedding
+        self.openai_key = openai_key
+        self.index_dir = index_dir
+        self.upload_dir = upload_dir
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.RLock()
+        self._build_locks: Dict[str, threading.Lock] = {}
+        self._sessions: Dict[str, UploadSession] = {}
+        self._last_sweep = 0.0
+
+    def session(self, session_id: str) -> UploadSession:
+        with self._lock:
+            sess = self._sessions.get(session_id)
+            if sess is None:
+                sess = self._sessions[session_id] = UploadSession(session_id, self.embedding, self.openai_key)
+            sess.touch()
+        self.maybe_sweep()
+        return sess
+
+    def add_upload(self, session_id: str, uploaded_file) -> dict:
+        """
+        Make `uploaded_file` searchable in `session_id`, embedding it only if no
+        shard exists for its content yet. Returns {shard_id, name, chunks, built, seconds}.
+        """
+        start = time.perf_counter()
+        sess = self.session(session_id)
+        sha = upload_hash(uploaded_file)
+        shard_id = upload_shard_id(sha)
+        name = Path(uploaded_file.name).name
+        if shard_id in sess.router.shard_names():
+            return {"shard_id": shard_id, "name": name, "chunks": 0, "built": False, "seconds": 0.0}
+
+        shard_dir = os.path.join(self.index_dir, shard_id)
+        with self._lock:
+            build_lock = self._build_locks.setdefault(shard_id, threading.Lock())
+        chunks, built = 0, False
+        with build_lock:   # two sessions uploading the same file embed it once
+            if not os.path.exists(os.path.join(shard_dir, DOCSTORE_NAME)):
+                # new content, or a shard from before docstore.sqlite: (re)build it
+                shutil.rmtree(shard_dir, ignore_errors=True)
+                pdf_path, name = resolve_input(uploaded_file)
+                try:
+                    pages = load_pages(pdf_path, name)
+                except Exception as e:
+                    # corrupt or not a PDF: the loaders raise their own error types
+                    raise ValueError(f"Could not read {name} as a PDF ({type(e).__name__})") from e
+                finally:
+                    os.remove(pdf_path)
+                docs = split_documents(pages)
+                if not docs:
+                    raise ValueError(f"No text could be extracted from {name}")
+                build_shard(docs, self.embedding, shard_dir)
+                chunks, built = len(docs), True
+                metrics.inc("upload_shards_built_total")
+            else:
+                metrics.inc("upload_dedup_hits_total")
+            os.utime(shard_dir)   # shard age counts from its last use
+        sess.router.add_shard(shard_id, shard_dir, name, chunks)
+        self._record_metrics()
+        return {"shard_id": shard_id, "name": name, "chunks": chunks, "built": built,
+                "seconds": time.perf_counter() - start}
+
+    def remove_upload(self, session_id: str, shard_id: str):
+        with self._lock:
+            sess = self._sessions.get(session_id)
+            if sess is not None:
+                sess.router.remove_shard(shard_id)
+        self._record_metrics()
+
+    # --- eviction ---
+    def maybe_sweep(self):
+        if time.time() - self._last_sweep >= UPLOAD_SWEEP_SECONDS:
+            self.sweep()
+
+    def sweep(self, now: Optional[float] = None) -> dict:
+        """Drop idle sessions, then unreferenced expired shards and stale temp files."""
+        now = now or time.time()
+        removed = {"sessions": 0, "shards": 0, "temp_files": 0}
+        with self._lock:
+            self._last_sweep = now
+            for session_id, sess in list(self._sessions.items()):
+                if now - sess.last_seen > self.ttl_seconds:
+                    sess.router.unload()
+                    del self._sessions[session_id]
+                    removed["sessions"] += 1
+            live = {sid for sess in self._sessions.values() for sid in sess.router.shard_names()}
+
+            for shard_id in _listdir(self.index_dir):
+                path = os.path.join(self.index_dir, shard_id)
+                if shard_id in live or now - os.path.getmtime(path) <= self.ttl_seconds:
+                    continue
+                shutil.rmtree(path, ignore_errors=True)
+                self._build_locks.pop(shard_id, None)
+                removed["shards"] += 1
+
+        # temp PDFs are deleted right after indexing; this catches crashed uploads
+        for name in _listdir(self.upload_dir):
+            path = os.path.join(self.upload_dir, name)
+            if os.path.isfile(path) and now - os.path.getmtime(path) > self.ttl_seconds:
+                os.remove(path)
+                removed["temp_files"] += 1
+
+        for key, value in removed.items():
+            metrics.inc(f"upload_evicted_{key}_total", value)
+        self._record_metrics()
+        return removed
+
+    # --- accounting ---
+    def session_stats(self, session_id: str) -> dict:
+        with self._lock:
+            sess = self._sessions.get(session_id)
+            if sess is None:
+                return {"uploads": 0, "memory_bytes": 0, "shards": {}}
+            return {"uploads": len(sess.router), "memory_bytes": sess.router.memory_bytes(),
+                    "idle_seconds": time.time() - sess.last_seen, "shards": sess.router.stats()}
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {sid: self.session_stats(sid) for sid in self._sessions}
+
+    def _record_metrics(self):
+        with self._lock:
+            sessions = list(self._sessions.values())
+            metrics.set_gauge("upload_sessions", len(sessions))
+            metrics.set_gauge("upload_session_shards", sum(len(s.router) for s in sessions))
+            memory = [s.router.memory_bytes() for s in sessions]
+            metrics.set_gauge("upload_memory_bytes", sum(memory))
+            metrics.set_gauge("upload_session_max_memory_bytes", max(memory, default=0))
+
+
+def _listdir(path: str):
+    try:
+        return os.listdir(path)
+    except FileNotFoundError:
+        return []
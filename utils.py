@@ -1,15 +1,78 @@
 import os
+import faiss
 from langchain_community.vectorstores import FAISS
-from langchain_openai import OpenAIEmbeddings
+from docstore import DOCSTORE_NAME, PICKLE_NAME, SqliteDocstore, write_docstore
+
+ANN_INDEX_NAME = "index.ann.faiss"
+# Memory-map index files when serving, so several app workers share one copy in the page cache
+INDEX_MMAP = os.getenv("STUDY_INDEX_MMAP", "1") == "1"
 
 def save_faiss_index(vectorstore, save_path="faiss_index"):
+    """Write index.faiss plus the chunk rows to docstore.sqlite (no pickle)."""
     os.makedirs(save_path, exist_ok=True)
-    vectorstore.save_local(save_path)
-
-def load_faiss_index(openai_key, save_path="faiss_index"):
-    embedding = OpenAIEmbeddings(openai_api_key=openai_key)
-    return FAISS.load_local(
-        save_path,
-        embeddings=embedding,
-        allow_dangerous_deserialization=True
-    )
\ No newline at end of file
+    faiss.write_index(vectorstore.index, os.path.join(save_path, "index.faiss"))
+    write_docstore(os.path.join(save_path, DOCSTORE_NAME), vectorstore.index_to_docstore_id, vectorstore.docstore)
+
+def _mmap_flags(index_path) -> int:
+    # IO_FLAG_MMAP only maps IVF inverted lists; flat and HNSW storage needs
+    # IO_FLAG_MMAP_IFC (zero-copy codes), which in turn cannot read IVF lists.
+    # IVF index files start with an "Iw.." fourcc.
+    with open(index_path, "rb") as f:
+        is_ivf = f.read(2) == b"Iw"
+    if is_ivf:
+        return faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+    return faiss.IO_FLAG_MMAP_IFC
+
+def load_faiss_index(openai_key, save_path="faiss_index", embedding=None, serving=False):
+    """
+    Load a saved FAISS store. Pass a shared embedding client to avoid building
+    a new one per load.
+
+    With serving=True the store is meant for read-only search: a tuned ANN
+    index (index.ann.faiss, see index_tools.py) is used when present, and the
+    index file is memory-mapped when STUDY_INDEX_MMAP is on; chunks are read
+    lazily from docstore.sqlite. Such a store must never be mutated
+    (add/delete); load with serving=False for that.
+
+    Only docstore.sqlite is read, never a pickle: a store that still has
+    LangChain's index.pkl raises FileNotFoundError until a sync has
+    converted it (docstore.migrate_pickle).
+    """
+    if embedding is None:
+        from backends import make_embedding
+        embedding = make_embedding()
+    sqlite_path = os.path.join(save_path, DOCSTORE_NAME)
+    if not os.path.exists(sqlite_path):
+        hint = " (run a sync to convert its index.pkl)" if os.path.exists(os.path.join(save_path, PICKLE_NAME)) else ""
+        raise FileNotFoundError(f"No {DOCSTORE_NAME} in {save_path}{hint}")
+    if not serving:
+        store = SqliteDocstore(sqlite_path)
+        try:
+            docstore, index_to_docstore_id = store.to_memory(), dict(store.id_map().items())
+        finally:
+            store.close()
+        return FAISS(embedding, faiss.read_index(os.path.join(save_path, "index.faiss")),
+                     docstore, index_to_docstore_id)
+
+    ann_path = os.path.join(save_path, ANN_INDEX_NAME)
+    index_path = ann_path if os.path.exists(ann_path) else os.path.join(save_path, "index.faiss")
+    flags = _mmap_flags(index_path) if INDEX_MMAP else 0
+    index = faiss.read_index(index_path, flags)
+    # chunks stay on disk and are fetched by ID per search
+    store = SqliteDocstore(sqlite_path)
+    return FAISS(embedding, index, store, store.id_map())
+
+def index_signature(save_path="faiss_index"):
+    """
+    Cheap fingerprint of an on-disk index: (name, size, mtime_ns) for each file.
+    Returns None when the index does not exist or is empty.
+    """
+    if not os.path.isdir(save_path):
+        return None
+    entries = []
+    for name in sorted(os.listdir(save_path)):
+        full = os.path.join(save_path, name)
+        if os.path.isfile(full):
+            st = os.stat(full)
+            entries.append((name, st.st_size, st.st_mtime_ns))
+    return tuple(entries) or None